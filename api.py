@@ -0,0 +1,284 @@
+# Bulk forecast endpoint for programmatic clients (SCADA, trading systems).
+#
+# POST /api/forecasts with a JSON body
+#     {"model": "GFS", "daysahead": 7,
+#      "outputs": ["ac_out", "dc_out"],        (optional, default all of OUTPUTS)
+#      "format": "json",                       (or "npz")
+#      "sites": [{"id": "plant-1", "latitude": 39.7423, "longitude": -105.1785,
+#                 "surface_tilt": 30, "surface_azimuth": 180, "albedo": 0.2,
+#                 "pvmanf": "SandiaMod", "pvmodel": "...",
+#                 "invmanf": "sandiainverter", "invmodel": "..."}, ...]}
+# ("id" is optional and echoed back). pvmanf must be one of MODULE_CATALOGS,
+# invmanf one of INVERTER_CATALOGS and the models entries of them. The batch
+# is served from the result cache and the sites that are not cached are
+# modelled in one vectorized fleet pass (resultcache.get_fleet_forecasts_cached);
+# no Plotly figures or Dash callbacks are involved.
+#
+# Batches of up to API_SYNC_SITES sites are answered directly. Larger ones
+# (each uncached grid cell is a remote NWP pull) run on the job queue
+# (jobs.py): the answer is 202 {"job_id", "state", "status_url"} and
+# GET /api/jobs/<job_id> answers 202 while the job is running and then the
+# response the batch would have had.
+#
+# Status codes: 400 malformed request, 422 unknown module/inverter or sites
+# that cannot be modelled, 502 the NWP pull failed, 503 the job queue is full.
+#
+# format "json" answers column oriented series on one shared time axis:
+#     {"model": "GFS", "daysahead": 7, "time": [unix seconds, ...],
+#      "sites": [{"id": "plant-1", "ac_out": [...], "pvtemp": [...],
+#                 "dc_out": {"p_mp": [...], ...}, "poa_irrad": {"poa_global": [...], ...}}]}
+# with values rounded to decimate.DECIMALS and NaN as null. format "npz" answers
+# a numpy .npz archive (np.load) of float32 (n_sites, n_times) arrays named
+# 'ac_out', 'pvtemp', 'dc_out.p_mp', 'poa_irrad.poa_global', ..., plus 'time'
+# (int64 unix seconds) and 'id'. Either is gzip encoded for clients that send
+# Accept-Encoding: gzip.
+#
+# GET /api/sam/<catalog>?q=<words>&page=0&page_size=50 pages through the
+# module/inverter names of a SAM catalog matching q (see samsearch.py), e.g.
+# /api/sam/sandiainverter?q=sma+5000 -> {"total", "page", "page_size",
+# "options": [{"label", "value"}, ...]}.
+
+import gzip
+import io
+import json
+import os
+
+import flask
+import numpy as np
+import pandas as pd
+
+import metrics
+from decimate import DECIMALS
+from fleet import SITE_COLUMNS, DC_COLUMNS, POA_COLUMNS
+from pvgeneration import FORECAST_MODELS
+from jobs import DONE, ERROR, QueueFull, job_queue
+from resultcache import get_fleet_forecasts_cached
+from samcache import get_sam_table
+from samsearch import search
+from weathercache import WeatherFetchError
+
+
+API_MAX_SITES = int(os.environ.get('API_MAX_SITES', 1000))
+# Larger batches are run as background jobs.
+API_SYNC_SITES = int(os.environ.get('API_SYNC_SITES', 25))
+API_MAX_DAYS = int(os.environ.get('API_MAX_DAYS', 21))
+# Responses smaller than this are sent uncompressed.
+API_GZIP_MIN_BYTES = 1024
+API_MAX_PAGE_SIZE = 500
+
+# Output name -> position in the get_forecasts tuple and columns (None for series).
+OUTPUTS = {
+    'poa_irrad': (0, POA_COLUMNS),
+    'pvtemp': (1, None),
+    'dc_out': (2, DC_COLUMNS),
+    'ac_out': (3, None),
+}
+FORMATS = ['json', 'npz']
+# SAM catalogs the fleet model chain takes modules (SAPM) and inverters from.
+MODULE_CATALOGS = ['SandiaMod']
+INVERTER_CATALOGS = ['sandiainverter', 'cecinverter']
+
+api = flask.Blueprint('api', __name__)
+
+
+class BadRequest(ValueError):
+    status = 400
+
+
+class UnknownEntry(BadRequest):
+    # A module or inverter that is not in its SAM catalog.
+    status = 422
+
+
+def check_sam_entries(sites):
+    # Raise UnknownEntry unless every site's module and inverter exist.
+    for manf_col, model_col, catalogs in [('pvmanf', 'pvmodel', MODULE_CATALOGS),
+                                          ('invmanf', 'invmodel', INVERTER_CATALOGS)]:
+        for manf, model in sites[[manf_col, model_col]].drop_duplicates().itertuples(index=False):
+            if manf not in catalogs:
+                raise UnknownEntry('unknown {} {!r}, expected one of {}'.format(
+                    manf_col, manf, ', '.join(catalogs)))
+            if model not in get_sam_table(manf):
+                raise UnknownEntry('unknown {} {!r} in {}'.format(model_col, model, manf))
+
+
+def parse_request(body):
+    # (sites DataFrame, ids, model, daysahead, outputs, format) of a request body.
+    if not isinstance(body, dict):
+        raise BadRequest('expected a JSON object')
+    model = body.get('model', 'GFS')
+    if model not in FORECAST_MODELS:
+        raise BadRequest('unknown model {!r}, expected one of {}'.format(model, ', '.join(FORECAST_MODELS)))
+    try:
+        daysahead = int(body.get('daysahead', 7))
+    except (TypeError, ValueError):
+        raise BadRequest('daysahead must be an integer')
+    if not 1 <= daysahead <= API_MAX_DAYS:
+        raise BadRequest('daysahead must be between 1 and {}'.format(API_MAX_DAYS))
+    outputs = body.get('outputs', list(OUTPUTS))
+    if not isinstance(outputs, list):
+        raise BadRequest('outputs must be a list')
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown:
+        raise BadRequest('unknown outputs: {}'.format(', '.join(map(str, unknown))))
+    fmt = body.get('format', 'json')
+    if fmt not in FORMATS:
+        raise BadRequest('format must be one of {}'.format(', '.join(FORMATS)))
+    sites = body.get('sites')
+    if not isinstance(sites, list) or not sites:
+        raise BadRequest('sites must be a non-empty list')
+    if len(sites) > API_MAX_SITES:
+        raise BadRequest('at most {} sites per request'.format(API_MAX_SITES))
+    for i, site in enumerate(sites):
+        missing = [col for col in SITE_COLUMNS if not isinstance(site, dict) or site.get(col) is None]
+        if missing:
+            raise BadRequest('site {} is missing {}'.format(i, ', '.join(missing)))
+        wrong = [col for col in ['pvmanf', 'pvmodel', 'invmanf', 'invmodel'] if not isinstance(site[col], str)]
+        if wrong:
+            raise BadRequest('site {}: {} must be strings'.format(i, ', '.join(wrong)))
+    ids = [site.get('id', i) for i, site in enumerate(sites)]
+    frame = pd.DataFrame([{col: site[col] for col in SITE_COLUMNS} for site in sites], columns=SITE_COLUMNS)
+    try:
+        for col in ['latitude', 'longitude', 'surface_tilt', 'surface_azimuth', 'albedo']:
+            frame[col] = frame[col].astype(float)
+    except (TypeError, ValueError):
+        raise BadRequest('latitude, longitude, surface_tilt, surface_azimuth and albedo must be numbers')
+    check_sam_entries(frame)
+    return frame, ids, model, daysahead, outputs, fmt
+
+
+def output_arrays(results, outputs, time):
+    # {name: (n_sites, n_times)} of the requested outputs, 'dc_out.p_mp' style
+    # names for table columns; every site on `time`.
+    arrays = {}
+    for name in outputs:
+        pos, columns = OUTPUTS[name]
+        tables = [result[pos] if result[pos].index.equals(time) else result[pos].reindex(time)
+                  for result in results]
+        if columns is None:
+            arrays[name] = np.stack([table.to_numpy(dtype=float) for table in tables])
+        else:
+            values = np.stack([table[columns].to_numpy(dtype=float) for table in tables])
+            for j, col in enumerate(columns):
+                arrays['{}.{}'.format(name, col)] = values[:, :, j]
+    return arrays
+
+
+def _json_values(values):
+    values = np.round(values, DECIMALS)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def encode_json(model, daysahead, time, ids, outputs, arrays):
+    sites = []
+    for i, site_id in enumerate(ids):
+        site = {'id': site_id}
+        for name in outputs:
+            if OUTPUTS[name][1] is None:
+                site[name] = _json_values(arrays[name][i])
+            else:
+                site[name] = {col: _json_values(arrays['{}.{}'.format(name, col)][i])
+                              for col in OUTPUTS[name][1]}
+        sites.append(site)
+    body = {'model': model, 'daysahead': daysahead, 'time': (time.asi8 // 10 ** 9).tolist(), 'sites': sites}
+    return json.dumps(body, separators=(',', ':')).encode(), 'application/json'
+
+
+def encode_npz(time, ids, arrays):
+    buf = io.BytesIO()
+    np.savez(buf, time=time.asi8 // 10 ** 9, id=np.asarray([str(site_id) for site_id in ids]),
+             **{name: values.astype(np.float32) for name, values in arrays.items()})
+    return buf.getvalue(), 'application/octet-stream'
+
+
+def _error_payload(message):
+    return json.dumps({'error': message}).encode(), 'application/json'
+
+
+def _response(payload, mimetype, status=200):
+    response = flask.Response(payload, status=status, mimetype=mimetype)
+    if len(payload) >= API_GZIP_MIN_BYTES and 'gzip' in flask.request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(payload, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _error(message, status):
+    return _response(*_error_payload(message), status=status)
+
+
+def forecast_payload(sites, ids, model, daysahead, outputs, fmt):
+    # (payload, mimetype, status) answering a parsed request; also run as a
+    # background job, so no request context is used.
+    try:
+        results = get_fleet_forecasts_cached(sites, model, daysahead)
+    except WeatherFetchError as e:
+        return _error_payload('could not fetch the {} forecast: {}'.format(model, e)) + (502,)
+    except (KeyError, ValueError) as e:
+        return _error_payload('could not model the sites: {}'.format(e)) + (422,)
+    metrics.count('api_sites', len(ids))
+    time = results[0][3].index
+    arrays = output_arrays(results, outputs, time)
+    if fmt == 'npz':
+        payload, mimetype = encode_npz(time, ids, arrays)
+    else:
+        payload, mimetype = encode_json(model, daysahead, time, ids, outputs, arrays)
+    return payload, mimetype, 200
+
+
+@api.route('/api/forecasts', methods=['POST'])
+@metrics.timed('api_forecasts')
+def serve_forecasts():
+    try:
+        request = parse_request(flask.request.get_json(force=True, silent=True))
+    except BadRequest as e:
+        return _error(str(e), e.status)
+    if len(request[1]) <= API_SYNC_SITES:
+        payload, mimetype, status = forecast_payload(*request)
+        return _response(payload, mimetype, status)
+    try:
+        job_id = job_queue.submit(forecast_payload, *request)
+    except QueueFull:
+        response = _error('the forecast server is busy, please try again later', 503)
+        response.headers['Retry-After'] = '30'
+        return response
+    return _job_response(job_id, job_queue.status(job_id)['state'])
+
+
+def _job_response(job_id, state):
+    url = flask.url_for('api.serve_job', job_id=job_id)
+    response = _response(json.dumps({'job_id': job_id, 'state': state, 'status_url': url}).encode(),
+                         'application/json', 202)
+    response.headers['Location'] = url
+    return response
+
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def serve_job(job_id):
+    # Result of a batch submitted by serve_forecasts.
+    status = job_queue.status(job_id)
+    if status is None:
+        return _error('unknown or expired job {!r}'.format(job_id), 404)
+    if status['state'] == ERROR:
+        return _error('the forecast job failed: {}'.format(status['error']), 500)
+    if status['state'] != DONE:
+        return _job_response(job_id, status['state'])
+    payload, mimetype, code = status['result']
+    return _response(payload, mimetype, code)
+
+
+@api.route('/api/sam/<catalog>', methods=['GET'])
+@metrics.timed('api_sam_search')
+def serve_sam_search(catalog):
+    args = flask.request.args
+    try:
+        page = int(args.get('page', 0))
+        page_size = min(int(args.get('page_size', 50)), API_MAX_PAGE_SIZE)
+    except ValueError:
+        return _error('page and page_size must be integers', 400)
+    try:
+        result = search(catalog, args.get('q', ''), page, page_size)
+    except KeyError:
+        return _error('unknown catalog {!r}'.format(catalog), 404)
+    return _response(json.dumps(result, separators=(',', ':')).encode(), 'application/json')
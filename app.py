@@ -1,16 +1,56 @@
+import startup
+
 import dash
 import dash_core_components as dcc
 import dash_table as dt
 import dash_html_components as html
-from dash.dependencies import Output, Input, State
+from dash.dependencies import Output, Input, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
-import plotly.graph_objs as go
+import flask
 import pandas as pd
 
 from pvgeneration import *
+from samcache import warm_sam_tables
+from samsearch import warm_sam_indexes, dropdown_options
+from solargeometry import register_configured_sites
+from jobs import job_queue, QueueFull, DONE, ERROR
+from resultstore import result_store, INITIAL_SITE
+import decimate
+import metrics
+from singleflight import forecast_key
+from resultcache import iter_forecasts_cached
+from ensemble import get_ensemble_forecasts
+from montecarlo import get_forecast_quantiles
+from api import api
+startup.mark('imports')
+
+# Parse the SAM databases once at boot; with `gunicorn --preload` this happens
+# in the master process and the tables are shared by the forked workers.
+warm_sam_tables('SandiaMod', 'sandiainverter', 'cecinverter')
+startup.mark('sam tables')
+# Search indexes for the model dropdowns (see samsearch.py), one per
+# manufacturer option.
+warm_sam_indexes('SandiaMod', 'sandiainverter', 'cecinverter')
+startup.mark('sam indexes')
+# Solar geometry tables of the landing page and configured sites (see solargeometry.py).
+register_configured_sites()
+startup.mark('geometry tables')
 
 app = dash.Dash(__name__)
 server = app.server
+
+
+# Stage latencies, counters and cache statistics (see metrics.py), for scraping.
+@server.route('/metrics')
+def serve_metrics():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Bulk JSON/npz forecasts for programmatic clients (see api.py).
+server.register_blueprint(api)
+
+metrics.register_gauges('jobs', lambda: {'pending': job_queue.pending()})
+metrics.register_gauges('startup_seconds', lambda: dict(startup.startup_times, boot=startup.total()))
 app.css.config.serve_locally = False
 app.css.append_css({'external_url': 'https://codepen.io/amyoshino/pen/jzXypZ.css'})
 
@@ -31,11 +71,11 @@ app.layout = html.Div([
             ], 
             className = 'row'),
         html.Div([
-            html.Div(dcc.Input(id='lon', placeholder='Longitude (Ex: 105.1785)', 
+            html.Div(dcc.Input(id='lon', placeholder='Longitude (Ex: -105.1785)', 
                     className = 'two columns')),
-            html.Div(dcc.Dropdown(id='pvmodel', options=[
-                                                                    {'label': 'Canadian_Solar_CS5P_220M___2009_', 'value': 'Canadian_Solar_CS5P_220M___2009_'}
-                                                               ], placeholder='PV Module Model: (Ex: Canadian_Solar_CS5P_220M___2009_)'), 
+            # Model options are looked up as the user types (see model_options).
+            html.Div(dcc.Dropdown(id='pvmodel', options=[], 
+                                                               placeholder='PV Module Model: (type to search, Ex: Canadian Solar CS5P)'), 
                     className = 'five columns'),
             
             ], 
@@ -44,7 +84,8 @@ app.layout = html.Div([
             html.Div(dcc.Input(id='surface_tilt', placeholder='Surface Tilt (Ex: 30)', 
                     className = 'two columns')),
             html.Div(dcc.Dropdown(id='invmanf', options=[
-                                                                    {'label': 'Sandia', 'value': 'sandiainverter'}
+                                                                    {'label': 'Sandia', 'value': 'sandiainverter'},
+                                                                    {'label': 'CEC', 'value': 'cecinverter'}
                                                                ], placeholder='Inverter Manufacturer: (Ex: Sandia)'), 
                     className = 'five columns'),
             
@@ -53,9 +94,8 @@ app.layout = html.Div([
        html.Div([
             html.Div(dcc.Input(id='surface_azimuth', placeholder='Surface Azimuth (Ex: 180)', 
                     className = 'two columns')),
-            html.Div(dcc.Dropdown(id='invmodel', options=[
-                                                                    {'label': 'ABB__MICRO_0_25_I_OUTD_US_208__208V_', 'value': 'ABB__MICRO_0_25_I_OUTD_US_208__208V_'}
-                                                               ], placeholder='Inverter Model: (Ex: ABB__MICRO_0_25_I_OUTD_US_208__208V_)'), 
+            html.Div(dcc.Dropdown(id='invmodel', options=[], 
+                                                               placeholder='Inverter Model: (type to search, Ex: ABB MICRO 0 25)'), 
                     className = 'five columns'),
             
             ], 
@@ -69,7 +109,8 @@ app.layout = html.Div([
                                                                     {'label': 'NDFD', 'value': 'NDFD'},
                                                                     {'label': 'RAP', 'value': 'RAP'},
                                                                     {'label': 'HRRR', 'value': 'HRRR'},
-                                                               ], placeholder='NWP Forecasting Model (Ex: GFS)'), 
+                                                               ], multi=True,
+                                                               placeholder='NWP Forecasting Model(s) (Ex: GFS; pick several for an ensemble)'), 
                     className = 'five columns'),
             
             ], 
@@ -80,6 +121,8 @@ app.layout = html.Div([
                #     className = 'one columns'),
                html.Div([
                     html.Button('Run/Clear Forecasts', id='run_forecasts'),
+                    dcc.Checklist(id='uncertainty', options=[{'label': ' P10/P50/P90 AC power', 'value': 'mc'}],
+                                  value=[]),
                 
                 ],className = 'two columns'),
                html.Div([
@@ -104,6 +147,20 @@ app.layout = html.Div([
        
        #html.Div([html.Button('Clear', id='clear', className='one column')], className='row'),
        html.H4(id='op1', className='row'),
+       # Forecasts run as background jobs (see jobs.py): the submitted job id
+       # is kept in 'job' and 'poll' checks on it until it has finished.
+       dcc.Store(id='job'),
+       # The last forecast's figures stay in the browser ('results'); clearing,
+       # redrawing and shorter horizons are rendered from there by the
+       # client-side callbacks in assets/results.js ('view'), which only send a
+       # 'request' to the server for new inputs or a longer horizon.
+       dcc.Store(id='results'),
+       dcc.Store(id='view'),
+       dcc.Store(id='request'),
+       dcc.Store(id='status'),
+       dcc.Interval(id='poll', interval=1000, n_intervals=0, disabled=True),
+       # Browser window width, used to cap the number of points per trace.
+       dcc.Store(id='viewport'),
        
         
         
@@ -125,57 +182,155 @@ app.layout = html.Div([
 ], id='container')
 
 
+# Columns of the 12 column grid each graph spans, to size its traces.
+GRAPH_COLUMNS = {'graph1': 7, 'graph2': 5, 'graph3': 4, 'graph4': 4, 'graph5': 4}
+
+
+@metrics.timed('forecast_figures')
+def forecast_figures(poa_irrad, pvtemp, dc_out, ac_out, viewport=None, fig5=None):
+    # Figures are decimated to the pixel width of their graph (see decimate.py).
+    # fig5 replaces the DC/AC power figure (ensemble members, quantile bands).
+    df = dc_out
+    df2 = ac_out
+    df3 = poa_irrad
+    df4 = pvtemp
+    width = lambda graph_id: decimate.graph_width(viewport, GRAPH_COLUMNS[graph_id])
+    fig1 = decimate.figure('Irradiance (Wm^-2)',
+                           [(df3.index, df3[name], name) for name in
+                            ['poa_global', 'poa_direct', 'poa_diffuse', 'poa_sky_diffuse', 'poa_ground_diffuse']],
+                           width('graph1'))
+    fig2 = decimate.figure('PV Module Temperature (degree Celcius)',
+                           [(df4.index, df4, None)], width('graph2'))
+    fig3 = decimate.figure('Open-Circuit & MPP Voltages (V)',
+                           [(df.index, df['v_oc'], 'v_oc'),
+                            (df.index, df['v_mp'], 'v_mp')], width('graph3'))
+    fig4 = decimate.figure('Short-Circuit & MPP Currents (A)',
+                           [(df.index, df['i_sc'], 'i_sc'),
+                            (df.index, df['i_mp'], 'i_mp')], width('graph4'))
+    if fig5 is None:
+        fig5 = decimate.figure('DC and AC MPP Power (W)',
+                               [(df.index, df['p_mp'], 'DC p_mp'),
+                                (df2.index, df2, 'AC p_mp')], width('graph5'))
+    return fig1, fig2, fig3, fig4, fig5
+
+
+def band_traces(index, lower, upper, name, width):
+    # Filled band between two series, decimated like the line traces.
+    lower = decimate.traces(index, lower, None, int(width))[-1]
+    upper = decimate.traces(index, upper, name, int(width))[-1]
+    lower.update(line={'width': 0}, hoverinfo='skip', showlegend=False)
+    upper.update(line={'width': 0}, fill='tonexty', opacity=0.3)
+    return [lower, upper]
+
+
+def ensemble_figure(ensemble, viewport=None):
+    # AC power of every member and of the blend, with a +/- one standard
+    # deviation band around the blend.
+    blend, spread = ensemble['blend'][3], ensemble['spread'][3]
+    width = decimate.graph_width(viewport, GRAPH_COLUMNS['graph5'])
+    fig = decimate.figure('AC Power by Model (W)',
+                          [(ensemble['members'][model][3].index, ensemble['members'][model][3], model)
+                           for model in ensemble['models']] + [(blend.index, blend, 'blend')], width)
+    fig['data'] = band_traces(blend.index, blend - spread, blend + spread, 'spread', width) + fig['data']
+    return fig
+
+
+def quantile_figure(dc_out, ac_out, ac_quantiles, viewport=None):
+    # graph5 with the outer quantiles of AC power as a band and the inner
+    # ones (P50) as lines.
+    width = decimate.graph_width(viewport, GRAPH_COLUMNS['graph5'])
+    low, high = ac_quantiles.columns[0], ac_quantiles.columns[-1]
+    fig = decimate.figure('DC and AC MPP Power (W)',
+                          [(dc_out.index, dc_out['p_mp'], 'DC p_mp'), (ac_out.index, ac_out, 'AC p_mp')]
+                          + [(ac_quantiles.index, ac_quantiles[q], 'AC ' + q.upper())
+                             for q in ac_quantiles.columns[1:-1]], width)
+    fig['data'] = band_traces(ac_quantiles.index, ac_quantiles[low], ac_quantiles[high],
+                              'AC {}-{}'.format(low.upper(), high.upper()), width) + fig['data']
+    return fig
+
+
 def initial_render():
-    df  = pd.read_csv('data_dc_out.csv')
-    df2 = pd.read_csv('data_ac_out.csv')
-    df3 = pd.read_csv('data_poa_irrad.csv')
-    df4 = pd.read_csv('data_pvtemp.csv')
-    
-    df.rename(columns={'Unnamed: 0':'date'},inplace=True)
-    df2.rename(columns={'Unnamed: 0':'date', '0':'p_ac'},inplace=True)
-    df3.rename(columns={'Unnamed: 0':'date'},inplace=True)
-    df4.rename(columns={'Unnamed: 0':'date', '0':'pvtemp'},inplace=True)
-
-    fig1 = go.Figure(layout = {'title': 'Irradiance (Wm^-2)'}, 
-                                        data=[go.Scatter(x=df3.index, y=df3['poa_global'], name='poa_global'), 
-                                              go.Scatter(x=df3.index, y=df3['poa_direct'], name='poa_direct'),
-                                              go.Scatter(x=df3.index, y=df3['poa_diffuse'], name='poa_diffuse'),
-                                              go.Scatter(x=df3.index, y=df3['poa_sky_diffuse'], name='poa_sky_diffuse'),
-                                              go.Scatter(x=df3.index, y=df3['poa_ground_diffuse'], name='poa_ground_diffuse'),
-                                              ])
-    fig2 = go.Figure(layout = {'title': 'PV Module Temperature (degree Celcius)'}, 
-                                data=[go.Scatter(x=df4.index, y=df4['pvtemp'])  
-                                      ])                                  
-                                      
-    fig3 = go.Figure(layout = {'title': 'Open-Circuit & MPP Voltages (V)'}, 
-                                data=[go.Scatter(x=df.index, y=df['v_oc'], name='v_oc'), 
-                                      go.Scatter(x=df.index, y=df['v_mp'], name='v_mp')
-                                      ])
-    fig4 = go.Figure(layout = {'title': 'Short-Circuit & MPP Currents (A)'}, 
-                                data=[go.Scatter(x=df.index, y=df['i_sc'], name='i_sc'), 
-                                      go.Scatter(x=df.index, y=df['i_mp'], name='i_mp')
-                                      ])
-    fig5 = go.Figure(layout = {'title': 'DC and AC MPP Power (W)'}, 
-                                data=[go.Scatter(x=df.index, y=df['p_mp'], name='DC p_mp'), 
-                                      go.Scatter(x=df2.index, y=df2, name='AC p_mp')
-                                      ])
+    # Latest stored landing page forecast (written by initial_data.py).
+    df3, df4, df, df2 = result_store.read(INITIAL_SITE)
+
     #return_object = {1:fig1, 2:fig2, 3:fig3, 4:fig4, 5:fig5}                                
     #return return_object[graph_id]
-    return fig1, fig2, fig3, fig4, fig5
+    return forecast_figures(df3, df4, df, df2)
+
+
+# The landing page figures are built once at boot (at the default page width)
+# as plain dicts, so a page load neither re-reads the stored run nor rebuilds Plotly figures.
+# They are also put straight into the layout, the first paint needs no callback.
+INITIAL_TITLE = '1-day ahead solar pv-generation forecasts for NREL - Boulder, Colorado (39.7423N, 105.1785W)'
+INITIAL_FIGURES = list(initial_render())
+app.layout['op1'].children = INITIAL_TITLE
+for graph_id, figure in zip(['graph1', 'graph2', 'graph3', 'graph4', 'graph5'], INITIAL_FIGURES):
+    app.layout[graph_id].figure = figure
+startup.mark('initial figures')
+
+
+def stored_results(key, daysahead, title, figures, index, partial=False, viewport=None):
+    # Contents of the 'results' store. title may contain '{days}' for the
+    # horizon on display; day_ends[d - 1] is the last x value of the first d
+    # days, in the format of the trace x values (see decimate._x_values).
+    # Calendar days (DateOffset), so the ends stay on local midnight across
+    # DST changes. 'points' (timesteps) and 'max_points' (point budget of the
+    # narrowest graph) tell the browser when a sliced shorter horizon would
+    # be drawn with too few points and has to be requested instead.
+    start = index[0].normalize() if len(index) else None
+    day_ends = [] if start is None else [(start + pd.DateOffset(days=d)).strftime('%Y-%m-%d %H:%M')
+                                         for d in range(1, int(daysahead) + 1)]
+    max_points = min(int(decimate.graph_width(viewport, columns) * decimate.POINTS_PER_PIXEL)
+                     for columns in GRAPH_COLUMNS.values())
+    return {'key': key, 'daysahead': int(daysahead), 'title': title, 'figures': list(figures),
+            'day_ends': day_ends, 'points': len(index), 'max_points': max_points, 'partial': partial}
+
+
+INITIAL_INDEX = result_store.read(INITIAL_SITE)[3].index
+app.layout['results'].data = stored_results(None, 1, INITIAL_TITLE, INITIAL_FIGURES, INITIAL_INDEX)
+
+
+
+def model_options(manf, search_value, value):
+    # One page of catalog matches for what is typed into a model dropdown;
+    # the full catalogs stay on the server (see samsearch.py).
+    return dropdown_options(manf, search_value or '', value)
+
 
+for manf_id, model_id in [('pvmanf', 'pvmodel'), ('invmanf', 'invmodel')]:
+    app.callback(Output(model_id, 'options'),
+                 [Input(manf_id, 'value'), Input(model_id, 'search_value')],
+                 [State(model_id, 'value')])(model_options)
+
+
+app.clientside_callback(
+    'function(n_clicks) { return window.innerWidth; }',
+    Output('viewport', 'data'),
+    [Input('run_forecasts', 'n_clicks')])
+
+
+app.clientside_callback(
+    ClientsideFunction('results', 'route'),
+    [Output('view', 'data'), Output('request', 'data')],
+    [Input('run_forecasts', 'n_clicks'), Input('daysahead', 'value')],
+    [State('lat', 'value'), State('lon', 'value'), State('surface_tilt', 'value'),
+     State('surface_azimuth', 'value'), State('albedo', 'value'), State('pvmanf', 'value'),
+     State('pvmodel', 'value'), State('invmanf', 'value'), State('invmodel', 'value'),
+     State('fm', 'value'), State('uncertainty', 'value'), State('results', 'data'), State('view', 'data')])
+
+
+app.clientside_callback(
+    ClientsideFunction('results', 'render'),
+    [Output('op1', 'children'), Output('graph1', 'figure'), Output('graph2', 'figure'),
+     Output('graph3', 'figure'), Output('graph4', 'figure'), Output('graph5', 'figure')],
+    [Input('results', 'data'), Input('view', 'data'), Input('status', 'data')],
+    prevent_initial_call=True)
 
 
 @app.callback(
+    Output('job', 'data'),
     [
-        Output('op1','children'),
-        Output('graph1','figure'),
-        Output('graph2','figure'),
-        Output('graph3','figure'),
-        Output('graph4','figure'),
-        Output('graph5','figure')
-    ],
-    [
-        Input('run_forecasts', 'n_clicks')
+        Input('request', 'data')
     ],
     [
         State('lat', 'value'),
@@ -188,78 +343,124 @@ def initial_render():
         State('invmanf', 'value'),
         State('invmodel', 'value'),
         State('fm', 'value'),
-        State('daysahead', 'value'),
+        State('uncertainty', 'value'),
         
-    ])
+    ],
+    prevent_initial_call=True)
 
-def update_output(n_clicks, lat, lon, surface_tilt, surface_azimuth, albedo, 
-                    pvmanf, pvmodel, invmanf, invmodel, fm, daysahead):
-    
-    fig1 = go.Figure(layout = {'title': 'Irradiance (Wm^-2)'})
-    fig2 = go.Figure(layout = {'title': 'PV Module Temperature (degree Celcius)'}) 
-    fig3 = go.Figure(layout = {'title': 'Open Circuit & MPP Voltages (V)' })
-    fig4 = go.Figure(layout = {'title': 'Short-Circuit & MPP Currents (A)'})
-    fig5 = go.Figure(layout = {'title': 'DC and AC MPP Power (W)'})
-    
-    if not n_clicks:
-        #return 'Solar pv-generation forecasts', fig1, fig2, fig3, fig4, fig5
-        fig1, fig2, fig3, fig4, fig5 = initial_render()
-        return '1-day ahead solar pv-generation forecasts for NREL - Boulder, Colorado (39.7423N, 105.1785W)', fig1, fig2, fig3, fig4, fig5
-    elif n_clicks%2 == 0:
-        return 'Solar pv-generation forecasts', fig1, fig2, fig3, fig4, fig5
-    
-    else:
-        poa_irrad, pvtemp, dc_out, ac_out = get_forecasts(float(lat),float(lon),float(surface_tilt),float(surface_azimuth),float(albedo),
-                                                          {'pvmanf':pvmanf,
-                                                          'pvmodel':pvmodel},
-                                                          {'invmanf':invmanf,
-                                                          'invmodel':invmodel},
-                                                          fm,int(daysahead))
+def submit_forecast(request, lat, lon, surface_tilt, surface_azimuth, albedo, 
+                    pvmanf, pvmodel, invmanf, invmodel, fm, uncertainty=None):
+    # Submit the forecast job of a 'request' (new inputs or a longer horizon,
+    # see assets/results.js); the job data carries the request's key and click.
+    if not request:
+        raise PreventUpdate
+    daysahead = request['days']
+    sent = {'key': request['key'], 'clicks': request['clicks']}
+    # Several selected models run as an ensemble (see ensemble.py).
+    models = fm if isinstance(fm, list) else [fm]
+    try:
+        args = (float(lat),float(lon),float(surface_tilt),float(surface_azimuth),float(albedo),
+                {'pvmanf':pvmanf,
+                'pvmodel':pvmodel},
+                {'invmanf':invmanf,
+                'invmodel':invmodel})
+        if not models or None in models:
+            raise ValueError('no forecast model selected')
+        if len(models) > 1:
+            key = ('ensemble',) + forecast_key(*(args + ('+'.join(models), int(daysahead))))
+            job_id = job_queue.submit_once(key, get_ensemble_forecasts, *(args + (models, int(daysahead))))
+        elif uncertainty and 'mc' in uncertainty:
+            # Monte Carlo quantiles of AC power (see montecarlo.py).
+            args = args + (models[0], int(daysahead))
+            job_id = job_queue.submit_once(('quantiles',) + forecast_key(*args), get_forecast_quantiles, *args)
+        else:
+            args = args + (models[0], int(daysahead))
+            # Identical requests share one job, results are reused until a newer NWP
+            # cycle is out (see resultcache.py) and the horizon is modelled day by day
+            # so the first days are shown while the rest is still running.
+            job_id = job_queue.submit_once(forecast_key(*args), iter_forecasts_cached, *args)
+    except QueueFull:
+        return dict(sent, busy=True)
+    except (TypeError, ValueError):
+        return dict(sent, error='Please fill in all the forecast inputs.')
+    return dict(sent, job_id=job_id, daysahead=daysahead)
 
-        
-        df = dc_out
-        df2 = ac_out
-        df3 = poa_irrad
-        df4 = pvtemp
-        
-        '''
-        df = pd.read_csv('dc_out.csv')
-        df2 = pd.read_csv('ac_out.csv')
-        df3 = pd.read_csv('poa_irrad.csv')
-        df4 = pd.read_csv('pvtemp.csv')
-        
-        df.rename(columns={'Unnamed: 0':'date'},inplace=True)
-        df2.rename(columns={'Unnamed: 0':'date', '0':'p_ac'},inplace=True)
-        df3.rename(columns={'Unnamed: 0':'date'},inplace=True)
-        df4.rename(columns={'Unnamed: 0':'date', '0':'pvtemp'},inplace=True)
-        '''
-        fig1 = go.Figure(layout = {'title': 'Irradiance (Wm^-2)'}, 
-                                    data=[go.Scatter(x=df3.index, y=df3['poa_global'], name='poa_global'), 
-                                          go.Scatter(x=df3.index, y=df3['poa_direct'], name='poa_direct'),
-                                          go.Scatter(x=df3.index, y=df3['poa_diffuse'], name='poa_diffuse'),
-                                          go.Scatter(x=df3.index, y=df3['poa_sky_diffuse'], name='poa_sky_diffuse'),
-                                          go.Scatter(x=df3.index, y=df3['poa_ground_diffuse'], name='poa_ground_diffuse'),
-                                          ])
-        fig2 = go.Figure(layout = {'title': 'PV Module Temperature (degree Celcius)'}, 
-                                    data=[go.Scatter(x=df4.index, y=df4)  
-                                          ])                                  
-                                          
-        fig3 = go.Figure(layout = {'title': 'Open-Circuit & MPP Voltages (V)'}, 
-                                    data=[go.Scatter(x=df.index, y=df['v_oc'], name='v_oc'), 
-                                          go.Scatter(x=df.index, y=df['v_mp'], name='v_mp')
-                                          ])
-        fig4 = go.Figure(layout = {'title': 'Short-Circuit & MPP Currents (A)'}, 
-                                    data=[go.Scatter(x=df.index, y=df['i_sc'], name='i_sc'), 
-                                          go.Scatter(x=df.index, y=df['i_mp'], name='i_mp')
-                                          ])
-        fig5 = go.Figure(layout = {'title': 'DC and AC MPP Power (W)'}, 
-                                    data=[go.Scatter(x=df.index, y=df['p_mp'], name='DC p_mp'), 
-                                          go.Scatter(x=df2.index, y=df2, name='AC p_mp')
-                                          ])                                  
-        return '{}-day(s) ahead solar pv-generation forecasts:'.format(daysahead), fig1, fig2, fig3, fig4, fig5 
+
+@app.callback(
+    [
+        Output('results', 'data'),
+        Output('status', 'data'),
+        Output('poll', 'disabled')
+    ],
+    [
+        Input('job', 'data'),
+        Input('poll', 'n_intervals')
+    ],
+    [
+        State('viewport', 'data')
+    ],
+    prevent_initial_call=True)
+@metrics.timed('update_output')
+def update_output(job, n_intervals, viewport):
+    # Store the figures of the submitted forecast job for the client-side
+    # render callback, with a status text while it is not done; 'poll' stays
+    # enabled while the job is running.
+    def status(text):
+        return {'clicks': job['clicks'], 'text': text}
+
+    if not job:
+        raise PreventUpdate
+    elif job.get('busy'):
+        return dash.no_update, status('The forecast server is busy, please try again in a moment.'), True
+    elif job.get('error'):
+        return dash.no_update, status(job['error']), True
+
+    def store(title, figures, index, partial=False):
+        return stored_results(job['key'], job['daysahead'], title, figures, index, partial, viewport)
+
+    state = job_queue.status(job['job_id'])
+    if state is None:
+        return dash.no_update, status('The forecast job was lost, please run it again.'), True
+    elif state['state'] == ERROR:
+        return dash.no_update, status('The forecast failed: {}'.format(state['error'])), True
+    elif state['state'] != DONE:
+        running = status('Running {}-day(s) ahead forecast...'.format(job['daysahead']))
+        if not state['result']:
+            return dash.no_update, running, False
+        # Render the days modelled so far and keep polling.
+        result = concat_forecasts(state['result'])
+        figures = forecast_figures(*result, viewport=viewport)
+        return store('', figures, result[3].index, partial=True), running, False
+
+    result = state['result']
+    if isinstance(result, list):
+        # Day chunks of iter_forecasts_cached.
+        result = concat_forecasts(result)
+    if isinstance(result, dict) and 'ac_quantiles' in result:
+        poa_irrad, pvtemp, dc_out, ac_out = result['forecast']
+        fig1, fig2, fig3, fig4, fig5 = forecast_figures(poa_irrad, pvtemp, dc_out, ac_out, viewport,
+                                                        quantile_figure(dc_out, ac_out, result['ac_quantiles'],
+                                                                        viewport))
+        title = '{{days}}-day(s) ahead solar pv-generation forecasts ({} samples):'.format(result['n_samples'])
+    elif isinstance(result, dict):
+        # Ensemble: blended tables, and the members and spread on graph5.
+        poa_irrad, pvtemp, dc_out, ac_out = result['blend']
+        fig1, fig2, fig3, fig4, fig5 = forecast_figures(poa_irrad, pvtemp, dc_out, ac_out, viewport,
+                                                        ensemble_figure(result, viewport))
+        title = '{{days}}-day(s) ahead {} ensemble solar pv-generation forecasts:'.format(
+            '/'.join(result['models']))
+        if result['errors']:
+            title += ' (failed: {})'.format(', '.join(result['errors']))
+    else:
+        poa_irrad, pvtemp, dc_out, ac_out = result
+        fig1, fig2, fig3, fig4, fig5 = forecast_figures(poa_irrad, pvtemp, dc_out, ac_out, viewport)
+        title = '{days}-day(s) ahead solar pv-generation forecasts:'
+    return store(title, [fig1, fig2, fig3, fig4, fig5], ac_out.index), status(None), True
       
         
         
 
+startup.report()
+
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,90 @@
+// Client-side handling of forecast results (see app.py).
+//
+// The last forecast is kept in the 'results' store: its decimated figures,
+// the inputs it was run with ('key') and its horizon ('daysahead'). Clearing
+// the graphs, drawing them again and showing a shorter horizon are done
+// here from that store; the server is only asked ('request' store) when the
+// inputs changed, a longer horizon is wanted, or a shorter one sliced from
+// the stored figures would be drawn with too few points (the figures were
+// decimated for the whole stored horizon).
+
+// Slices keeping at least this fraction of the points a run of their own
+// horizon would be drawn with are shown from the store.
+var MIN_SLICE_DETAIL = 0.5;
+
+// True if the first `days` days of the stored figures are detailed enough.
+function sliceDetailed(results, days) {
+    if (!results.max_points || results.points <= results.max_points || days >= results.daysahead) {
+        return true;
+    }
+    var fraction = days / results.daysahead;
+    var shown = results.max_points * fraction;
+    var wanted = Math.min(results.points * fraction, results.max_points);
+    return shown >= MIN_SLICE_DETAIL * wanted;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    results: {
+        // run_forecasts clicks and slider moves -> [view, request].
+        // Odd clicks show a forecast, even clicks clear the graphs.
+        route: function(n_clicks, days, lat, lon, surface_tilt, surface_azimuth, albedo,
+                        pvmanf, pvmodel, invmanf, invmodel, fm, uncertainty, results, view) {
+            var no_update = window.dash_clientside.no_update;
+            var clicks = n_clicks || 0;
+            view = view || {clicks: 0};
+            var key = JSON.stringify([lat, lon, surface_tilt, surface_azimuth, albedo,
+                                      pvmanf, pvmodel, invmanf, invmodel, fm, uncertainty]);
+            var stored = results && results.key === key && !results.partial;
+            if (clicks === view.clicks) {
+                // Slider moved: slice the stored horizon, or fetch a longer
+                // (or more detailed shorter) one for the forecast on display.
+                if (view.clear) {
+                    return [no_update, no_update];
+                }
+                var next = Object.assign({}, view, {days: days});
+                if (clicks && stored && (results.daysahead < days || !sliceDetailed(results, days))) {
+                    return [next, {clicks: clicks, key: key, days: days}];
+                }
+                return [next, no_update];
+            }
+            if (clicks % 2 === 0) {
+                return [{clicks: clicks, days: days, clear: true}, no_update];
+            }
+            if (stored && results.daysahead >= days && sliceDetailed(results, days)) {
+                return [{clicks: clicks, days: days}, no_update];
+            }
+            return [{clicks: clicks, days: days}, {clicks: clicks, key: key, days: days}];
+        },
+
+        // results, view, status -> [title, figure1, ..., figure5].
+        render: function(results, view, status) {
+            view = view || {clicks: 0};
+            if (view.clear) {
+                return ['Solar pv-generation forecasts'].concat(results.figures.map(function(figure) {
+                    return {data: [], layout: figure.layout};
+                }));
+            }
+            var days = results.daysahead;
+            var figures = results.figures;
+            if (view.days && view.days < days && results.day_ends) {
+                days = view.days;
+                var end = results.day_ends[days - 1];
+                figures = figures.map(function(figure) {
+                    return {layout: figure.layout, data: figure.data.map(function(trace) {
+                        // x are 'YYYY-MM-DD HH:MM' local times, ordered as strings.
+                        var n = 0;
+                        while (n < trace.x.length && trace.x[n] <= end) {
+                            n++;
+                        }
+                        return Object.assign({}, trace, {x: trace.x.slice(0, n), y: trace.y.slice(0, n)});
+                    })};
+                });
+            }
+            var title = results.title.replace('{days}', days);
+            if (status && status.text && status.clicks === view.clicks) {
+                title = status.text;
+            }
+            return [title].concat(figures);
+        }
+    }
+});
@@ -0,0 +1,193 @@
+# Historical backtests of the modelling chain over archived weather.
+#
+# Archived weather is one CSV file per site, <archive_dir>/<site_id>.csv, with
+# a UTC time column first and at least the fleet.WEATHER_COLUMNS. Sites come
+# from a CSV with a site_id column plus fleet.SITE_COLUMNS.
+#
+# The work is split into tasks, one per site and time shard (--shard-days),
+# and run on a process pool. A task streams its site file with
+# read_csv(chunksize=...), so at most chunk_rows rows of weather and their
+# results are in memory at once. With shards, the parent scans every file
+# once for the byte offsets of its chunks (chunk_offsets) and each task seeks
+# straight to the chunks of its shard instead of reading the file from the
+# top. Every chunk is modelled with pvgeneration.model_forecasts and written
+# straight away as one run of a ResultStore under <out_dir> (run id = first
+# timestamp of the chunk). Runs that already exist are skipped, so an
+# interrupted backtest is resumed by starting it again with the same
+# arguments.
+#
+#     python backtest.py sites.csv archive/ backtest_results/ --start 2018-01-01 --end 2020-01-01 --workers 8
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from fleet import SITE_COLUMNS, WEATHER_COLUMNS
+from pvgeneration import model_forecasts
+from resultstore import ResultStore
+from weathercache import LocalForecastSource
+
+
+CHUNK_ROWS = 24 * 31
+
+
+def load_sites(path):
+    sites = pd.read_csv(path, dtype={'site_id': str})
+    missing = [col for col in ['site_id'] + SITE_COLUMNS if col not in sites.columns]
+    if missing:
+        raise ValueError('sites is missing columns: {}'.format(', '.join(missing)))
+    return sites
+
+
+def chunk_offsets(path, chunk_rows=CHUNK_ROWS):
+    # (byte offsets, first times) of the chunk_rows row chunks of an archive
+    # file, the same chunks read_csv(chunksize=chunk_rows) gives.
+    offsets = []
+    times = []
+    with open(path, 'rb') as f:
+        pos = len(f.readline())
+        row = 0
+        for line in f:
+            if line.strip():
+                if row % chunk_rows == 0:
+                    offsets.append(pos)
+                    times.append(line.split(b',', 1)[0].decode())
+                row += 1
+            pos += len(line)
+    return np.array(offsets, dtype=np.int64), pd.to_datetime(times, utc=True)
+
+
+def make_tasks(sites, archive_dir, start=None, end=None, shard_days=None, chunk_rows=CHUNK_ROWS):
+    # [(site dict, weather path, shard start, shard end, rows)]; shards cover
+    # [start, end) in shard_days pieces, or the whole range. rows is
+    # (byte offset, row count) of the chunks overlapping the shard, or None
+    # to read the whole file.
+    tasks = []
+    for site in sites.to_dict('records'):
+        site = {key: value.item() if hasattr(value, 'item') else value for key, value in site.items()}
+        path = os.path.join(archive_dir, '{}.csv'.format(site['site_id']))
+        if not os.path.exists(path):
+            continue
+        if shard_days and start is not None and end is not None:
+            bounds = list(pd.date_range(start, end, freq='{}D'.format(shard_days)))
+            if bounds[-1] < end:
+                bounds.append(end)
+            offsets, times = chunk_offsets(path, chunk_rows)
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                first = max(times.searchsorted(a, side='right') - 1, 0)
+                last = times.searchsorted(b, side='left')
+                if last > first:
+                    tasks.append((site, path, a, b, (int(offsets[first]), int(last - first) * chunk_rows)))
+        else:
+            tasks.append((site, path, start, end, None))
+    return tasks
+
+
+def iter_weather(path, start=None, end=None, chunk_rows=CHUNK_ROWS, rows=None):
+    # Weather of one archive file within [start, end), in chunks of at most
+    # chunk_rows rows (chunk boundaries only depend on the file and chunk_rows,
+    # which keeps run ids stable between resumed runs). rows (see make_tasks)
+    # limits the read to those chunks.
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    with open(path, 'rb') as f:
+        if rows is None:
+            f.readline()
+            nrows = None
+        else:
+            f.seek(rows[0])
+            nrows = rows[1]
+        for chunk in pd.read_csv(f, header=None, names=columns, index_col=0, chunksize=chunk_rows,
+                                 nrows=nrows):
+            chunk.index = pd.to_datetime(chunk.index, utc=True)
+            if start is not None:
+                chunk = chunk[chunk.index >= start]
+            if end is not None:
+                if len(chunk.index) and chunk.index[0] >= end:
+                    break
+                chunk = chunk[chunk.index < end]
+            if len(chunk):
+                yield chunk
+
+
+def run_task(site, path, start, end, rows, out_dir, chunk_rows=CHUNK_ROWS):
+    # Model one site/shard; returns (site_id, rows modelled, rows skipped).
+    store = ResultStore(out_dir)
+    done = set(store.runs(site['site_id']))
+    fm = LocalForecastSource('archive')
+    fm.set_location('UTC', site['latitude'], site['longitude'])
+    pvmoduledata = {'pvmanf': site['pvmanf'], 'pvmodel': site['pvmodel']}
+    inverterdata = {'invmanf': site['invmanf'], 'invmodel': site['invmodel']}
+    modelled = skipped = 0
+    for weather in iter_weather(path, start, end, chunk_rows, rows):
+        run_id = weather.index[0].strftime('%Y%m%dT%H%M%SZ')
+        if run_id in done:
+            skipped += len(weather)
+            continue
+        weather = weather[WEATHER_COLUMNS].astype(float)
+        fm.time = weather.index
+        results = model_forecasts(weather, fm, site['surface_tilt'], site['surface_azimuth'], site['albedo'],
+                                  pvmoduledata, inverterdata)
+        store.write(site['site_id'], *results, run_id=run_id, meta=site)
+        modelled += len(weather)
+    return site['site_id'], modelled, skipped
+
+
+def run_backtest(sites, archive_dir, out_dir, start=None, end=None, workers=None, chunk_rows=CHUNK_ROWS,
+                 shard_days=None, out=None):
+    # Run all tasks on a pool of `workers` processes (1 runs in-process);
+    # returns {'tasks', 'modelled', 'skipped', 'seconds', 'rows_per_second'}.
+    start = None if start is None else pd.Timestamp(start, tz='UTC')
+    end = None if end is None else pd.Timestamp(end, tz='UTC')
+    tasks = make_tasks(sites, archive_dir, start, end, shard_days, chunk_rows)
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    modelled = skipped = 0
+
+    def progress(result, i):
+        if out is not None:
+            out.write('[{}/{}] {}: {} rows modelled, {} already done\n'.format(i, len(tasks), *result))
+
+    if workers == 1:
+        for i, task in enumerate(tasks, 1):
+            result = run_task(*(task + (out_dir, chunk_rows)))
+            modelled, skipped = modelled + result[1], skipped + result[2]
+            progress(result, i)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_task, *(task + (out_dir, chunk_rows))) for task in tasks]
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                modelled, skipped = modelled + result[1], skipped + result[2]
+                progress(result, i)
+    seconds = time.perf_counter() - t0
+    return {'tasks': len(tasks), 'modelled': modelled, 'skipped': skipped, 'seconds': seconds,
+            'rows_per_second': modelled / seconds if seconds else 0.}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest the modelling chain over archived weather.')
+    parser.add_argument('sites', help='sites csv: site_id, ' + ', '.join(SITE_COLUMNS))
+    parser.add_argument('archive_dir', help='directory of <site_id>.csv weather files')
+    parser.add_argument('out_dir', help='result store directory, also used to resume')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all cores)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='weather rows per chunk')
+    parser.add_argument('--shard-days', type=int, default=None,
+                        help='split every site into shards of this many days (needs --start/--end)')
+    args = parser.parse_args(argv)
+
+    stats = run_backtest(load_sites(args.sites), args.archive_dir, args.out_dir, args.start, args.end,
+                         args.workers, args.chunk_rows, args.shard_days, out=sys.stdout)
+    print('{tasks} tasks, {modelled} rows modelled, {skipped} skipped in {seconds:.1f}s '
+          '({rows_per_second:,.0f} rows/s)'.format(**stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
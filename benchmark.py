@@ -0,0 +1,226 @@
+# Offline benchmark of the get_forecasts modelling chain.
+#
+# Every stage of pvgeneration.model_forecasts is timed on its own for a grid
+# of fleet sizes (number of sites) and horizons (days ahead), using weather
+# from weathercache.LocalForecastSource instead of a live Unidata server:
+# synthetic clear-sky based weather by default, or a recorded
+# get_processed_data frame (--weather, .pkl or .csv). For every stage and
+# case it reports the throughput in site-timesteps/s (best of --repeat runs)
+# and the peak memory allocated by the stage (tracemalloc, a separate run).
+#
+#     python benchmark.py                          # full grid, compare to the baseline
+#     python benchmark.py --sites 1,100 --days 1,7 --repeat 5
+#     python benchmark.py --save-baseline          # record the current numbers
+#
+# Results are compared to the baseline file (BENCHMARK_BASELINE); a stage
+# whose throughput dropped by more than --tolerance is reported as a
+# regression and the exit status is 1. Baselines are machine specific:
+# record one on the machine the comparison runs on.
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import pvgeneration as pvg
+from weathercache import LocalForecastSource
+
+
+BENCHMARK_BASELINE = os.environ.get('BENCHMARK_BASELINE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                 'benchmark_baseline.json'))
+SITES = [1, 10, 100, 1000, 10000]
+DAYS = [1, 7, 21]
+# Fixed horizon start, so synthetic weather and solar geometry are the same on every run.
+START = pd.Timestamp('2020-06-01', tz='US/Mountain')
+# Distinct weather frames generated; sites share them round-robin.
+WEATHER_TEMPLATES = 16
+
+SYSTEM = {'surface_tilt': 30, 'surface_azimuth': 180, 'albedo': 0.2,
+          'pvmoduledata': {'pvmanf': 'SandiaMod', 'pvmodel': 'Canadian_Solar_CS5P_220M___2009_'},
+          'inverterdata': {'invmanf': 'sandiainverter', 'invmodel': 'ABB__MICRO_0_25_I_OUTD_US_208__208V_'}}
+
+# Stages of model_forecasts in order: (name, function of the per-site state dict).
+STAGES = [
+    ('get_solpos', lambda s: pvg.get_solpos(s['forecast_data'], s['fm'])),
+    ('get_dni_extra', lambda s: pvg.get_dni_extra(s['fm'])),
+    ('get_airmass', lambda s: pvg.get_airmass(s['get_solpos'])),
+    ('get_poa_sky_diffuse', lambda s: pvg.get_poa_sky_diffuse(SYSTEM['surface_tilt'], SYSTEM['surface_azimuth'],
+                                                              s['forecast_data'], s['get_dni_extra'],
+                                                              s['get_solpos'])),
+    ('get_poa_ground_diffuse', lambda s: pvg.get_poa_ground_diffuse(SYSTEM['surface_tilt'], s['forecast_data'],
+                                                                    SYSTEM['albedo'])),
+    ('get_angle_of_incidence', lambda s: pvg.get_angle_of_incidence(SYSTEM['surface_tilt'],
+                                                                    SYSTEM['surface_azimuth'], s['get_solpos'])),
+    ('get_total_poa', lambda s: pvg.get_total_poa(s['get_angle_of_incidence'], s['forecast_data'],
+                                                  s['get_poa_sky_diffuse'], s['get_poa_ground_diffuse'])),
+    ('get_cell_temp', lambda s: pvg.get_cell_temp(s['forecast_data'], s['get_total_poa'])),
+    ('forecast_dc_power', lambda s: pvg.forecast_dc_power(s['get_total_poa'], s['get_airmass'],
+                                                          s['get_angle_of_incidence'], s['pvmodule'],
+                                                          s['get_cell_temp'])),
+    ('forecast_ac_power', lambda s: pvg.forecast_ac_power(s['forecast_dc_power'], s['invertermodel'])),
+]
+
+
+def site_locations(n, seed=0):
+    # n deterministic (latitude, longitude) pairs over the contiguous US.
+    rng = np.random.RandomState(seed)
+    return list(zip(rng.uniform(25, 49, n).round(4), rng.uniform(-124, -67, n).round(4)))
+
+
+def load_weather(path):
+    # A recorded get_processed_data frame from a pickle or csv file.
+    if path.endswith('.csv'):
+        data = pd.read_csv(path, index_col=0)
+        data.index = pd.to_datetime(data.index, utc=True)
+        return data
+    return pd.read_pickle(path)
+
+
+def make_sites(n, days, weather=None, freq=None):
+    # Per-site state dicts holding fm and forecast_data, as get_forecasts
+    # would have them after get_weather_data.
+    locations = site_locations(n)
+    end = START + pd.Timedelta(days=days)
+    templates = {}
+    sites = []
+    for i, (lat, lon) in enumerate(locations):
+        k = i % WEATHER_TEMPLATES
+        if k not in templates:
+            if weather is not None:
+                data = weather.tz_convert(START.tz)
+                data = data[data.index < data.index[0] + pd.Timedelta(days=days)]
+            else:
+                source = LocalForecastSource('HRRR', freq=freq)
+                data = source.get_processed_data(lat, lon, START, end)
+            templates[k] = data
+        fm = LocalForecastSource('HRRR')
+        fm.set_location(START.tz, lat, lon)
+        fm.time = templates[k].index
+        sites.append({'fm': fm, 'forecast_data': templates[k]})
+    pvmodule = pvg.get_pvmodule(SYSTEM['pvmoduledata'])
+    invertermodel = pvg.get_invertermodel(SYSTEM['inverterdata'])
+    for site in sites:
+        site['pvmodule'] = pvmodule
+        site['invertermodel'] = invertermodel
+    return sites
+
+
+def run_stage(fn, sites, name):
+    for site in sites:
+        site[name] = fn(site)
+
+
+def run_case(n_sites, days, repeat=3, memory=True, weather=None, freq=None):
+    # {stage: {'seconds', 'throughput', 'peak_bytes'}} for one case.
+    sites = make_sites(n_sites, days, weather, freq)
+    timesteps = sum(len(site['forecast_data']) for site in sites)
+    results = {}
+    for name, fn in STAGES:
+        best = float('inf')
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run_stage(fn, sites, name)
+            best = min(best, time.perf_counter() - t0)
+        results[name] = {'seconds': best, 'throughput': timesteps / best if best else float('inf')}
+        if memory:
+            tracemalloc.start()
+            try:
+                run_stage(fn, sites, name)
+                results[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    results['model_forecasts'] = {'seconds': sum(r['seconds'] for r in results.values())}
+    results['model_forecasts']['throughput'] = timesteps / results['model_forecasts']['seconds']
+    return {'sites': n_sites, 'days': days, 'site_timesteps': timesteps, 'stages': results}
+
+
+def case_key(case, stage):
+    return '{}/{}sites/{}days'.format(stage, case['sites'], case['days'])
+
+
+def compare(cases, baseline, tolerance):
+    # (key, baseline throughput, throughput) of every stage that got slower
+    # than baseline * (1 - tolerance).
+    regressions = []
+    for case in cases:
+        for stage, result in case['stages'].items():
+            key = case_key(case, stage)
+            if key in baseline and result['throughput'] < baseline[key] * (1 - tolerance):
+                regressions.append((key, baseline[key], result['throughput']))
+    return regressions
+
+
+def report(cases, out=None, header=True):
+    out = out or sys.stdout
+    if header:
+        out.write('{:<24} {:>6} {:>5} {:>10} {:>16} {:>12}\n'.format(
+            'stage', 'sites', 'days', 'seconds', 'site-steps/s', 'peak MB'))
+    for case in cases:
+        for stage, result in case['stages'].items():
+            peak = result.get('peak_bytes')
+            out.write('{:<24} {:>6} {:>5} {:>10.4f} {:>16,.0f} {:>12}\n'.format(
+                stage, case['sites'], case['days'], result['seconds'], result['throughput'],
+                '' if peak is None else '{:.2f}'.format(peak / 1e6)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the get_forecasts modelling chain.')
+    parser.add_argument('--sites', default=','.join(map(str, SITES)),
+                        help='comma separated fleet sizes (default %(default)s)')
+    parser.add_argument('--days', default=','.join(map(str, DAYS)),
+                        help='comma separated horizons in days (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best is kept')
+    parser.add_argument('--freq', default=None, help='synthetic weather resolution, e.g. 1h or 15min')
+    parser.add_argument('--weather', default=None, help='recorded forecast_data frame (.pkl or .csv)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE, help='baseline file (default %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed throughput drop before a regression is reported (default %(default)s)')
+    parser.add_argument('--output', default=None, help='also write the full results as json')
+    args = parser.parse_args(argv)
+
+    weather = load_weather(args.weather) if args.weather else None
+    cases = []
+    for days in [int(d) for d in args.days.split(',')]:
+        for n_sites in [int(n) for n in args.sites.split(',')]:
+            cases.append(run_case(n_sites, days, args.repeat, not args.no_memory, weather, args.freq))
+            report(cases[-1:], header=len(cases) == 1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(cases, f, indent=1)
+
+    throughput = {case_key(case, stage): result['throughput']
+                  for case in cases for stage, result in case['stages'].items()}
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(throughput)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('baseline written to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline at {}, run with --save-baseline to record one'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(cases, baseline, args.tolerance)
+    for key, expected, measured in regressions:
+        print('REGRESSION {}: {:,.0f} site-steps/s, baseline {:,.0f}'.format(key, measured, expected))
+    if not regressions:
+        print('no regressions against {}'.format(args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
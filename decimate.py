@@ -0,0 +1,109 @@
+# Server-side decimation and compact serialization of dashboard traces.
+#
+# A long horizon at hourly (or finer) resolution sends every raw point of
+# every trace to the browser. Traces are cut down to about one point per
+# horizontal pixel of their graph with largest-triangle-three-buckets (LTTB),
+# which keeps the visual shape (peaks, ramps) of the series; when points were
+# thinned out by ENVELOPE_FACTOR or more, a min/max band per bucket is drawn
+# behind the line so no extreme disappears. Figures are built as plain dicts with short local timestamps
+# and rounded values instead of validated go.Figure objects.
+
+import numpy as np
+import pandas as pd
+
+
+# Default page width (px) when the browser has not reported one.
+DEFAULT_VIEWPORT = 1200
+POINTS_PER_PIXEL = 1
+DECIMALS = 3
+# Draw the min/max band once a trace has this many times more points than
+# its graph has pixels.
+ENVELOPE_FACTOR = 4
+
+
+def lttb(x, y, n_out):
+    # Indices of the n_out points LTTB keeps out of (x, y). NaNs count as 0
+    # for the selection; the first and last points are always kept.
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    every = (n - 2) / float(n_out - 2)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    idx[-1] = n - 1
+    return idx
+
+
+def minmax_envelope(y, n_buckets):
+    # (bucket start indices, min, max) of y over n_buckets equal buckets,
+    # ignoring NaNs.
+    y = np.asarray(y, dtype=float)
+    starts = np.unique(np.linspace(0, len(y), n_buckets, endpoint=False).astype(np.int64))
+    with np.errstate(invalid='ignore'):
+        return starts, np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)
+
+
+def _x_values(x):
+    # Local wall-clock timestamps, as Plotly displays them, without the
+    # seconds and UTC offset.
+    if isinstance(x, pd.DatetimeIndex):
+        return list(x.strftime('%Y-%m-%d %H:%M'))
+    return np.asarray(x).tolist()
+
+
+def _y_values(y):
+    y = np.round(np.asarray(y, dtype=float), DECIMALS)
+    return [None if v != v else v for v in y.tolist()]
+
+
+def traces(x, y, name=None, max_points=None):
+    # Plotly trace dicts for one series, decimated to max_points.
+    x = pd.Index(x)
+    y = np.asarray(y, dtype=float)
+    line = {'type': 'scatter', 'mode': 'lines'}
+    if name is not None:
+        line['name'] = name
+    if not max_points or len(y) <= max_points:
+        line.update(x=_x_values(x), y=_y_values(y))
+        return [line]
+
+    xnum = x.asi8 if isinstance(x, pd.DatetimeIndex) else np.asarray(x, dtype=float)
+    keep = lttb(xnum, y, max_points)
+    line.update(x=_x_values(x[keep]), y=_y_values(y[keep]))
+    if len(y) < ENVELOPE_FACTOR * max_points:
+        return [line]
+    starts, low, high = minmax_envelope(y, max(max_points // 2, 2))
+    band_x = _x_values(x[starts])
+    band = {'type': 'scatter', 'mode': 'lines', 'line': {'width': 0}, 'hoverinfo': 'skip',
+            'showlegend': False}
+    lower = dict(band, x=band_x, y=_y_values(low))
+    upper = dict(band, x=band_x, y=_y_values(high), fill='tonexty', opacity=0.2)
+    if name is not None:
+        lower['legendgroup'] = upper['legendgroup'] = line['legendgroup'] = name
+    return [lower, upper, line]
+
+
+def figure(title, series, width_px=None):
+    # Figure dict from [(x, y, name), ...], capping each trace at
+    # POINTS_PER_PIXEL points per pixel of width_px.
+    max_points = int(width_px * POINTS_PER_PIXEL) if width_px else None
+    data = []
+    for x, y, name in series:
+        data.extend(traces(x, y, name, max_points))
+    return {'data': data, 'layout': {'title': {'text': title}}}
+
+
+def graph_width(viewport, columns):
+    # Pixel width of a graph spanning `columns` of the 12 column grid.
+    return (viewport or DEFAULT_VIEWPORT) * columns / 12.
@@ -0,0 +1,96 @@
+# Multi-model ensemble forecasts.
+#
+# The selected NWP models are forecast concurrently on a thread pool: the
+# fetches are I/O bound and the numpy/pvlib chain releases the GIL for much
+# of its work, so the total latency is close to that of the slowest model.
+# Every member goes through get_forecasts_cached (result cache, single-flight
+# coalescing and weather cache as for single-model runs). The members are then
+# interpolated onto a common time grid (finest member resolution, spanning all
+# members; NaN outside a member's own horizon) and blended into a weighted
+# mean, with the member standard deviation as spread.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pvgeneration import FORECAST_MODELS
+from resultcache import get_forecasts_cached
+from weathercache import model_name
+
+
+def common_grid(indexes):
+    # Regular grid at the finest member resolution, spanning all members.
+    # Members of a single row have no resolution; if all of them are like
+    # that the grid is just their timestamps.
+    steps = [pd.Series(index).diff().median() for index in indexes if len(index) > 1]
+    if not steps:
+        return pd.DatetimeIndex(sorted({index[0] for index in indexes}))
+    start = min(index[0] for index in indexes)
+    end = max(index[-1] for index in indexes)
+    return pd.date_range(start, end, freq=min(steps))
+
+
+def align(data, grid):
+    # Time interpolation of a member table onto grid, NaN outside its span.
+    data = data[~data.index.duplicated()]
+    merged = data.reindex(data.index.union(grid))
+    inside = (merged.index >= data.index[0]) & (merged.index <= data.index[-1])
+    merged = merged.interpolate(method='time', limit_area='inside')
+    merged[~inside] = np.nan
+    return merged.reindex(grid)
+
+
+def blend(tables, weights):
+    # (weighted mean, standard deviation) across member tables of the same
+    # shape; members with NaN at a timestep are left out there.
+    values = np.stack([table.to_numpy(dtype=float) for table in tables])
+    w = np.asarray(weights, dtype=float).reshape((-1,) + (1,) * (values.ndim - 1))
+    present = ~np.isnan(values)
+    w = np.where(present, w, 0.)
+    total = w.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(total > 0, np.nansum(values * w, axis=0) / total, np.nan)
+        spread = np.sqrt(np.where(total > 0, np.nansum(w * (values - mean) ** 2, axis=0) / total, np.nan))
+    like = tables[0]
+    if isinstance(like, pd.Series):
+        return pd.Series(mean, index=like.index), pd.Series(spread, index=like.index)
+    return (pd.DataFrame(mean, index=like.index, columns=like.columns),
+            pd.DataFrame(spread, index=like.index, columns=like.columns))
+
+
+def get_ensemble_forecasts(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                           inverterdata, models, daysahead, weights=None):
+    # Returns a dict with
+    # * 'models'  - the members that produced a forecast, in order
+    # * 'members' - {model: (poa_irrad, pvtemp, dc_out, ac_out)} on the common grid
+    # * 'blend'   - (poa_irrad, pvtemp, dc_out, ac_out) weighted mean of the members
+    # * 'spread'  - the same tables holding the member standard deviation
+    # * 'errors'  - {model: message} of the members that failed
+    # models are names ('GFS', ...) or forecast model instances.
+    models = list(models or FORECAST_MODELS)
+    weights = weights or {}
+    args = (latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata)
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = [(model_name(model), executor.submit(get_forecasts_cached, *(args + (model, daysahead))))
+                   for model in models]
+        results, errors = {}, {}
+        for model, future in futures:
+            try:
+                result = future.result()
+                if len(result[0]):
+                    results[model] = result
+                else:
+                    errors[model] = 'no data in the forecast window'
+            except Exception as exc:
+                errors[model] = '{}: {}'.format(type(exc).__name__, exc)
+    if not results:
+        raise ValueError('no model produced a forecast: {}'.format(
+            '; '.join('{} ({})'.format(model, error) for model, error in errors.items())))
+
+    names = [model_name(model) for model in models if model_name(model) in results]
+    grid = common_grid([results[model][0].index for model in names])
+    members = {model: tuple(align(table, grid) for table in results[model]) for model in names}
+    w = [weights.get(model, 1.) for model in names]
+    blended, spread = zip(*(blend([members[model][i] for model in names], w) for i in range(4)))
+    return {'models': names, 'members': members, 'blend': blended, 'spread': spread, 'errors': errors}
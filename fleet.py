@@ -0,0 +1,194 @@
+# Vectorized forecasts for a fleet of PV sites.
+#
+# get_forecasts models one site per call. Here the whole fleet goes through
+# the same pvlib chain in one pass on 2-D (site x time) NumPy arrays: site
+# parameters (location, orientation, albedo, module and inverter coefficients)
+# are (n_sites, 1) columns that broadcast against the (n_sites, n_times)
+# weather, so the cost is per site-timestep instead of per-site Python calls.
+#
+# sites is a DataFrame with one row per site and the columns in SITE_COLUMNS,
+# e.g.
+#     latitude  longitude  surface_tilt  surface_azimuth  albedo  pvmanf     pvmodel  invmanf         invmodel
+#     39.7423   -105.1785  30            180              0.2     SandiaMod  ...      sandiainverter  ...
+
+import numpy as np
+import pandas as pd
+
+from pvlib import atmosphere, irradiance, pvsystem, spa, temperature
+
+from pvgeneration import UPSAMPLE_FREQ, forecast_window, get_forecast_model, get_weather_data
+from samcache import get_sam_table
+
+
+SITE_COLUMNS = ['latitude', 'longitude', 'surface_tilt', 'surface_azimuth', 'albedo',
+                'pvmanf', 'pvmodel', 'invmanf', 'invmodel']
+WEATHER_COLUMNS = ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed']
+POA_COLUMNS = ['poa_global', 'poa_direct', 'poa_diffuse', 'poa_sky_diffuse', 'poa_ground_diffuse']
+DC_COLUMNS = ['i_sc', 'i_mp', 'v_oc', 'v_mp', 'p_mp', 'i_x', 'i_xx']
+
+THERMAL_PARAMS = temperature.TEMPERATURE_MODEL_PARAMETERS['sapm']['open_rack_glass_polymer']
+
+
+def fleet_solpos(time, latitude, longitude):
+    # NREL SPA for many sites at once, with the same defaults as
+    # Location.get_solarposition (altitude 0 m, 12 C, delta_t 67 s).
+    # latitude/longitude are (n_sites, 1) arrays, results are (n_sites, n_times).
+    unixtime = np.asarray(time.asi8 / 1e9)[None, :]
+    pressure = atmosphere.alt2pres(0) / 100.   # mbar
+    apparent_zenith, zenith, _, _, azimuth, _ = spa.solar_position_numpy(
+        unixtime, latitude, longitude, 0, pressure, 12, 67.0, 0.5667, numthreads=1)
+    return {'apparent_zenith': apparent_zenith, 'zenith': zenith, 'azimuth': azimuth}
+
+
+def sam_parameters(manfs, models):
+    # Module/inverter coefficients for every site as {parameter: (n_sites, 1)}.
+    # Each distinct (database, name) pair is looked up once.
+    codes, uniques = pd.factorize(pd.MultiIndex.from_arrays([manfs, models]))
+    rows = {}
+    for i, (manf, model) in enumerate(uniques):
+        table = get_sam_table(manf)
+        rows.setdefault(manf, ([], []))
+        rows[manf][0].append(i)
+        rows[manf][1].append(table.index[model])
+    params = {}
+    for manf, (unique_pos, table_rows) in rows.items():
+        table = get_sam_table(manf)
+        values = np.asarray(table.values)[table_rows]
+        for pos, name in enumerate(table.parameters):
+            col = params.setdefault(name, np.full(len(uniques), np.nan))
+            col[unique_pos] = values[:, pos]
+    return {name: col[codes][:, None] for name, col in params.items()}
+
+
+def sandia_inverter(v_dc, p_dc, invertermodel, clip=True):
+    # inverter.sandia with per-site (n_sites, 1) coefficient arrays; pvlib's
+    # version only applies the night tare limit with scalar coefficients.
+    # clip=False skips the Paco limit (to measure clipping losses).
+    Paco = invertermodel['Paco']
+    Pso = invertermodel['Pso']
+    Vdco = invertermodel['Vdco']
+    A = invertermodel['Pdco'] * (1 + invertermodel['C1'] * (v_dc - Vdco))
+    B = Pso * (1 + invertermodel['C2'] * (v_dc - Vdco))
+    C = invertermodel['C0'] * (1 + invertermodel['C3'] * (v_dc - Vdco))
+    power_ac = (Paco / (A - B) - C * (A - B)) * (p_dc - B) + C * (p_dc - B) ** 2
+    if clip:
+        power_ac = np.minimum(Paco, power_ac)
+    return np.where(p_dc < Pso, -1.0 * np.abs(invertermodel['Pnt']), power_ac)
+
+
+def fleet_dc_chain(solpos, dni_extra, airmass, weather, surface_tilt, surface_azimuth, albedo, module):
+    # The get_forecasts chain up to DC power of one module (haydavies, ground
+    # diffuse, AOI, poa_components, sapm_cell, SAPM) on broadcastable arrays.
+    # Site level inputs (solpos, dni_extra, airmass) may be shared rows of
+    # shape (1, n_times) and orientations/albedo/parameters (n, 1) columns.
+    # Returns {output: array} for POA_COLUMNS, 'pvtemp' and DC_COLUMNS.
+    poa_sky_diffuse = irradiance.haydavies(surface_tilt, surface_azimuth,
+                                           weather['dhi'], weather['dni'], dni_extra,
+                                           solpos['apparent_zenith'], solpos['azimuth'])
+    poa_ground_diffuse = irradiance.get_ground_diffuse(surface_tilt, weather['ghi'], albedo=albedo)
+    aoi = irradiance.aoi(surface_tilt, surface_azimuth, solpos['apparent_zenith'], solpos['azimuth'])
+    poa_irrad = irradiance.poa_components(aoi, weather['dni'], poa_sky_diffuse, poa_ground_diffuse)
+    pvtemp = temperature.sapm_cell(poa_irrad['poa_global'], weather['temp_air'],
+                                   weather['wind_speed'], **THERMAL_PARAMS)
+    effective_irradiance = pvsystem.sapm_effective_irradiance(poa_irrad['poa_direct'],
+                                                              poa_irrad['poa_diffuse'],
+                                                              airmass, aoi, module)
+    dc_out = pvsystem.sapm(effective_irradiance, pvtemp, module)
+    out = {name: np.asarray(poa_irrad[name]) for name in POA_COLUMNS}
+    out['pvtemp'] = np.asarray(pvtemp)
+    out.update((name, np.asarray(dc_out[name])) for name in DC_COLUMNS)
+    return out
+
+
+def fleet_power_chain(solpos, dni_extra, airmass, weather, surface_tilt, surface_azimuth,
+                      albedo, module, invertermodel):
+    # fleet_dc_chain plus the Sandia inverter fed by that one module, adding 'p_ac'.
+    out = fleet_dc_chain(solpos, dni_extra, airmass, weather, surface_tilt, surface_azimuth, albedo, module)
+    out['p_ac'] = np.asarray(sandia_inverter(out['v_mp'], out['p_mp'], invertermodel))
+    return out
+
+
+def fleet_weather(sites, fm, start, end, weather=None):
+    # Stack per-site forecast frames into {column: (n_sites, n_times)} on the
+    # time index of the first site. weather may be given as one frame shared by
+    # all sites or as a list of frames (one per site); otherwise it is pulled
+    # with get_weather_data, where the per-cell cache serves nearby sites, or
+    # read for all sites in one pass from a local model file.
+    if weather is None:
+        fm = get_forecast_model(fm)
+        if hasattr(fm, 'get_fleet_data'):
+            # Local model files extract all sites at once (see nwpfile.py).
+            weather = fm.get_fleet_data(sites['latitude'].to_numpy(dtype=float),
+                                        sites['longitude'].to_numpy(dtype=float), start, end)
+        else:
+            weather = [get_weather_data(lat, lon, start, end, fm)
+                       for lat, lon in zip(sites['latitude'], sites['longitude'])]
+    if isinstance(weather, pd.DataFrame):
+        time = weather.index
+        stacked = {col: np.broadcast_to(weather[col].to_numpy(dtype=float), (len(sites), len(time)))
+                   for col in WEATHER_COLUMNS}
+        return time, stacked
+    time = weather[0].index
+    stacked = {col: np.empty((len(sites), len(time))) for col in WEATHER_COLUMNS}
+    for i, frame in enumerate(weather):
+        if not frame.index.equals(time):
+            frame = frame.reindex(time)
+        for col in WEATHER_COLUMNS:
+            stacked[col][i] = frame[col].to_numpy(dtype=float)
+    return time, stacked
+
+
+def get_fleet_forecasts(sites, fm, daysahead, weather=None, engine='pvlib', outputs=None,
+                        dtype=np.float64, freq=UPSAMPLE_FREQ):
+    # Forecast every row of `sites` for the next `daysahead` days. Returns a
+    # dict with 'time', 'sites' (the sites index) and one (n_sites, n_times)
+    # array per output: POA_COLUMNS, 'pvtemp', DC_COLUMNS and 'p_ac'.
+    # engine='fused' (or 'numba'/'numpy') runs kernel.run_chain instead of the
+    # pvlib functions, computing only `outputs` (default kernel.DEFAULT_OUTPUTS)
+    # in `dtype`. With freq the weather is upsampled to that timestep for all
+    # sites at once (upsample.upsample_arrays).
+    missing = [col for col in SITE_COLUMNS if col not in sites.columns]
+    if missing:
+        raise ValueError('sites is missing columns: {}'.format(', '.join(missing)))
+    start, end = forecast_window(daysahead)
+    time, weather = fleet_weather(sites, fm, start, end, weather)
+
+    def column(name):
+        return sites[name].to_numpy(dtype=float)[:, None]
+
+    if freq and len(time) > 1:
+        from upsample import upsample_arrays
+        time, weather = upsample_arrays(time, weather, column('latitude'), column('longitude'), freq)
+    solpos = fleet_solpos(time, column('latitude'), column('longitude'))
+    dni_extra = np.asarray(irradiance.get_extra_radiation(time))[None, :]
+    airmass = atmosphere.get_relative_airmass(solpos['apparent_zenith'])
+    module = sam_parameters(sites['pvmanf'], sites['pvmodel'])
+    invertermodel = sam_parameters(sites['invmanf'], sites['invmodel'])
+    args = (solpos, dni_extra, airmass, weather,
+            column('surface_tilt'), column('surface_azimuth'), column('albedo'),
+            module, invertermodel)
+    if engine == 'pvlib':
+        out = fleet_power_chain(*args)
+    else:
+        from kernel import run_chain
+        out = run_chain(*args, outputs=outputs, dtype=dtype,
+                        engine='auto' if engine == 'fused' else engine)
+    out['time'] = time
+    out['sites'] = sites.index
+    return out
+
+
+def site_forecast(fleet_out, i):
+    # Results of site number i in get_forecasts form:
+    # (poa_irrad, pvtemp, dc_out, ac_out).
+    time = fleet_out['time']
+    poa_irrad = pd.DataFrame({name: fleet_out[name][i] for name in POA_COLUMNS}, index=time)
+    pvtemp = pd.Series(fleet_out['pvtemp'][i], index=time)
+    dc_out = pd.DataFrame({name: fleet_out[name][i] for name in DC_COLUMNS}, index=time)
+    ac_out = pd.Series(fleet_out['p_ac'][i], index=time)
+    return poa_irrad, pvtemp, dc_out, ac_out
+
+
+def fleet_frame(fleet_out, name):
+    # One output as a (time x site) DataFrame.
+    return pd.DataFrame(fleet_out[name].T, index=fleet_out['time'], columns=fleet_out['sites'])
@@ -0,0 +1,156 @@
+# Incremental forecasts across NWP cycles.
+#
+# When a new model cycle is published, get_forecasts rebuilds the whole
+# start -> start + daysahead horizon. Every step of the modelling chain is
+# pointwise in time, so only the timesteps whose weather inputs changed have
+# to be recomputed. IncrementalForecaster keeps, per site, the weather and
+# the results of the previous run; a new run diffs the new forecast_data
+# against them, models only new or changed timesteps, overwrites/appends
+# those rows in the stored results and keeps past timesteps as they were.
+# With INCREMENTAL_DIR set the states are also pickled there; the directory
+# is a private spool directory like the job queue's (jobs.spool_dir) and
+# only state files owned by this user are unpickled.
+
+import hashlib
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+from jobs import owned_file, spool_dir
+from pvgeneration import (forecast_window, get_forecast_model, get_weather_data, model_forecasts,
+                          upsample_weather_data)
+
+
+# Weather columns the modelling chain reads; changes in others are ignored.
+INPUT_COLUMNS = ['ghi', 'dni', 'dhi', 'temp_air', 'wind_speed']
+
+INCREMENTAL_DIR = os.environ.get('INCREMENTAL_DIR')
+
+
+def site_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata, fm):
+    model = fm if isinstance(fm, str) else getattr(fm, 'cache_name', type(fm).__name__)
+    return (round(float(latitude), 4), round(float(longitude), 4), float(surface_tilt),
+            float(surface_azimuth), float(albedo), pvmoduledata['pvmanf'], pvmoduledata['pvmodel'],
+            inverterdata['invmanf'], inverterdata['invmodel'], model)
+
+
+def changed_rows(previous, current, atol=1e-6):
+    # Boolean Series over current.index: True where the timestep is new or
+    # one of the INPUT_COLUMNS differs from the previous weather.
+    changed = pd.Series(True, index=current.index)
+    common = current.index.intersection(previous.index)
+    if len(common):
+        old = previous.loc[common, INPUT_COLUMNS].to_numpy(dtype=float)
+        new = current.loc[common, INPUT_COLUMNS].to_numpy(dtype=float)
+        same = np.isclose(old, new, rtol=0, atol=atol, equal_nan=True).all(axis=1)
+        changed[common] = ~same
+    return changed
+
+
+def _merge(previous, update, index):
+    # previous rows, overwritten/extended by update, restricted to index.
+    if previous is None:
+        return update.reindex(index)
+    merged = pd.concat([previous[~previous.index.isin(update.index)], update]).sort_index()
+    return merged.reindex(index)
+
+
+class IncrementalForecaster(object):
+
+    def __init__(self, state_dir=INCREMENTAL_DIR):
+        self.state_dir = spool_dir(state_dir) if state_dir else state_dir
+        self._states = {}   # site key -> {'forecast_data': ..., 'results': (poa_irrad, pvtemp, dc_out, ac_out)}
+        self._lock = threading.Lock()
+        self.last_stats = None
+
+    def _path(self, key):
+        return os.path.join(self.state_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def _load(self, key):
+        state = self._states.get(key)
+        if state is None and self.state_dir and owned_file(self._path(key)):
+            try:
+                with open(self._path(key), 'rb') as f:
+                    state = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                state = None
+        return state
+
+    def _save(self, key, state):
+        self._states[key] = state
+        if self.state_dir:
+            path = self._path(key)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            try:
+                with open(tmp, 'wb') as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    def forecast(self, latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                 inverterdata, fm, daysahead, now=None):
+        # Same arguments and return value as get_forecasts.
+        key = site_key(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                       pvmoduledata, inverterdata, fm)
+        start, end = forecast_window(daysahead)
+        fm = get_forecast_model(fm)
+        # Rows are diffed on the UPSAMPLE_FREQ grid get_forecasts models on.
+        forecast_data = upsample_weather_data(get_weather_data(latitude, longitude, start, end, fm), fm)
+        now = pd.Timestamp.now(tz=forecast_data.index.tz) if now is None else pd.Timestamp(now)
+
+        with self._lock:
+            state = self._load(key)
+            if state is None:
+                changed = pd.Series(True, index=forecast_data.index)
+            else:
+                changed = changed_rows(state['forecast_data'], forecast_data)
+                # Past timesteps that were already modelled are fixed.
+                done = state['results'][0].index
+                changed &= ~((forecast_data.index < now) & forecast_data.index.isin(done))
+
+            if changed.any() or state is None:
+                rows = forecast_data[changed.values]
+                # fm.time drives get_dni_extra, restrict it to the rows being modelled
+                fm.time = rows.index
+                update = model_forecasts(rows, fm, surface_tilt, surface_azimuth, albedo,
+                                         pvmoduledata, inverterdata)
+
+            index = forecast_data.index
+            if state is None:
+                results = update
+                weather = forecast_data
+            else:
+                if changed.any():
+                    results = tuple(_merge(old, new, index) for old, new in zip(state['results'], update))
+                else:
+                    results = tuple(old.reindex(index) for old in state['results'])
+                # Keep the weather the stored results were modelled with.
+                weather = _merge(state['forecast_data'], forecast_data[changed.values], index)
+            self._save(key, {'forecast_data': weather, 'results': results})
+            self.last_stats = {'timesteps': len(forecast_data), 'recomputed': int(changed.sum())}
+        return results
+
+    def forget(self, *args):
+        # Drop the stored state of one site (same arguments as site_key).
+        key = site_key(*args)
+        with self._lock:
+            self._states.pop(key, None)
+            if self.state_dir:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+
+incremental_forecaster = IncrementalForecaster()
+
+
+def get_forecasts_incremental(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                              pvmoduledata, inverterdata, fm, daysahead):
+    # Drop-in replacement for get_forecasts that reuses the previous run.
+    return incremental_forecaster.forecast(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                                           pvmoduledata, inverterdata, fm, daysahead)
@@ -0,0 +1,209 @@
+# Background execution of forecast jobs.
+#
+# A forecast (NWP pull + modelling) can take tens of seconds, too long to run
+# inside a request. Jobs are run on a bounded thread pool instead and the
+# caller gets a job id to poll. The pool is per process; job states and
+# results are also spooled to JOBS_DIR so a poll that lands on another
+# gunicorn worker still finds them. Spooled files are pickles, so the
+# directory has to be private: it is created with mode 0700 and checked to
+# belong to this user alone (one that does not is replaced by a fresh
+# tempfile.mkdtemp() directory), and only files owned by this user are
+# unpickled from it.
+#
+#     job_id = job_queue.submit(get_forecasts, lat, lon, ...)
+#     job_queue.status(job_id)  # {'state': 'running', 'result': None, 'error': None}
+#
+# A job function may also be a generator: every item it yields is appended
+# to the result list, which is published while the job is still running.
+
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Private per-user directory holding the spool directories (see also
+# singleflight.py).
+SPOOL_DIR = os.environ.get('SPOOL_DIR', os.path.join(tempfile.gettempdir(),
+                                                     'solarapp-{}'.format(getattr(os, 'getuid', lambda: 0)())))
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(SPOOL_DIR, 'jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 8))
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+
+class QueueFull(Exception):
+    # Raised by JobQueue.submit when max_pending jobs are already queued or
+    # running in this process.
+    pass
+
+
+def _owned(st):
+    return not hasattr(os, 'getuid') or st.st_uid == os.getuid()
+
+
+def private_dir(path):
+    # Create path with mode 0700, or check that the existing one is a real
+    # directory owned by this user that no one else can access. Raises
+    # OSError if it is not.
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or not _owned(st) or stat.S_IMODE(st.st_mode) & 0o077:
+        raise OSError('{} is not a private directory of this user'.format(path))
+    return path
+
+
+def spool_dir(path):
+    # path checked with private_dir, or a new private directory if it fails
+    # the checks. Called at import, so with gunicorn --preload all workers
+    # get the same directory.
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        return private_dir(path)
+    except OSError:
+        return tempfile.mkdtemp(prefix='solarapp-')
+
+
+def owned_file(path):
+    # True if path is a regular file (not a link) owned by this user: the
+    # only files read back from a spool directory.
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and _owned(st)
+
+
+class JobQueue(object):
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, job_dir=JOBS_DIR,
+                 ttl=3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_dir = spool_dir(job_dir) if job_dir else job_dir
+        self.ttl = ttl
+        self._executor = None
+        self._jobs = {}         # job id -> status dict
+        self._pending = 0
+        self._keys = {}         # submit_once key -> job id
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so the pool's threads are started in the worker after
+        # gunicorn forks, not in the preloading master.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull('{} forecast jobs are already pending'.format(self._pending))
+            self._pending += 1
+            executor = self._get_executor()
+        job_id = uuid.uuid4().hex
+        self._set(job_id, PENDING)
+        self.purge()
+        executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def submit_once(self, key, fn, *args, **kwargs):
+        # Like submit, but returns the id of the pending or running job
+        # submitted under the same key, if there is one in this process.
+        with self._lock:
+            job_id = self._keys.get(key)
+            if job_id is not None and self._jobs[job_id]['state'] in (PENDING, RUNNING):
+                return job_id
+        job_id = self.submit(fn, *args, **kwargs)
+        with self._lock:
+            if self._jobs[job_id]['state'] in (PENDING, RUNNING):
+                self._keys[key] = job_id
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        try:
+            self._set(job_id, RUNNING)
+            result = fn(*args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                items = []
+                for item in result:
+                    items.append(item)
+                    self._set(job_id, RUNNING, result=list(items))
+                result = items
+        except Exception as exc:
+            self._set(job_id, ERROR, error='{}: {}'.format(type(exc).__name__, exc))
+        else:
+            self._set(job_id, DONE, result=result)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                for key in [k for k, j in self._keys.items() if j == job_id]:
+                    del self._keys[key]
+
+    def _path(self, job_id):
+        return os.path.join(self.job_dir, '{}.pkl'.format(job_id))
+
+    def _set(self, job_id, state, result=None, error=None):
+        status = {'state': state, 'result': result, 'error': error, 'updated': time.time()}
+        with self._lock:
+            self._jobs[job_id] = status
+        if not self.job_dir:
+            return
+        try:
+            tmp = '{}.{}.tmp'.format(self._path(job_id), os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(status, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(job_id))
+        except (OSError, pickle.PicklingError):
+            pass
+
+    def status(self, job_id):
+        # Status dict of a job, or None for an unknown/expired job id.
+        with self._lock:
+            status = self._jobs.get(job_id)
+        if status is not None:
+            return status
+        if not self.job_dir or not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        path = self._path(job_id)
+        if not owned_file(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def purge(self):
+        # Forget finished jobs older than ttl seconds.
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [j for j, s in self._jobs.items()
+                           if s['state'] in (DONE, ERROR) and s['updated'] < cutoff]:
+                del self._jobs[job_id]
+        if not self.job_dir:
+            return
+        try:
+            for fname in os.listdir(self.job_dir):
+                path = os.path.join(self.job_dir, fname)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+
+# Process-wide queue used by the dashboard.
+job_queue = JobQueue()
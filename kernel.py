@@ -0,0 +1,265 @@
+# Fused POA -> cell temperature -> SAPM -> inverter kernel.
+#
+# The pvlib path (fleet.fleet_power_chain, and get_forecasts step by step)
+# allocates a new array or Series at every step and always computes every SAPM
+# output. run_chain evaluates the same equations in one pass over contiguous
+# buffers and only writes the requested outputs. Two engines:
+# * 'numba' - one JIT compiled loop over (row, time); used when numba is
+#             installed
+# * 'numpy' - the same equations as whole-array NumPy expressions, skipping
+#             the stages no requested output depends on
+# dtype=np.float32 halves the memory traffic; results then agree with the
+# pvlib path to float32 precision, float64 results to ~1e-9.
+#
+# Inputs follow fleet_power_chain: site level arrays (solar position,
+# dni_extra, airmass), the weather columns, (n, 1) orientation/albedo columns
+# or scalars, and module/inverter parameters as a SAM entry or the
+# {parameter: (n, 1)} dicts of fleet.sam_parameters.
+
+import numpy as np
+
+from pvlib import temperature
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+OUTPUTS = ['poa_global', 'poa_direct', 'poa_diffuse', 'poa_sky_diffuse', 'poa_ground_diffuse',
+           'pvtemp', 'i_sc', 'i_mp', 'v_oc', 'v_mp', 'p_mp', 'i_x', 'i_xx', 'p_ac']
+# Everything get_forecasts returns except the unplotted i_x/i_xx.
+DEFAULT_OUTPUTS = [name for name in OUTPUTS if name not in ('i_x', 'i_xx')]
+
+MODULE_PARAMS = ['A0', 'A1', 'A2', 'A3', 'A4', 'B0', 'B1', 'B2', 'B3', 'B4', 'B5', 'FD',
+                 'Isco', 'Impo', 'Voco', 'Vmpo', 'Aisc', 'Aimp', 'Bvoco', 'Mbvoc', 'Bvmpo', 'Mbvmp',
+                 'N', 'Cells_in_Series', 'IXO', 'IXXO', 'C0', 'C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7']
+INVERTER_PARAMS = ['Paco', 'Pdco', 'Vdco', 'Pso', 'C0', 'C1', 'C2', 'C3', 'Pnt']
+
+THERMAL_PARAMS = temperature.TEMPERATURE_MODEL_PARAMETERS['sapm']['open_rack_glass_polymer']
+
+# Boltzmann constant and elementary charge (scipy.constants k and e, as in pvsystem.sapm).
+KB = 1.380649e-23
+Q = 1.602176634e-19
+
+
+def _param_matrix(params, names, rows, dtype):
+    # (rows x len(names)) matrix of coefficients from a SAM entry or a dict of
+    # (n, 1) columns.
+    out = np.empty((rows, len(names)), dtype=dtype)
+    for j, name in enumerate(names):
+        out[:, j] = np.broadcast_to(np.asarray(params[name], dtype=float).reshape(-1), (rows,))
+    return out
+
+
+def _kernel(zen, azi, dni_extra, airmass, dni, dhi, ghi, temp_air, wind_speed,
+            tilt, surface_azimuth, albedo, mod, inv, a, b, deltaT, slots, out):
+    # Scalar version of the pvlib chain for every (row, time); written to be
+    # compiled by numba, slots[k] is the out index of OUTPUTS[k] or -1.
+    nan = np.nan
+    rows, times = out.shape[1], out.shape[2]
+    for r in range(rows):
+        cos_tilt = np.cos(np.radians(tilt[r]))
+        sin_tilt = np.sin(np.radians(tilt[r]))
+        term2 = 0.5 * (1 + cos_tilt)
+        ground_factor = albedo[r] * (1 - cos_tilt) * 0.5
+        for t in range(times):
+            cos_zen = np.cos(np.radians(zen[r, t]))
+            projection = (cos_tilt * cos_zen + sin_tilt * np.sin(np.radians(zen[r, t])) *
+                          np.cos(np.radians(azi[r, t] - surface_azimuth[r])))
+            if projection > 1:
+                projection = 1.
+            elif projection < -1:
+                projection = -1.
+            aoi = np.degrees(np.arccos(projection))
+            # haydavies
+            cos_tt = projection if (projection > 0 or projection != projection) else 0.
+            Rb = cos_tt / max(cos_zen, 0.01745) if cos_zen == cos_zen else nan
+            AI = dni[r, t] / dni_extra[r, t]
+            iso = dhi[r, t] * (1 - AI) * term2
+            circ = dhi[r, t] * (AI * Rb)
+            sky = ((iso if (iso > 0 or iso != iso) else 0.) +
+                   (circ if (circ > 0 or circ != circ) else 0.))
+            ground = ghi[r, t] * ground_factor
+            direct = dni[r, t] * np.cos(np.radians(aoi))
+            if direct < 0:
+                direct = 0.
+            diffuse = sky + ground
+            poa_global = direct + diffuse
+            for k, value in ((0, poa_global), (1, direct), (2, diffuse), (3, sky), (4, ground)):
+                if slots[k] >= 0:
+                    out[slots[k], r, t] = value
+            # sapm_cell
+            temp_cell = (poa_global * np.exp(a + b * wind_speed[r, t]) + temp_air[r, t] +
+                         poa_global / 1000. * deltaT)
+            if slots[5] >= 0:
+                out[slots[5], r, t] = temp_cell
+            # sapm_effective_irradiance
+            am = airmass[r, t]
+            f1 = (((mod[r, 4] * am + mod[r, 3]) * am + mod[r, 2]) * am + mod[r, 1]) * am + mod[r, 0]
+            if f1 != f1 or f1 < 0:
+                f1 = 0.
+            f2 = ((((mod[r, 10] * aoi + mod[r, 9]) * aoi + mod[r, 8]) * aoi + mod[r, 7]) * aoi +
+                  mod[r, 6]) * aoi + mod[r, 5]
+            if f2 < 0 or aoi < 0:
+                f2 = 0.
+            Ee = f1 * (direct * f2 + mod[r, 11] * diffuse) / 1000.
+            # sapm
+            if Ee > 0:
+                logEe = np.log(Ee)
+            elif Ee == 0:
+                logEe = -np.inf
+            else:
+                logEe = nan
+            dT = temp_cell - 25
+            delta = mod[r, 22] * KB * (temp_cell + 273.15) / Q
+            cis = mod[r, 23]
+            i_sc = mod[r, 12] * Ee * (1 + mod[r, 16] * dT)
+            i_mp = mod[r, 13] * (mod[r, 26] * Ee + mod[r, 27] * Ee ** 2) * (1 + mod[r, 17] * dT)
+            v_oc = mod[r, 14] + cis * delta * logEe + (mod[r, 18] + mod[r, 19] * (1 - Ee)) * dT
+            if v_oc < 0:
+                v_oc = 0.
+            v_mp = (mod[r, 15] + mod[r, 28] * cis * delta * logEe +
+                    mod[r, 29] * cis * (delta * logEe) ** 2 +
+                    (mod[r, 20] + mod[r, 21] * (1 - Ee)) * dT)
+            if v_mp < 0:
+                v_mp = 0.
+            p_mp = i_mp * v_mp
+            for k, value in ((6, i_sc), (7, i_mp), (8, v_oc), (9, v_mp), (10, p_mp)):
+                if slots[k] >= 0:
+                    out[slots[k], r, t] = value
+            if slots[11] >= 0:
+                out[slots[11], r, t] = (mod[r, 24] * (mod[r, 30] * Ee + mod[r, 31] * Ee ** 2) *
+                                        (1 + mod[r, 16] * dT))
+            if slots[12] >= 0:
+                out[slots[12], r, t] = (mod[r, 25] * (mod[r, 32] * Ee + mod[r, 33] * Ee ** 2) *
+                                        (1 + mod[r, 16] * dT))
+            # inverter.sandia
+            if slots[13] >= 0:
+                dv = v_mp - inv[r, 2]
+                A = inv[r, 1] * (1 + inv[r, 5] * dv)
+                B = inv[r, 3] * (1 + inv[r, 6] * dv)
+                C = inv[r, 4] * (1 + inv[r, 7] * dv)
+                p_ac = (inv[r, 0] / (A - B) - C * (A - B)) * (p_mp - B) + C * (p_mp - B) ** 2
+                if p_ac > inv[r, 0]:
+                    p_ac = inv[r, 0]
+                if p_mp < inv[r, 3]:
+                    p_ac = -abs(inv[r, 8])
+                out[slots[13], r, t] = p_ac
+
+
+_jit_kernel = numba.njit(cache=True, nogil=True)(_kernel) if numba is not None else None
+
+
+def _polyval(coeffs, x):
+    # np.polyval for per-row coefficient columns.
+    y = np.zeros_like(x)
+    for c in coeffs:
+        y = y * x + c
+    return y
+
+
+def _numpy_chain(zen, azi, dni_extra, airmass, dni, dhi, ghi, temp_air, wind_speed,
+                 tilt, surface_azimuth, albedo, mod, inv, a, b, deltaT, wanted):
+    # The chain as array expressions; stages no wanted output needs are skipped.
+    out = {}
+    m = {name: mod[:, [j]] for j, name in enumerate(MODULE_PARAMS)}
+    tilt = tilt[:, None]
+    cos_tilt = np.cos(np.radians(tilt))
+    cos_zen = np.cos(np.radians(zen))
+    projection = (cos_tilt * cos_zen + np.sin(np.radians(tilt)) * np.sin(np.radians(zen)) *
+                  np.cos(np.radians(azi - surface_azimuth[:, None])))
+    np.clip(projection, -1, 1, out=projection)
+    aoi = np.degrees(np.arccos(projection))
+    Rb = np.maximum(projection, 0) / np.maximum(cos_zen, 0.01745)
+    AI = dni / dni_extra
+    sky = (np.maximum(dhi * (1 - AI) * (0.5 * (1 + cos_tilt)), 0) +
+           np.maximum(dhi * (AI * Rb), 0))
+    ground = ghi * albedo[:, None] * (1 - cos_tilt) * 0.5
+    direct = np.maximum(dni * np.cos(np.radians(aoi)), 0)
+    diffuse = sky + ground
+    poa_global = direct + diffuse
+    out.update(poa_global=poa_global, poa_direct=direct, poa_diffuse=diffuse,
+               poa_sky_diffuse=sky, poa_ground_diffuse=ground)
+    if not wanted & set(OUTPUTS[5:]):
+        return out
+
+    temp_cell = poa_global * np.exp(a + b * wind_speed) + temp_air + poa_global / 1000. * deltaT
+    out['pvtemp'] = temp_cell
+    if not wanted & set(OUTPUTS[6:]):
+        return out
+
+    f1 = _polyval([m['A4'], m['A3'], m['A2'], m['A1'], m['A0']], airmass)
+    f1 = np.maximum(0, np.where(np.isnan(f1), 0, f1))
+    f2 = _polyval([m['B5'], m['B4'], m['B3'], m['B2'], m['B1'], m['B0']], aoi)
+    f2 = np.where(aoi < 0, 0, np.maximum(f2, 0))
+    Ee = f1 * (direct * f2 + m['FD'] * diffuse) / 1000.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logEe = np.where(Ee > 0, np.log(np.where(Ee > 0, Ee, 1)), np.where(Ee == 0, -np.inf, np.nan))
+        dT = temp_cell - 25
+        delta = m['N'] * KB * (temp_cell + 273.15) / Q
+        cis = m['Cells_in_Series']
+        if 'i_sc' in wanted:
+            out['i_sc'] = m['Isco'] * Ee * (1 + m['Aisc'] * dT)
+        if 'v_oc' in wanted:
+            out['v_oc'] = np.maximum(0, m['Voco'] + cis * delta * logEe + (m['Bvoco'] + m['Mbvoc'] * (1 - Ee)) * dT)
+        if 'i_x' in wanted:
+            out['i_x'] = m['IXO'] * (m['C4'] * Ee + m['C5'] * Ee ** 2) * (1 + m['Aisc'] * dT)
+        if 'i_xx' in wanted:
+            out['i_xx'] = m['IXXO'] * (m['C6'] * Ee + m['C7'] * Ee ** 2) * (1 + m['Aisc'] * dT)
+        if wanted & {'i_mp', 'v_mp', 'p_mp', 'p_ac'}:
+            i_mp = m['Impo'] * (m['C0'] * Ee + m['C1'] * Ee ** 2) * (1 + m['Aimp'] * dT)
+            v_mp = np.maximum(0, m['Vmpo'] + m['C2'] * cis * delta * logEe +
+                              m['C3'] * cis * (delta * logEe) ** 2 + (m['Bvmpo'] + m['Mbvmp'] * (1 - Ee)) * dT)
+            p_mp = i_mp * v_mp
+            out.update(i_mp=i_mp, v_mp=v_mp, p_mp=p_mp)
+        if 'p_ac' in wanted:
+            i = {name: inv[:, [j]] for j, name in enumerate(INVERTER_PARAMS)}
+            dv = out['v_mp'] - i['Vdco']
+            A = i['Pdco'] * (1 + i['C1'] * dv)
+            B = i['Pso'] * (1 + i['C2'] * dv)
+            C = i['C0'] * (1 + i['C3'] * dv)
+            p_ac = (i['Paco'] / (A - B) - C * (A - B)) * (out['p_mp'] - B) + C * (out['p_mp'] - B) ** 2
+            p_ac = np.minimum(i['Paco'], p_ac)
+            out['p_ac'] = np.where(out['p_mp'] < i['Pso'], -np.abs(i['Pnt']), p_ac)
+    return out
+
+
+def run_chain(solpos, dni_extra, airmass, weather, surface_tilt, surface_azimuth, albedo,
+              module, invertermodel, outputs=None, dtype=np.float64, engine='auto',
+              thermal_params=THERMAL_PARAMS):
+    # Fused equivalent of fleet.fleet_power_chain. Returns {output: (rows x
+    # times) array} for the requested outputs (default DEFAULT_OUTPUTS).
+    outputs = list(DEFAULT_OUTPUTS if outputs is None else outputs)
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown:
+        raise ValueError('unknown outputs: {}'.format(', '.join(unknown)))
+    if engine == 'auto':
+        engine = 'numba' if _jit_kernel is not None else 'numpy'
+    if engine == 'numba' and _jit_kernel is None:
+        raise ValueError("engine='numba' requires numba to be installed")
+    if engine not in ('numba', 'numpy'):
+        raise ValueError('unknown engine {!r}'.format(engine))
+
+    series = [solpos['apparent_zenith'], solpos['azimuth'], dni_extra, airmass,
+              weather['dni'], weather['dhi'], weather['ghi'], weather['temp_air'], weather['wind_speed']]
+    series = [np.atleast_2d(np.asarray(x, dtype=dtype)) for x in series]
+    columns = [np.asarray(x, dtype=dtype).reshape(-1) for x in (surface_tilt, surface_azimuth, albedo)]
+    shape = np.broadcast(*series, *[x[:, None] for x in columns]).shape
+    rows, times = shape
+    series = [np.broadcast_to(x, shape) for x in series]
+    columns = [np.ascontiguousarray(np.broadcast_to(x, (rows,))) for x in columns]
+    mod = _param_matrix(module, MODULE_PARAMS, rows, dtype)
+    inv = _param_matrix(invertermodel, INVERTER_PARAMS, rows, dtype)
+    a, b, deltaT = (np.dtype(dtype).type(thermal_params[k]) for k in ('a', 'b', 'deltaT'))
+
+    if engine == 'numpy':
+        result = _numpy_chain(*series, *columns, mod, inv, a, b, deltaT, set(outputs))
+        return {name: np.ascontiguousarray(result[name], dtype=dtype) for name in outputs}
+
+    slots = np.full(len(OUTPUTS), -1, dtype=np.int64)
+    for n, name in enumerate(outputs):
+        slots[OUTPUTS.index(name)] = n
+    out = np.empty((len(outputs), rows, times), dtype=dtype)
+    _jit_kernel(*series, *columns, mod, inv, a, b, deltaT, slots, out)
+    return {name: out[n] for n, name in enumerate(outputs)}
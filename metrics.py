@@ -0,0 +1,158 @@
+# Per-stage timing and counters for forecasts and the dashboard.
+#
+# Stages are wrapped with @timed('stage') (or `with timer('stage'):`) and
+# record their latency into a fixed-bucket histogram; count() adds to
+# counters such as bytes fetched or rows processed, and register_gauges()
+# adds values read at scrape time (cache statistics, queue length). render()
+# gives everything in the Prometheus text format, app.py serves it on
+# /metrics.
+#
+# Collection is off unless METRICS=1 (or enable() is called); disabled, a
+# timed stage costs one flag check. Metrics are per process: every gunicorn
+# worker reports its own.
+
+import bisect
+import functools
+import os
+import re
+import threading
+import time
+
+
+METRICS_ENABLED = os.environ.get('METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+PREFIX = 'solarapp'
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_histograms = {}    # stage -> [per-bucket counts, sum of seconds, count]
+_counters = {}      # name -> value
+_gauges = {}        # prefix -> function returning {name: value}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def observe(stage, seconds):
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = [[0] * len(BUCKETS), 0.0, 0]
+        hist[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+
+def count(name, value=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class _Timer(object):
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timer(stage):
+    # Context manager timing its block as `stage`.
+    return _Timer(stage) if enabled else _null_timer
+
+
+def timed(stage):
+    # Decorator timing every call of the function as `stage`.
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def register_gauges(prefix, fn):
+    # fn() -> {name: number}, read on every render() as <prefix>_<name>.
+    _gauges[prefix] = fn
+
+
+def snapshot():
+    # Plain dict copy of the histograms and counters.
+    with _lock:
+        return {'histograms': {stage: {'buckets': list(hist[0]), 'sum': hist[1], 'count': hist[2]}
+                               for stage, hist in _histograms.items()},
+                'counters': dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _name(name):
+    return re.sub('[^a-zA-Z0-9_]', '_', str(name))
+
+
+def render():
+    # All metrics in the Prometheus text exposition format.
+    data = snapshot()
+    lines = []
+    if not enabled:
+        lines.append('# metrics collection is disabled, set METRICS=1 to enable it')
+    name = '{}_stage_seconds'.format(PREFIX)
+    lines.append('# TYPE {} histogram'.format(name))
+    for stage, hist in sorted(data['histograms'].items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, hist['buckets']):
+            cumulative += n
+            lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, _le(bound), cumulative))
+        lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, repr(hist['sum'])))
+        lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, hist['count']))
+    for counter, value in sorted(data['counters'].items()):
+        counter = '{}_{}_total'.format(PREFIX, _name(counter))
+        lines.append('# TYPE {} counter'.format(counter))
+        lines.append('{} {}'.format(counter, value))
+    for prefix, fn in sorted(_gauges.items()):
+        try:
+            values = fn()
+        except Exception:
+            continue
+        for key, value in sorted(values.items()):
+            gauge = '{}_{}_{}'.format(PREFIX, _name(prefix), _name(key))
+            lines.append('# TYPE {} gauge'.format(gauge))
+            lines.append('{} {}'.format(gauge, value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,94 @@
+# Monte Carlo uncertainty bands for the power forecast.
+#
+# The forecast weather is perturbed n_samples times and every sample is run
+# through the power chain as one (sample x time) array pass
+# (fleet.fleet_power_chain: POA, sapm_cell, SAPM, Sandia inverter), with the
+# solar position, extraterrestrial radiation and airmass computed once. The
+# perturbations (UNCERTAINTY) are
+# * irradiance: relative errors of ghi/dni/dhi sharing one AR(1) noise series
+#   per sample, so errors persist over a few timesteps like cloud timing
+#   errors do;
+# * temp_air: additive AR(1) error, wind_speed: relative error;
+# * albedo: one value per sample.
+# Quantiles of AC power are taken across the samples, e.g. P10/P50/P90.
+
+import numpy as np
+import pandas as pd
+
+from fleet import WEATHER_COLUMNS, fleet_power_chain
+from pvgeneration import (forecast_window, get_airmass, get_dni_extra, get_forecast_model,
+                          get_invertermodel, get_pvmodule, get_solpos, get_weather_data, model_forecasts,
+                          upsample_weather_data)
+
+
+UNCERTAINTY = {
+    'ghi': 0.15,          # relative standard deviation
+    'dni': 0.25,
+    'dhi': 0.15,
+    'temp_air': 1.5,      # degrees C
+    'wind_speed': 0.3,    # relative
+    'albedo': 0.05,       # absolute
+    'autocorrelation': 0.8,
+}
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def ar1_noise(rng, n_samples, n_times, rho):
+    # (n_samples, n_times) standard normal noise, AR(1) correlated in time.
+    # scipy.signal is only imported here, it is slow to import with the app.
+    from scipy.signal import lfilter
+    e = rng.standard_normal((n_samples, n_times))
+    e[:, 0] /= np.sqrt(1 - rho ** 2)
+    return lfilter([np.sqrt(1 - rho ** 2)], [1, -rho], e, axis=1)
+
+
+def perturb_weather(forecast_data, albedo, n_samples, uncertainty=UNCERTAINTY, seed=0):
+    # ({column: (n_samples, n_times)}, albedo (n_samples, 1)) of perturbed inputs.
+    rng = np.random.RandomState(seed)
+    n_times = len(forecast_data)
+    rho = uncertainty['autocorrelation']
+    cloud = ar1_noise(rng, n_samples, n_times, rho)
+    weather = {}
+    for col in ('ghi', 'dni', 'dhi'):
+        base = forecast_data[col].to_numpy(dtype=float)[None, :]
+        weather[col] = np.maximum(base * (1 + uncertainty[col] * cloud), 0)
+    weather['temp_air'] = (forecast_data['temp_air'].to_numpy(dtype=float)[None, :]
+                           + uncertainty['temp_air'] * ar1_noise(rng, n_samples, n_times, rho))
+    weather['wind_speed'] = np.maximum(
+        forecast_data['wind_speed'].to_numpy(dtype=float)[None, :]
+        * (1 + uncertainty['wind_speed'] * rng.standard_normal((n_samples, n_times))), 0)
+    albedo = np.clip(albedo + uncertainty['albedo'] * rng.standard_normal((n_samples, 1)), 0, 1)
+    return {col: weather[col] for col in WEATHER_COLUMNS}, albedo
+
+
+def sample_forecasts(forecast_data, fm, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata,
+                     n_samples=1000, uncertainty=UNCERTAINTY, seed=0):
+    # fleet_power_chain outputs for n_samples perturbations of forecast_data,
+    # {output: (n_samples, n_times)}; fm.location/fm.time as after the pull.
+    solpos = get_solpos(forecast_data, fm)
+    dni_extra = np.asarray(get_dni_extra(fm), dtype=float)[None, :]
+    airmass = np.asarray(get_airmass(solpos), dtype=float)[None, :]
+    solpos = {col: solpos[col].to_numpy(dtype=float)[None, :] for col in ('apparent_zenith', 'azimuth')}
+    weather, albedo = perturb_weather(forecast_data, albedo, n_samples, uncertainty, seed)
+    return fleet_power_chain(solpos, dni_extra, airmass, weather, surface_tilt, surface_azimuth, albedo,
+                             get_pvmodule(pvmoduledata), get_invertermodel(inverterdata))
+
+
+def get_forecast_quantiles(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                           inverterdata, fm, daysahead, n_samples=1000, quantiles=QUANTILES,
+                           uncertainty=UNCERTAINTY, seed=0):
+    # Returns a dict with
+    # * 'forecast'    - the deterministic (poa_irrad, pvtemp, dc_out, ac_out)
+    # * 'ac_quantiles' - DataFrame of AC power quantiles, columns 'p10', 'p50', ...
+    # * 'n_samples'
+    start, end = forecast_window(daysahead)
+    fm = get_forecast_model(fm)
+    forecast_data = upsample_weather_data(get_weather_data(latitude, longitude, start, end, fm), fm)
+    forecast = model_forecasts(forecast_data, fm, surface_tilt, surface_azimuth, albedo,
+                               pvmoduledata, inverterdata)
+    samples = sample_forecasts(forecast_data, fm, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                               inverterdata, n_samples, uncertainty, seed)
+    values = np.nanquantile(samples['p_ac'], quantiles, axis=0)
+    ac_quantiles = pd.DataFrame(values.T, index=forecast_data.index,
+                                columns=['p{:g}'.format(100 * q) for q in quantiles])
+    return {'forecast': forecast, 'ac_quantiles': ac_quantiles, 'n_samples': n_samples}
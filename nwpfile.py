@@ -0,0 +1,208 @@
+# Forecasts from locally stored NWP model output.
+#
+# Instead of one remote NCSS query per point (fm.get_processed_data), a model
+# cycle is downloaded once as a netCDF file (e.g. an NCSS grid subset with
+# the variables of the pvlib model class, accept=netcdf4) and read locally:
+# * NWPFile opens the file lazily (netCDF4 only reads the slabs that are
+#   sliced) and builds a KD-tree over the model grid, on 3-D unit vectors so
+#   distances are right across the dateline and near the poles;
+# * extract() maps thousands of sites to their nearest grid points in one
+#   query and reads every variable as one bounding-box slab per block of
+#   timesteps, from which all sites are taken with one fancy index;
+# * NWPFileSource is a drop-in forecast model for get_weather_data, fleet
+#   and incremental runs: the raw series of each site go through the
+#   process_data of the matching pvlib model (GFS, NAM, HRRR, ...), so the
+#   processed frames are the same as those of a remote pull.
+#
+#     fm = NWPFileSource('GFS', 'gfs_20200827_00.nc')
+#     poa_irrad, pvtemp, dc_out, ac_out = get_forecasts(lat, lon, 30, 180, 0.2, pvmoduledata,
+#                                                       inverterdata, fm, 7)
+#
+# Grids need latitude/longitude coordinates (1-D, or 2-D as NCSS adds with
+# addLatLon=true); projected x/y grids are converted with pyproj when it is
+# installed. GRIB files are not read directly; convert them to netCDF first
+# (e.g. `wgrib2 file.grb2 -netcdf file.nc`, keeping the pvlib variable names).
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Bytes of one variable slab read at a time by extract().
+SLAB_BYTES = 64 * 2 ** 20
+EARTH_RADIUS_KM = 6371.0
+
+LAT_NAMES = ['lat', 'latitude', 'Latitude', 'LAT']
+LON_NAMES = ['lon', 'longitude', 'Longitude', 'LON']
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _projected_latlon(dataset, ydim, xdim):
+    # 2-D latitudes/longitudes of a projected (x, y) grid, from its CF
+    # grid_mapping; needs pyproj.
+    try:
+        import pyproj
+    except ImportError:
+        raise ValueError('the grid has no latitude/longitude coordinates; install pyproj or '
+                         'download the file with addLatLon=true')
+    mapping = next((v for v in dataset.variables.values() if hasattr(v, 'grid_mapping_name')), None)
+    if mapping is None:
+        raise ValueError('the grid has neither latitude/longitude coordinates nor a grid_mapping')
+    crs = pyproj.CRS.from_cf({name: mapping.getncattr(name) for name in mapping.ncattrs()})
+    x = dataset.variables[xdim]
+    y = dataset.variables[ydim]
+    scale = 1000. if getattr(x, 'units', 'm') == 'km' else 1.
+    xx, yy = np.meshgrid(x[:] * scale, y[:] * scale)
+    lon, lat = pyproj.Transformer.from_crs(crs, 'EPSG:4326', always_xy=True).transform(xx, yy)
+    return lat, lon
+
+
+class NWPFile(object):
+
+    def __init__(self, path):
+        import netCDF4
+        self.path = path
+        self.dataset = netCDF4.Dataset(path)
+        self._tree = None
+        self._load_grid()
+
+    def _load_grid(self):
+        variables = self.dataset.variables
+        lat_name = next((name for name in LAT_NAMES if name in variables), None)
+        lon_name = next((name for name in LON_NAMES if name in variables), None)
+        if lat_name and lon_name and variables[lat_name].ndim == 1:
+            # Regular latitude/longitude grid.
+            self.ydim, self.xdim = variables[lat_name].dimensions[0], variables[lon_name].dimensions[0]
+            self.lons, self.lats = np.meshgrid(variables[lon_name][:], variables[lat_name][:])
+        elif lat_name and lon_name:
+            self.ydim, self.xdim = variables[lat_name].dimensions
+            self.lats, self.lons = variables[lat_name][:], variables[lon_name][:]
+        else:
+            self.ydim, self.xdim = 'y', 'x'
+            self.lats, self.lons = _projected_latlon(self.dataset, self.ydim, self.xdim)
+        self.lats = np.asarray(self.lats, dtype=float)
+        self.lons = np.asarray(self.lons, dtype=float)
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(_unit_vectors(self.lats.ravel(), self.lons.ravel()))
+        return self._tree
+
+    def nearest(self, latitudes, longitudes):
+        # (iy, ix, distance in km) of the grid points closest to the sites.
+        chord, flat = self.tree.query(_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes)))
+        iy, ix = np.unravel_index(flat, self.lats.shape)
+        return iy, ix, 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.))
+
+    def times(self, name):
+        # UTC times of a variable, from its time dimension.
+        import netCDF4
+        var = self.dataset.variables[name]
+        time = self.dataset.variables[var.dimensions[0]]
+        dates = netCDF4.num2date(time[:], time.units, only_use_cftime_datetimes=False,
+                                 only_use_python_datetimes=True)
+        return pd.DatetimeIndex(np.atleast_1d(dates), tz='UTC')
+
+    def _level_index(self, dim, vert_level):
+        # Index along an extra (vertical) dimension: vert_level if the
+        # dimension's coordinate has it, the first level otherwise.
+        coord = self.dataset.variables.get(dim)
+        if vert_level is not None and coord is not None:
+            matches = np.flatnonzero(np.isclose(np.asarray(coord[:], dtype=float), vert_level))
+            if len(matches):
+                return int(matches[0])
+        return 0
+
+    def extract(self, names, latitudes, longitudes, start=None, end=None, vert_level=None):
+        # {name: (times, values (n_sites, n_times))} at the nearest grid points
+        # of the sites, for times within [start, end].
+        iy, ix, _ = self.nearest(latitudes, longitudes)
+        y0, y1, x0, x1 = iy.min(), iy.max() + 1, ix.min(), ix.max() + 1
+        out = {}
+        for name in names:
+            var = self.dataset.variables[name]
+            times = self.times(name)
+            keep = np.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= pd.Timestamp(start)
+            if end is not None:
+                keep &= times <= pd.Timestamp(end)
+            steps = np.flatnonzero(keep)
+            values = np.empty((len(iy), len(steps)))
+            dims = var.dimensions
+            levels = tuple(self._level_index(dim, vert_level) for dim in dims[1:-2])
+            per_step = max((y1 - y0) * (x1 - x0) * var.dtype.itemsize, 1)
+            block = max(SLAB_BYTES // per_step, 1)
+            for b in range(0, len(steps), block):
+                t = steps[b:b + block]
+                slab = var[(slice(t[0], t[-1] + 1),) + levels + (slice(y0, y1), slice(x0, x1))]
+                slab = np.ma.filled(np.ma.asarray(slab, dtype=float), np.nan)[t - t[0]]
+                values[:, b:b + len(t)] = slab[:, iy - y0, ix - x0].T
+            out[name] = (times[steps], values)
+        return out
+
+    def close(self):
+        self.dataset.close()
+
+
+def _offline_model(model):
+    # A pvlib forecast model instance that never connects to the Unidata
+    # catalog; only its variables and process_data are used.
+    from pvlib import forecast
+    cls = getattr(forecast, model)
+
+    class OfflineModel(cls):
+        def connect_to_catalog(self):
+            self.connected = False
+
+    return OfflineModel()
+
+
+class NWPFileSource(object):
+    # Forecast model reading a local file of `model` ('GFS', 'NAM', 'HRRR', ...).
+
+    def __init__(self, model, path):
+        self.model = _offline_model(model)
+        self.file = NWPFile(path)
+        self.model_name = model
+        # Not the remote model's name, so the weather cache does not mix the
+        # file with live pulls.
+        self.cache_name = 'file:{}:{}'.format(model, os.path.basename(path))
+        self.variables = self.model.variables
+        self.output_variables = self.model.output_variables
+
+    def __repr__(self):
+        return 'NWPFileSource({}, {})'.format(self.model_name, self.file.path)
+
+    def set_location(self, tz, latitude, longitude):
+        self.model.set_location(tz, latitude, longitude)
+        self.location = self.model.location
+
+    def get_fleet_data(self, latitudes, longitudes, start, end, **kwargs):
+        # Processed frames of many sites from one vectorized extraction.
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        tz = start.tz or 'UTC'
+        names = [name for name in self.variables.values() if name in self.file.dataset.variables]
+        raw = self.file.extract(names, latitudes, longitudes, start, end, self.model.vert_level)
+        frames = []
+        for i, (lat, lon) in enumerate(zip(np.atleast_1d(latitudes), np.atleast_1d(longitudes))):
+            data = pd.concat([pd.Series(values[i], index=times, name=name)
+                              for name, (times, values) in raw.items()], axis=1).sort_index()
+            data.index = data.index.tz_convert(tz)
+            self.set_location(tz, lat, lon)
+            self.model.time = self.time = data.index
+            frames.append(self.model.process_data(data, **kwargs))
+        return frames
+
+    def get_processed_data(self, latitude, longitude, start, end, **kwargs):
+        # Same contract as the pvlib models: leaves location and time set.
+        return self.get_fleet_data([latitude], [longitude], start, end, **kwargs)[0]
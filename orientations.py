@@ -0,0 +1,64 @@
+# Many array orientations at one location.
+#
+# Solar position, extraterrestrial radiation and airmass only depend on the
+# location and the forecast times, so for design studies (east/west roofs,
+# tilt sweeps, tracker positions) they are computed once with the
+# get_forecasts helpers and every orientation is evaluated in one pass of the
+# fleet chain on (n_orientations, n_times) arrays.
+#
+#     site = get_site_intermediates(39.7423, -105.1785, 'GFS', 7)
+#     out = evaluate_orientations(site, [30, 30, 15], [90, 270, 180], 0.2,
+#                                 pvmoduledata, inverterdata)
+
+import numpy as np
+
+from pvgeneration import (forecast_window, get_airmass, get_dni_extra, get_forecast_model,
+                          get_solpos, get_weather_data, upsample_weather_data)
+from fleet import WEATHER_COLUMNS, fleet_power_chain, sam_parameters
+
+
+def get_site_intermediates(latitude, longitude, fm, daysahead):
+    # Weather and the orientation independent intermediates of get_forecasts.
+    start, end = forecast_window(daysahead)
+    fm = get_forecast_model(fm)
+    forecast_data = upsample_weather_data(get_weather_data(latitude, longitude, start, end, fm), fm)
+    solpos = get_solpos(forecast_data, fm)
+    dni_extra = get_dni_extra(fm).reindex(forecast_data.index)
+    airmass = get_airmass(solpos)
+    return {'forecast_data': forecast_data, 'solpos': solpos,
+            'dni_extra': dni_extra, 'airmass': airmass}
+
+
+def evaluate_orientations(site, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata):
+    # Evaluate N orientations against the intermediates of one site.
+    # surface_tilt/surface_azimuth are sequences of length N (albedo may be a
+    # scalar or length N). Returns the same dict as fleet.get_fleet_forecasts,
+    # with one row per orientation (see fleet.site_forecast / fleet.fleet_frame).
+    surface_tilt = np.asarray(surface_tilt, dtype=float).reshape(-1, 1)
+    surface_azimuth = np.asarray(surface_azimuth, dtype=float).reshape(-1, 1)
+    if surface_tilt.shape != surface_azimuth.shape:
+        raise ValueError('surface_tilt and surface_azimuth must have the same length')
+    albedo = np.broadcast_to(np.asarray(albedo, dtype=float).reshape(-1, 1), surface_tilt.shape)
+
+    forecast_data = site['forecast_data']
+    solpos = {name: site['solpos'][name].to_numpy()[None, :]
+              for name in ['apparent_zenith', 'zenith', 'azimuth']}
+    weather = {col: forecast_data[col].to_numpy(dtype=float)[None, :] for col in WEATHER_COLUMNS}
+    dni_extra = site['dni_extra'].to_numpy(dtype=float)[None, :]
+    airmass = site['airmass'].to_numpy(dtype=float)[None, :]
+    module = sam_parameters([pvmoduledata['pvmanf']], [pvmoduledata['pvmodel']])
+    invertermodel = sam_parameters([inverterdata['invmanf']], [inverterdata['invmodel']])
+
+    out = fleet_power_chain(solpos, dni_extra, airmass, weather,
+                            surface_tilt, surface_azimuth, albedo, module, invertermodel)
+    out['time'] = forecast_data.index
+    out['sites'] = ['{:g}/{:g}'.format(t, a) for t, a in zip(surface_tilt[:, 0], surface_azimuth[:, 0])]
+    return out
+
+
+def get_orientation_forecasts(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                              pvmoduledata, inverterdata, fm, daysahead):
+    # get_forecasts for many orientations at once.
+    site = get_site_intermediates(latitude, longitude, fm, daysahead)
+    return evaluate_orientations(site, surface_tilt, surface_azimuth, albedo,
+                                 pvmoduledata, inverterdata)
@@ -0,0 +1,93 @@
+# Plant-level AC output for many strings and inverters.
+#
+# A plant is a DataFrame with one row per inverter block, the columns in
+# PLANT_COLUMNS, e.g.
+#     surface_tilt  surface_azimuth  albedo  pvmanf     pvmodel  invmanf         invmodel  modules_per_string  strings_per_inverter  inverters
+#     30            90               0.2     SandiaMod  ...      sandiainverter  ...       12                  10                    40
+#     30            270              0.2     SandiaMod  ...      sandiainverter  ...       12                  10                    40
+# i.e. `inverters` identical inverters, each fed by strings_per_inverter
+# parallel strings of modules_per_string modules in series.
+#
+# Nothing is modelled per module or per inverter: DC power of one module is
+# computed once per unique (orientation, albedo, module) configuration with
+# fleet.fleet_dc_chain, broadcast to the blocks, scaled to the inverter input
+# (voltage by modules per string, power by modules per inverter) and run
+# through the Sandia inverter of each distinct block design with its clipping
+# at Paco. Plant totals are the block outputs weighted by their inverter
+# counts, so the cost is (configurations + designs) x timesteps, whatever the
+# plant size.
+#
+#     site = get_site_intermediates(39.7423, -105.1785, 'GFS', 7)
+#     out = evaluate_plant(site, plant)
+#     out['plant_ac']
+
+import numpy as np
+import pandas as pd
+
+from fleet import WEATHER_COLUMNS, fleet_dc_chain, sam_parameters, sandia_inverter
+from orientations import get_site_intermediates
+
+
+CONFIG_COLUMNS = ['surface_tilt', 'surface_azimuth', 'albedo', 'pvmanf', 'pvmodel']
+DESIGN_COLUMNS = CONFIG_COLUMNS + ['invmanf', 'invmodel', 'modules_per_string', 'strings_per_inverter']
+PLANT_COLUMNS = DESIGN_COLUMNS + ['inverters']
+
+
+def evaluate_plant(site, plant):
+    # Model a plant against the intermediates of its site
+    # (orientations.get_site_intermediates). Returns a dict with
+    # * 'time'
+    # * 'blocks': the distinct inverter blocks (rows of plant that only differ
+    #   in 'inverters' are merged, adding up their inverter counts)
+    # * 'configs': the distinct module configurations, as DataFrames
+    # * per block, (n_blocks, n_times) for one inverter: 'v_dc', 'p_dc', 'p_ac'
+    # * plant totals, (n_times,): 'plant_dc', 'plant_ac' and 'clipping' (AC
+    #   power lost to the inverter limits)
+    missing = [col for col in PLANT_COLUMNS if col not in plant.columns]
+    if missing:
+        raise ValueError('plant is missing columns: {}'.format(', '.join(missing)))
+    forecast_data = site['forecast_data']
+    solpos = {name: site['solpos'][name].to_numpy()[None, :]
+              for name in ['apparent_zenith', 'zenith', 'azimuth']}
+    weather = {col: forecast_data[col].to_numpy(dtype=float)[None, :] for col in WEATHER_COLUMNS}
+    dni_extra = site['dni_extra'].to_numpy(dtype=float)[None, :]
+    airmass = site['airmass'].to_numpy(dtype=float)[None, :]
+
+    # Blocks that only differ in their inverter count are modelled once.
+    blocks = plant[PLANT_COLUMNS].groupby(DESIGN_COLUMNS, sort=False, as_index=False)['inverters'].sum()
+    codes, configs = pd.factorize(pd.MultiIndex.from_frame(blocks[CONFIG_COLUMNS]))
+    configs = pd.DataFrame(list(configs), columns=CONFIG_COLUMNS)
+
+    def column(frame, name):
+        return frame[name].to_numpy(dtype=float)[:, None]
+
+    module = sam_parameters(configs['pvmanf'], configs['pvmodel'])
+    dc = fleet_dc_chain(solpos, dni_extra, airmass, weather, column(configs, 'surface_tilt'),
+                        column(configs, 'surface_azimuth'), column(configs, 'albedo'), module)
+
+    modules_per_string = column(blocks, 'modules_per_string')
+    modules_per_inverter = modules_per_string * column(blocks, 'strings_per_inverter')
+    inverters = column(blocks, 'inverters')
+    # SAPM gives NaN voltages for some modules at zero irradiance; a block
+    # without power must not turn the plant totals into NaN.
+    v_dc = np.nan_to_num(dc['v_mp'][codes] * modules_per_string)
+    p_dc = np.nan_to_num(dc['p_mp'][codes] * modules_per_inverter)
+    invertermodel = sam_parameters(blocks['invmanf'], blocks['invmodel'])
+    p_ac = sandia_inverter(v_dc, p_dc, invertermodel)
+    unclipped = sandia_inverter(v_dc, p_dc, invertermodel, clip=False)
+    return {'time': forecast_data.index, 'blocks': blocks, 'configs': configs,
+            'v_dc': v_dc, 'p_dc': p_dc, 'p_ac': p_ac,
+            'plant_dc': (p_dc * inverters).sum(axis=0),
+            'plant_ac': (p_ac * inverters).sum(axis=0),
+            'clipping': ((unclipped - p_ac) * inverters).sum(axis=0)}
+
+
+def plant_frame(plant_out):
+    # Plant totals as a DataFrame with columns 'plant_dc', 'plant_ac', 'clipping'.
+    return pd.DataFrame({name: plant_out[name] for name in ['plant_dc', 'plant_ac', 'clipping']},
+                        index=plant_out['time'])
+
+
+def get_plant_forecasts(latitude, longitude, plant, fm, daysahead):
+    # Plant forecast for the next `daysahead` days, see evaluate_plant.
+    return evaluate_plant(get_site_intermediates(latitude, longitude, fm, daysahead), plant)
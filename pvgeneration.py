@@ -25,45 +25,97 @@ import inspect
 import os
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 
 from pvlib import solarposition, irradiance, atmosphere, pvsystem, inverter, temperature
-from pvlib.forecast import GFS, NAM, NDFD, RAP, HRRR
 
+from samcache import get_sam_entry
+from weathercache import WeatherCache
+from solargeometry import geometry_cache
+import metrics
 
+FORECAST_MODELS = ['GFS', 'NAM', 'NDFD', 'RAP', 'HRRR']
 
+# Processed NWP pulls, shared by all requests of this process (see weathercache.py).
+weather_cache = WeatherCache()
+metrics.register_gauges('weather_cache', weather_cache.stats)
 
+# Timestep of the modelled forecast, e.g. '15min' or '5min'. Coarser NWP
+# output (GFS is 3-hourly) is upsampled through the clear-sky index, see
+# upsample.py; unset keeps the timestep of the model.
+UPSAMPLE_FREQ = os.environ.get('UPSAMPLE_FREQ') or None
+
+
+
+
+@metrics.timed('get_forecast_model')
+def get_forecast_model(fm):
+    # Define forecast model: a model name ('GFS', ...) or a model instance,
+    # e.g. weathercache.LocalForecastSource for offline runs.
+    # pvlib.forecast (siphon, netCDF4) is only imported once a model is needed.
+    if not isinstance(fm, str):
+        return fm
+    if fm not in FORECAST_MODELS:
+        raise ValueError('unknown forecast model {!r}, expected one of {}'.format(fm, ', '.join(FORECAST_MODELS)))
+    from pvlib import forecast
+    return getattr(forecast, fm)()
+
+
+@metrics.timed('get_weather_data')
 def get_weather_data(latitude, longitude, start, end, fm):
     # Retrieve data
     # ## Load the Forecast data
     # pvlib forecast module only includes several models. To see the full list of forecast models visit the Unidata website: 
     # http://www.unidata.ucar.edu/data/#tds
-    forecast_data = fm.get_processed_data(latitude, longitude, start, end)
-    forecast_data.head()
+    # Pulls are cached per model cycle and grid cell, see weathercache.py.
+    forecast_data = weather_cache.get(fm, latitude, longitude, start, end)
+    return forecast_data
+
+
+@metrics.timed('upsample_weather_data')
+def upsample_weather_data(forecast_data, fm, freq=UPSAMPLE_FREQ):
+    # Resample the pulled weather to `freq` (fm.location/fm.time as after the
+    # pull; fm.time is moved to the new index).
+    if not freq or len(forecast_data) < 2:
+        return forecast_data
+    from upsample import upsample_weather
+    forecast_data = upsample_weather(forecast_data, fm.location, freq)
+    fm.time = forecast_data.index
     return forecast_data
 
 
 
+@metrics.timed('get_solpos')
 def get_solpos(forecast_data,fm):
     # Calculate the solar position for all times in the forecast data. 
     # The default solar position algorithm is based on Reda and Andreas (2004). Our implementation is pretty fast, but you can make it even faster if you install [``numba``](http://numba.pydata.org/#installing) and use add  ``method='nrel_numba'`` to the function call below.
+    # Registered sites read it from their precomputed geometry tables instead (see solargeometry.py).
     time = forecast_data.index
     a_point = fm.location
+    if geometry_cache.is_registered(a_point.latitude, a_point.longitude):
+        return geometry_cache.solpos(a_point.latitude, a_point.longitude, time)
     solpos = a_point.get_solarposition(time)
     return solpos
     
+@metrics.timed('get_dni_extra')
 def get_dni_extra(fm):
     # Calculate extra terrestrial radiation. This is needed for many plane of array diffuse irradiance models.
+    a_point = fm.location
+    if geometry_cache.is_registered(a_point.latitude, a_point.longitude):
+        return geometry_cache.dni_extra(a_point.latitude, a_point.longitude, fm.time)
     dni_extra = irradiance.get_extra_radiation(fm.time)
     return dni_extra
 
+@metrics.timed('get_airmass')
 def get_airmass(solpos):
     # Calculate airmass. Lots of model options here, see the ``atmosphere`` module tutorial for more details.
+    # Solar positions from the geometry tables already carry it.
+    if 'airmass' in solpos:
+        return solpos['airmass']
     airmass = atmosphere.get_relative_airmass(solpos['apparent_zenith'])
     return airmass
 
 
+@metrics.timed('get_poa_sky_diffuse')
 def get_poa_sky_diffuse(surface_tilt, surface_azimuth, forecast_data, dni_extra, solpos):
     # Use the Hay Davies model to calculate the plane of array diffuse sky radiation.
     poa_sky_diffuse = irradiance.haydavies(surface_tilt, surface_azimuth,
@@ -72,21 +124,25 @@ def get_poa_sky_diffuse(surface_tilt, surface_azimuth, forecast_data, dni_extra,
     return poa_sky_diffuse
 
 
+@metrics.timed('get_poa_ground_diffuse')
 def get_poa_ground_diffuse(surface_tilt, forecast_data, albedo):
     # Calculate ground diffuse. We specified the albedo above. You could have also provided a string to the ``surface_type`` keyword argument.
     poa_ground_diffuse = irradiance.get_ground_diffuse(surface_tilt, forecast_data['ghi'], albedo=albedo)
     return poa_ground_diffuse
 
+@metrics.timed('get_angle_of_incidence')
 def get_angle_of_incidence(surface_tilt, surface_azimuth, solpos):
     # Calculate AOI
     aoi = irradiance.aoi(surface_tilt, surface_azimuth, solpos['apparent_zenith'], solpos['azimuth'])
     return aoi
 
+@metrics.timed('get_total_poa')
 def get_total_poa(aoi, forecast_data,poa_sky_diffuse, poa_ground_diffuse):
     # Calculate Total POA irradiance
     poa_irrad = irradiance.poa_components(aoi, forecast_data['dni'], poa_sky_diffuse, poa_ground_diffuse)
     return poa_irrad
 
+@metrics.timed('get_cell_temp')
 def get_cell_temp(forecast_data, poa_irrad):
     # Calculate pv cell temperature
     ambient_temperature = forecast_data['temp_air']
@@ -95,43 +151,111 @@ def get_cell_temp(forecast_data, poa_irrad):
     pvtemp = temperature.sapm_cell(poa_irrad['poa_global'], ambient_temperature, wnd_spd, **thermal_params)
     return pvtemp
 
+@metrics.timed('get_pvmodule')
 def get_pvmodule(pvmoduledata):
 
     # ## DC power using SAPM
-    # Get module data from the web.
+    # Get module data from the process-wide SAM table cache (see samcache.py).
     pvmanf = pvmoduledata['pvmanf']
     pvmodel = pvmoduledata['pvmodel']
-    modules = eval("pvsystem.retrieve_sam('{}')".format(pvmanf)) #Sandia
     # Choose a particular module
-    pvmodule = eval("modules.{}".format(pvmodel)) #Canadian_Solar_CS5P_220M___2009_
+    pvmodule = get_sam_entry(pvmanf, pvmodel) #Sandia, Canadian_Solar_CS5P_220M___2009_
     return pvmodule
     
     
+@metrics.timed('forecast_dc_power')
 def forecast_dc_power(poa_irrad, airmass, aoi, pvmodule, pvtemp):
     # Run the SAPM using the parameters we calculated above.
     effective_irradiance = pvsystem.sapm_effective_irradiance(poa_irrad.poa_direct, poa_irrad.poa_diffuse, airmass, aoi, pvmodule)
     sapm_out = pvsystem.sapm(effective_irradiance, pvtemp, pvmodule)
     return sapm_out
 
+@metrics.timed('get_invertermodel')
 def get_invertermodel(inverterdata):
-    # Get the inverter database from the web
+    # Get the inverter data from the process-wide SAM table cache (see samcache.py).
     invmanf = inverterdata['invmanf']
     invmodel = inverterdata['invmodel']
-    inverters = eval("pvsystem.retrieve_sam('{}')".format(invmanf)) #sandiainverter
     # Choose a particular inverter
-    invertermodel = eval("inverters['{}']".format(invmodel)) #ABB__MICRO_0_25_I_OUTD_US_208__208V_
+    invertermodel = get_sam_entry(invmanf, invmodel) #sandiainverter, ABB__MICRO_0_25_I_OUTD_US_208__208V_
     return invertermodel
     
     
     
+@metrics.timed('forecast_ac_power')
 def forecast_ac_power(dc_out, invertermodel):
     p_ac = inverter.sandia(dc_out.v_mp, dc_out.p_mp, invertermodel)
     return p_ac
 
 
 
+def forecast_window(daysahead, tz='US/Mountain'):
+    # Forecast horizon: from the start of today to `daysahead` days later.
+    start = pd.Timestamp(datetime.date.today(), tz=tz) # today's date
+    end = start + pd.Timedelta(days=daysahead) # 7 days from today
+    return start, end
+
+
+@metrics.timed('model_forecasts')
+def model_forecasts(forecast_data, fm, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata):
+    # The modelling part of get_forecasts, for weather that has already been fetched
+    # (fm.location and fm.time set as by fm.get_processed_data).
+    
+    # ## Calculate modeling intermediates
+    # Before we can calculate power for all the forecast times, we will need to calculate:
+    # * solar position 
+    # * extra terrestrial radiation
+    # * airmass
+    # * angle of incidence
+    # * POA sky and ground diffuse radiation
+    # * cell and module temperatures
+    
+    metrics.count('rows_processed', len(forecast_data))
+    solpos = get_solpos(forecast_data,fm)
+    dni_extra = get_dni_extra(fm)
+    airmass = get_airmass(solpos)
+    poa_sky_diffuse = get_poa_sky_diffuse(surface_tilt, surface_azimuth, forecast_data, dni_extra, solpos)
+    poa_ground_diffuse = get_poa_ground_diffuse(surface_tilt, forecast_data, albedo)
+    aoi = get_angle_of_incidence(surface_tilt, surface_azimuth, solpos)
+    poa_irrad = get_total_poa(aoi, forecast_data,poa_sky_diffuse, poa_ground_diffuse)
+    pvtemp = get_cell_temp(forecast_data, poa_irrad)
+    pvmodule = get_pvmodule(pvmoduledata)
+    invertermodel = get_invertermodel(inverterdata)
+    dc_out = forecast_dc_power(poa_irrad, airmass, aoi, pvmodule, pvtemp)
+    ac_out = forecast_ac_power(dc_out, invertermodel)
+    return poa_irrad, pvtemp, dc_out, ac_out
+
+
+def iter_forecasts(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata,
+                   fm, daysahead, chunk_days=1):
+    # get_forecasts as a generator over chunk_days long pieces of the horizon:
+    # the weather of the whole window is pulled once, then each piece is
+    # modelled on its own and yielded as (poa_irrad, pvtemp, dc_out, ac_out),
+    # so the first day is shown before the rest is modelled.
+    start, end = forecast_window(daysahead)
+    fm = get_forecast_model(fm)
+    forecast_data = get_weather_data(latitude, longitude, start, end, fm)
+    forecast_data = upsample_weather_data(forecast_data, fm)
+    time = forecast_data.index
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days), end)
+        # The window is inclusive at both ends, the next chunk starts at chunk_end.
+        chunk = forecast_data[(time >= chunk_start) & ((time < chunk_end) | (chunk_end == end))]
+        if len(chunk):
+            fm.time = chunk.index
+            yield model_forecasts(chunk, fm, surface_tilt, surface_azimuth, albedo,
+                                  pvmoduledata, inverterdata)
+        chunk_start = chunk_end
+
+
+def concat_forecasts(chunks):
+    # Join the chunks of iter_forecasts into one (poa_irrad, pvtemp, dc_out, ac_out).
+    return tuple(pd.concat(tables) for tables in zip(*chunks))
+
+
 #if __name__ == '__main__':
 
+@metrics.timed('get_forecasts')
 def get_forecasts(latitude,longitude,surface_tilt,surface_azimuth,albedo,pvmoduledata,inverterdata,fm,daysahead):
  
     # Choose a location.
@@ -149,39 +273,20 @@ def get_forecasts(latitude,longitude,surface_tilt,surface_azimuth,albedo,pvmodul
     #pvmoduledata = {'pvmanf':'SandiaMod','pvmodel':'Canadian_Solar_CS5P_220M___2009_'}
     #inverterdata = {'invmanf':'sandiainverter','invmodel':'ABB__MICRO_0_25_I_OUTD_US_208__208V_'}
     
-    start = pd.Timestamp(datetime.date.today(), tz=tz) # today's date
-    end = start + pd.Timedelta(days=daysahead) # 7 days from today
+    start, end = forecast_window(daysahead, tz)
  
     
     # Define forecast model
-    fm = eval('{}()'.format(fm))
+    fm = get_forecast_model(fm)
     
     forecast_data = get_weather_data(latitude, longitude, start, end, fm)
+    forecast_data = upsample_weather_data(forecast_data, fm)
     
-    # ## Calculate modeling intermediates
-    # Before we can calculate power for all the forecast times, we will need to calculate:
-    # * solar position 
-    # * extra terrestrial radiation
-    # * airmass
-    # * angle of incidence
-    # * POA sky and ground diffuse radiation
-    # * cell and module temperatures
-    
-    solpos = get_solpos(forecast_data,fm)
-    dni_extra = get_dni_extra(fm)
-    airmass = get_airmass(solpos)
-    poa_sky_diffuse = get_poa_sky_diffuse(surface_tilt, surface_azimuth, forecast_data, dni_extra, solpos)
-    poa_ground_diffuse = get_poa_ground_diffuse(surface_tilt, forecast_data, albedo)
-    aoi = get_angle_of_incidence(surface_tilt, surface_azimuth, solpos)
-    poa_irrad = get_total_poa(aoi, forecast_data,poa_sky_diffuse, poa_ground_diffuse)
-    pvtemp = get_cell_temp(forecast_data, poa_irrad)
-    pvmodule = get_pvmodule(pvmoduledata)
-    invertermodel = get_invertermodel(inverterdata)
-    dc_out = forecast_dc_power(poa_irrad, airmass, aoi, pvmodule, pvtemp)
-    ac_out = forecast_ac_power(dc_out, invertermodel)
+    poa_irrad, pvtemp, dc_out, ac_out = model_forecasts(forecast_data, fm, surface_tilt, surface_azimuth, albedo,
+                                                        pvmoduledata, inverterdata)
     
     '''
-    # Plots:
+    # Plots (needs `import matplotlib.pyplot as plt`):
     
     poa_irrad.plot()
     plt.ylabel('Irradiance ($W/m^{-2}$)')
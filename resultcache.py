@@ -0,0 +1,204 @@
+# End-to-end cache of get_forecasts results, shared by all gunicorn workers.
+#
+# Complete (poa_irrad, pvtemp, dc_out, ac_out) results are stored on local
+# disk in the resultstore.py column format, under the normalized forecast
+# inputs (singleflight.forecast_key) plus the init time of the NWP cycle they
+# were computed from (weathercache.latest_cycle). Once a newer cycle is
+# expected on the server the key changes, so the next request recomputes;
+# the old entry is dropped when it is next read or evicted. Reads go through
+# np.memmap, so workers share the page cache instead of holding copies.
+# The directory is kept under max_bytes by evicting the least recently used
+# entries (a hit refreshes the file's mtime).
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import pandas as pd
+
+import metrics
+from fleet import get_fleet_forecasts, site_forecast
+from pvgeneration import concat_forecasts
+from resultstore import ResultStore
+from singleflight import forecast_key, get_forecasts_coalesced, iter_forecasts_coalesced
+from weathercache import latest_cycle, cycle_expiry
+
+
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'solarapp-results'))
+RESULT_CACHE_MAX_MB = float(os.environ.get('RESULT_CACHE_MAX_MB', 256))
+
+
+def _utcnow():
+    return pd.Timestamp.now(tz='UTC')
+
+
+class ResultCache(object):
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=int(RESULT_CACHE_MAX_MB * 1e6)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.store = ResultStore(cache_dir)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key):
+        # (store site id, run id) of a key.
+        return hashlib.sha1(repr(key).encode()).hexdigest(), 'entry'
+
+    def get(self, key, now=None):
+        # Cached results for key, or None.
+        now = _utcnow() if now is None else pd.Timestamp(now).tz_convert('UTC')
+        site_id, run_id = self._entry(key)
+        try:
+            header = self.store.header(site_id, run_id)
+            meta = header['meta']
+            if meta.get('key') != repr(key) or pd.Timestamp(meta['expires']) <= now:
+                results = None
+            else:
+                results = self.store.read(site_id, run_id)
+                os.utime(header['path'])
+        except (OSError, ValueError, KeyError):
+            results = None
+        with self._lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return results
+
+    def put(self, key, results, expires, evict=True):
+        # evict=False leaves the size check to the caller (batches of puts).
+        site_id, run_id = self._entry(key)
+        try:
+            self.store.write(site_id, *results, run_id=run_id,
+                             meta={'key': repr(key), 'expires': pd.Timestamp(expires).isoformat()})
+        except OSError:
+            return
+        if evict:
+            self.evict()
+
+    def _files(self):
+        # [(mtime, size, path)] of the cached entries, oldest first.
+        files = []
+        try:
+            for site_id in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, site_id, 'entry.pvr')
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        except OSError:
+            pass
+        return sorted(files)
+
+    def _remove(self, path):
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits max_bytes.
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def purge(self, now=None):
+        # Drop entries whose model cycle has been superseded.
+        now = _utcnow() if now is None else pd.Timestamp(now).tz_convert('UTC')
+        for _, _, path in self._files():
+            site_id = os.path.basename(os.path.dirname(path))
+            try:
+                expires = pd.Timestamp(self.store.header(site_id, 'entry')['meta']['expires'])
+            except (OSError, ValueError, KeyError):
+                expires = None
+            if expires is None or expires <= now:
+                self._remove(path)
+
+    def clear(self):
+        for _, _, path in self._files():
+            self._remove(path)
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        files = self._files()
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(files),
+                    'bytes': sum(size for _, size, _ in files)}
+
+
+result_cache = ResultCache()
+metrics.register_gauges('result_cache', result_cache.stats)
+
+
+def _cache_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata,
+               fm, daysahead, now=None):
+    # (key, cycle) of a forecast in the result cache.
+    cycle = latest_cycle(fm, now)
+    return forecast_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                        inverterdata, fm, daysahead) + (cycle.isoformat(),), cycle
+
+
+def get_forecasts_cached(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                         inverterdata, fm, daysahead, now=None):
+    # get_forecasts, served from the result cache while the NWP cycle it was
+    # computed from is the newest one.
+    key, cycle = _cache_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                            inverterdata, fm, daysahead, now)
+    results = result_cache.get(key, now)
+    if results is None:
+        results = get_forecasts_coalesced(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                                          pvmoduledata, inverterdata, fm, daysahead)
+        result_cache.put(key, results, cycle_expiry(fm, cycle))
+    return results
+
+
+def iter_forecasts_cached(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                          inverterdata, fm, daysahead, chunk_days=1, now=None):
+    # pvgeneration.iter_forecasts (coalesced with identical runs in flight,
+    # see singleflight.py) that yields a cached result as one chunk and
+    # caches the joined chunks once the whole horizon has been modelled.
+    key, cycle = _cache_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                            inverterdata, fm, daysahead, now)
+    results = result_cache.get(key, now)
+    if results is not None:
+        yield results
+        return
+    chunks = []
+    for chunk in iter_forecasts_coalesced(latitude, longitude, surface_tilt, surface_azimuth, albedo,
+                                          pvmoduledata, inverterdata, fm, daysahead, chunk_days):
+        chunks.append(chunk)
+        yield chunk
+    if chunks:
+        result_cache.put(key, concat_forecasts(chunks), cycle_expiry(fm, cycle))
+
+
+def get_fleet_forecasts_cached(sites, fm, daysahead, now=None):
+    # get_forecasts results for every row of `sites` (fleet.SITE_COLUMNS), as a
+    # list in row order. Cached sites are served from the result cache; the
+    # others are modelled together in one fleet.get_fleet_forecasts pass and
+    # cached one by one, so later single-site requests hit them too.
+    keys = []
+    results = []
+    for site in sites.to_dict('records'):
+        key, cycle = _cache_key(site['latitude'], site['longitude'], site['surface_tilt'],
+                                site['surface_azimuth'], site['albedo'],
+                                {'pvmanf': site['pvmanf'], 'pvmodel': site['pvmodel']},
+                                {'invmanf': site['invmanf'], 'invmodel': site['invmodel']}, fm, daysahead, now)
+        keys.append(key)
+        results.append(result_cache.get(key, now))
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        fleet_out = get_fleet_forecasts(sites.iloc[missing], fm, daysahead)
+        expires = cycle_expiry(fm, cycle)
+        for j, i in enumerate(missing):
+            results[i] = site_forecast(fleet_out, j)
+            result_cache.put(keys[i], results[i], expires, evict=False)
+        result_cache.evict()
+    return results
@@ -0,0 +1,173 @@
+# Binary columnar store for forecast results.
+#
+# One file per site and run, <root>/<site_id>/<run_id>.pvr:
+#     8 bytes   magic b'PVRS0001'
+#     8 bytes   header length (little-endian uint64)
+#     header    JSON: rows, timezone, site metadata and the dtype/offset of
+#               every column
+#     columns   one contiguous little-endian block per column, 64-byte aligned:
+#               'time' (int64 ns since epoch, UTC), then the columns of
+#               poa_irrad, pvtemp, dc_out and ac_out (float64)
+# Columns are read through np.memmap, so a time-range query only touches the
+# pages it needs and read_columns returns views without copying.
+#
+#     store = ResultStore()
+#     store.write('nrel-boulder', poa_irrad, pvtemp, dc_out, ac_out)
+#     poa_irrad, pvtemp, dc_out, ac_out = store.read('nrel-boulder', start=..., end=...)
+
+import datetime
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+RESULT_STORE_DIR = os.environ.get('RESULT_STORE_DIR',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results'))
+MAGIC = b'PVRS0001'
+ALIGN = 64
+TABLES = ['poa_irrad', 'pvtemp', 'dc_out', 'ac_out']
+# Tables returned as a Series rather than a DataFrame.
+SERIES_TABLES = ['pvtemp', 'ac_out']
+# Site of the landing page forecast, written by initial_data.py.
+INITIAL_SITE = 'nrel-boulder'
+
+
+def _tz_to_json(tz):
+    if tz is None:
+        return None
+    zone = getattr(tz, 'zone', None) or getattr(tz, 'key', None)
+    if zone:
+        return zone
+    offset = datetime.datetime(2000, 1, 1, tzinfo=tz).utcoffset()
+    return int(offset.total_seconds() // 60)
+
+
+def _tz_from_json(tz):
+    if isinstance(tz, int):
+        return datetime.timezone(datetime.timedelta(minutes=tz))
+    return tz
+
+
+def run_id_now():
+    return pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%SZ')
+
+
+class ResultStore(object):
+
+    def __init__(self, root=RESULT_STORE_DIR):
+        self.root = root
+
+    def _path(self, site_id, run_id):
+        return os.path.join(self.root, site_id, '{}.pvr'.format(run_id))
+
+    def sites(self):
+        try:
+            return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+        except OSError:
+            return []
+
+    def runs(self, site_id):
+        # Run ids of a site, oldest first.
+        try:
+            names = os.listdir(os.path.join(self.root, site_id))
+        except OSError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith('.pvr'))
+
+    def latest_run(self, site_id):
+        runs = self.runs(site_id)
+        return runs[-1] if runs else None
+
+    def write(self, site_id, poa_irrad, pvtemp, dc_out, ac_out, run_id=None, meta=None):
+        # Store the four get_forecasts outputs as one run; returns the run id.
+        run_id = run_id or run_id_now()
+        index = poa_irrad.index
+        columns = [('time', np.asarray(index.asi8, dtype=np.int64))]
+        for table, data in zip(TABLES, (poa_irrad, pvtemp, dc_out, ac_out)):
+            data = data.reindex(index)
+            if isinstance(data, pd.Series):
+                columns.append((table, data.to_numpy(dtype=np.float64)))
+            else:
+                columns.extend(('{}/{}'.format(table, name), data[name].to_numpy(dtype=np.float64))
+                               for name in data.columns)
+
+        header = {'rows': len(index), 'tz': _tz_to_json(index.tz), 'meta': meta or {}, 'columns': []}
+        # Column offsets depend on the header length and the other way round:
+        # lay out twice and leave slack for the offsets growing a digit.
+        for _ in range(2):
+            header_bytes = json.dumps(header).encode()
+            offset = -(-(16 + len(header_bytes) + 256) // ALIGN) * ALIGN
+            header['columns'] = []
+            for name, values in columns:
+                header['columns'].append({'name': name, 'dtype': values.dtype.newbyteorder('<').str,
+                                          'offset': offset})
+                offset += -(-values.nbytes // ALIGN) * ALIGN
+        header_bytes = json.dumps(header).encode()
+
+        path = self._path(site_id, run_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for column, (name, values) in zip(header['columns'], columns):
+                f.seek(column['offset'])
+                f.write(np.ascontiguousarray(values, dtype=column['dtype']).tobytes())
+        os.replace(tmp, path)
+        return run_id
+
+    def header(self, site_id, run_id=None):
+        run_id = run_id or self.latest_run(site_id)
+        path = self._path(site_id, run_id)
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError('{} is not a forecast result file'.format(path))
+            length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(length).decode())
+        header['path'] = path
+        header['run_id'] = run_id
+        return header
+
+    def read_columns(self, site_id, run_id=None, start=None, end=None, columns=None):
+        # Time range query returning (DatetimeIndex, {column: ndarray view}).
+        # Column names are 'poa_irrad/poa_global', 'pvtemp', 'dc_out/p_mp',
+        # 'ac_out', ...; columns=None returns all of them.
+        header = self.header(site_id, run_id)
+        rows = header['rows']
+        layout = {c['name']: c for c in header['columns']}
+
+        def column(name):
+            c = layout[name]
+            if rows == 0:
+                return np.empty(0, dtype=c['dtype'])
+            return np.memmap(header['path'], dtype=c['dtype'], mode='r', offset=c['offset'], shape=(rows,))
+
+        time = column('time')
+        i = 0 if start is None else int(np.searchsorted(time, pd.Timestamp(start).value, side='left'))
+        j = rows if end is None else int(np.searchsorted(time, pd.Timestamp(end).value, side='right'))
+        index = pd.DatetimeIndex(np.asarray(time[i:j]).view('datetime64[ns]'))
+        tz = _tz_from_json(header['tz'])
+        index = index.tz_localize('UTC').tz_convert(tz) if tz is not None else index
+        names = [n for n in layout if n != 'time'] if columns is None else columns
+        return index, {name: column(name)[i:j] for name in names}
+
+    def read(self, site_id, run_id=None, start=None, end=None):
+        # Time range query returning (poa_irrad, pvtemp, dc_out, ac_out) as
+        # get_forecasts does.
+        index, data = self.read_columns(site_id, run_id, start, end)
+        out = []
+        for table in TABLES:
+            if table in SERIES_TABLES:
+                out.append(pd.Series(data[table], index=index, copy=False))
+            else:
+                prefix = table + '/'
+                out.append(pd.DataFrame({name[len(prefix):]: values for name, values in data.items()
+                                         if name.startswith(prefix)}, index=index))
+        return tuple(out)
+
+
+result_store = ResultStore()
@@ -0,0 +1,175 @@
+# Process-wide cache for the SAM module and inverter databases.
+#
+# pvsystem.retrieve_sam reads and parses a full SAM table (hundreds of modules,
+# thousands of inverters) every time it is called. Here each table is parsed
+# once per process and a compact snapshot is kept on local disk:
+# * <name>.npy  - numeric parameters as a float64 (entries x parameters) matrix,
+#                 memory-mapped on load so forked gunicorn workers share pages
+# * <name>.json - entry names, parameter names and the few text parameters
+# Single modules/inverters are then looked up by name through a dict index.
+
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+SAM_SNAPSHOT_DIR = os.environ.get('SAM_SNAPSHOT_DIR',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sam_snapshot'))
+SNAPSHOT_VERSION = 1
+# Tables pvsystem.retrieve_sam knows; names are matched case-insensitively
+# ('sandiainverter' is 'SandiaInverter') and are the snapshot file names.
+SAM_TABLES = ['SandiaMod', 'CECMod', 'SandiaInverter', 'CECInverter', 'ADRInverter']
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class SamTable(object):
+    # One SAM database held as a numeric matrix plus a name -> row index.
+
+    def __init__(self, name, names, parameters, values, text):
+        self.name = name
+        self.names = names
+        self.parameters = parameters
+        self.values = values        # (entries x parameters), NaN where text
+        self.text = text            # {parameter position: [value per entry]}
+        self.index = {n: i for i, n in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, model):
+        return model in self.index
+
+    def get(self, model):
+        # Return the parameters of one entry as a Series, the same as the
+        # corresponding column of pvsystem.retrieve_sam(name).
+        row = self.index[model]
+        if not self.text:
+            return pd.Series(np.array(self.values[row]), index=self.parameters, name=model)
+        data = np.array(self.values[row]).astype(object)
+        for pos, col in self.text.items():
+            data[pos] = np.nan if col[row] is None else col[row]
+        return pd.Series(data, index=self.parameters, name=model)
+
+    def to_frame(self):
+        # Rebuild the full retrieve_sam style DataFrame (parameters x entries).
+        frame = pd.DataFrame(np.array(self.values).T, index=self.parameters, columns=self.names)
+        if self.text:
+            frame = frame.astype(object)
+            for pos, col in self.text.items():
+                frame.iloc[pos] = [np.nan if v is None else v for v in col]
+        return frame
+
+
+def _table_from_frame(name, frame):
+    # Split a retrieve_sam DataFrame into numeric matrix and text parameters.
+    parameters = [str(p) for p in frame.index]
+    names = [str(n) for n in frame.columns]
+    values = np.full((len(names), len(parameters)), np.nan)
+    text = {}
+    for pos, param in enumerate(frame.index):
+        col = frame.iloc[pos]
+        num = pd.to_numeric(col, errors='coerce')
+        if (num.isna() & col.notna()).any():
+            text[pos] = [None if pd.isna(v) else str(v) for v in col]
+        else:
+            values[:, pos] = num.to_numpy(dtype=float)
+    return SamTable(name, names, parameters, values, text)
+
+
+def table_key(name):
+    # Lowercase key of a SAM table name; KeyError if it is not one of
+    # SAM_TABLES.
+    key = name.lower() if isinstance(name, str) else None
+    if key not in [table.lower() for table in SAM_TABLES]:
+        raise KeyError('unknown SAM table {!r}, expected one of {}'.format(name, ', '.join(SAM_TABLES)))
+    return key
+
+
+def _snapshot_paths(name, snapshot_dir):
+    base = os.path.join(snapshot_dir, table_key(name))
+    return base + '.npy', base + '.json'
+
+
+def _pvlib_version():
+    import pvlib
+    return pvlib.__version__
+
+
+def _load_snapshot(name, snapshot_dir):
+    npy_path, json_path = _snapshot_paths(name, snapshot_dir)
+    if not (os.path.exists(npy_path) and os.path.exists(json_path)):
+        return None
+    with open(json_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != SNAPSHOT_VERSION or meta.get('pvlib') != _pvlib_version():
+        return None
+    values = np.load(npy_path, mmap_mode='r')
+    text = {int(pos): col for pos, col in meta['text'].items()}
+    return SamTable(name, meta['names'], meta['parameters'], values, text)
+
+
+def _save_snapshot(table, snapshot_dir):
+    # Write to temporary files and rename, so a worker never reads a half
+    # written snapshot.
+    npy_path, json_path = _snapshot_paths(table.name, snapshot_dir)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta = {'version': SNAPSHOT_VERSION,
+            'pvlib': _pvlib_version(),
+            'names': table.names,
+            'parameters': table.parameters,
+            'text': {str(pos): col for pos, col in table.text.items()}}
+    tmp_suffix = '.{}.tmp'.format(os.getpid())
+    with open(npy_path + tmp_suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(table.values))
+    with open(json_path + tmp_suffix, 'w') as f:
+        json.dump(meta, f)
+    os.replace(npy_path + tmp_suffix, npy_path)
+    os.replace(json_path + tmp_suffix, json_path)
+
+
+def get_sam_table(name, snapshot_dir=None):
+    # Get a SAM database (e.g. 'SandiaMod', 'sandiainverter'), parsing it at
+    # most once per process. The local snapshot is used when it is present and
+    # was written by the installed pvlib version, otherwise it is rebuilt.
+    key = table_key(name)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    snapshot_dir = snapshot_dir or SAM_SNAPSHOT_DIR
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            table = _load_snapshot(name, snapshot_dir)
+            if table is None:
+                from pvlib import pvsystem
+                table = _table_from_frame(name, pvsystem.retrieve_sam(name))
+                try:
+                    _save_snapshot(table, snapshot_dir)
+                except OSError:
+                    # Read-only filesystem: keep the in-memory table only.
+                    pass
+            _tables[key] = table
+    return table
+
+
+def get_sam_entry(name, model):
+    # Look up one module or inverter by name, e.g.
+    # get_sam_entry('SandiaMod', 'Canadian_Solar_CS5P_220M___2009_').
+    return get_sam_table(name).get(model)
+
+
+def warm_sam_tables(*names):
+    # Load the given tables up front, e.g. in the gunicorn master before the
+    # workers are forked.
+    for name in names:
+        get_sam_table(name)
+
+
+def clear_sam_cache():
+    with _tables_lock:
+        _tables.clear()
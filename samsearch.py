@@ -0,0 +1,162 @@
+# Search over the SAM module and inverter catalogs.
+#
+# The dashboard dropdowns and /api/sam cannot ship whole catalogs (thousands
+# of inverters, tens of thousands of CEC modules) to the browser. Instead
+# every table (samcache.get_sam_table) gets an index built once per process:
+# * each entry is split into lowercase tokens of its name
+#   ('Canadian_Solar_CS5P_220M___2009_' -> canadian solar cs5p 220m 2009)
+#   plus its rated power ('220w', from Paco, STC or Impo * Vmpo);
+# * all (token, entry) pairs are kept sorted, so the entries having a token
+#   that starts with a query word are one binary-searched range;
+# * every word of the query has to match (prefix match, AND); a word that
+#   matches no token is replaced by its closest tokens (difflib), so typos
+#   still find something.
+# Names that start with the whole query rank first. Results are paged, and
+# recent queries are kept in an LRU cache.
+#
+#     search('sandiainverter', 'sma 5000', page=0)
+
+import bisect
+import difflib
+import functools
+import re
+import threading
+
+import numpy as np
+
+from samcache import get_sam_table
+
+
+SAM_CATALOGS = ['SandiaMod', 'CECMod', 'sandiainverter', 'cecinverter']
+PAGE_SIZE = 50
+# Closest vocabulary tokens tried for a query word that matches nothing.
+FUZZY_MATCHES = 3
+FUZZY_CUTOFF = 0.75
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _tokens(text):
+    return re.findall(r'[a-z0-9]+', str(text).lower())
+
+
+def _ratings(table):
+    # Rated power (W) of every entry, NaN where the table has none.
+    params = {name: pos for pos, name in enumerate(table.parameters)}
+    values = np.asarray(table.values)
+    if 'Paco' in params:
+        return values[:, params['Paco']]
+    if 'STC' in params:
+        return values[:, params['STC']]
+    if 'Impo' in params and 'Vmpo' in params:
+        return values[:, params['Impo']] * values[:, params['Vmpo']]
+    return np.full(len(table), np.nan)
+
+
+class SamIndex(object):
+
+    def __init__(self, table):
+        self.name = table.name
+        self.names = list(table.names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.keys = [' '.join(_tokens(name)) for name in self.names]
+        ratings = _ratings(table)
+        self.labels = []
+        pairs = []
+        for i, (name, key, rating) in enumerate(zip(self.names, self.keys, ratings)):
+            tokens = set(key.split())
+            label = re.sub(r'_+', ' ', name).strip()
+            if rating == rating:
+                tokens.add('{:.0f}w'.format(rating))
+                label = '{} ({:,.0f} W)'.format(label, rating)
+            self.labels.append(label)
+            pairs.extend((token, i) for token in tokens)
+        pairs.sort()
+        self.tokens = [token for token, _ in pairs]
+        self.entries = np.array([i for _, i in pairs], dtype=np.int64)
+        self.vocabulary = sorted(set(self.tokens))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefixed(self, word):
+        # Entries with a token starting with word.
+        lo = bisect.bisect_left(self.tokens, word)
+        hi = bisect.bisect_left(self.tokens, word + '\uffff')
+        return self.entries[lo:hi]
+
+    def lookup(self, query):
+        # Positions of the entries matching query, best first.
+        words = _tokens(query)
+        if not words:
+            return np.arange(len(self.names))
+        matches = None
+        for word in words:
+            found = self._prefixed(word)
+            if not len(found) and len(word) >= 3:
+                close = difflib.get_close_matches(word, self.vocabulary, FUZZY_MATCHES, FUZZY_CUTOFF)
+                found = np.concatenate([self._prefixed(token) for token in close] + [found])
+            found = np.unique(found)
+            matches = found if matches is None else np.intersect1d(matches, found, assume_unique=True)
+            if not len(matches):
+                break
+        phrase = ' '.join(words)
+        first = np.array([self.keys[i].startswith(phrase) for i in matches], dtype=bool)
+        return np.concatenate([matches[first], matches[~first]])
+
+    def option(self, position):
+        return {'label': self.labels[position], 'value': self.names[position]}
+
+
+def get_sam_index(name):
+    # SamIndex of a SAM table, built at most once per process.
+    key = name.lower()
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _indexes[key] = SamIndex(get_sam_table(name))
+    return index
+
+
+@functools.lru_cache(maxsize=1024)
+def _lookup(name, query):
+    return get_sam_index(name).lookup(query)
+
+
+def search(name, query='', page=0, page_size=PAGE_SIZE):
+    # One page of the entries of table `name` matching query:
+    # {'total', 'page', 'page_size', 'options': [{'label', 'value'}, ...]}.
+    if name.lower() not in [catalog.lower() for catalog in SAM_CATALOGS]:
+        raise KeyError(name)
+    index = get_sam_index(name)
+    matches = _lookup(name.lower(), ' '.join(_tokens(query)))
+    page, page_size = max(int(page), 0), max(int(page_size), 1)
+    start = page * page_size
+    return {'total': len(matches), 'page': page, 'page_size': page_size,
+            'options': [index.option(i) for i in matches[start:start + page_size]]}
+
+
+def warm_sam_indexes(*names):
+    # Build the given indexes up front (see samcache.warm_sam_tables).
+    for name in names:
+        get_sam_index(name)
+
+
+def dropdown_options(name, query='', value=None, page_size=PAGE_SIZE):
+    # Options of a model dropdown while the user types: the first page of
+    # matches, the selected value (so it stays shown) and a disabled hint
+    # when there are more matches than fit.
+    if not name:
+        return []
+    result = search(name, query, 0, page_size)
+    options = result['options']
+    index = get_sam_index(name)
+    if value in index.positions and value not in [option['value'] for option in options]:
+        options = [index.option(index.positions[value])] + options
+    more = result['total'] - len(result['options'])
+    if more > 0:
+        options.append({'label': '{:,} more, keep typing...'.format(more), 'value': '', 'disabled': True})
+    return options
@@ -0,0 +1,283 @@
+# Coalescing of identical in-flight forecasts ("single flight").
+#
+# Concurrent get_forecasts calls with the same normalized parameters share
+# one computation:
+# * within a process, the first caller (the leader) runs it and the others
+#   wait on its Future;
+# * across gunicorn workers, the leader of each process takes an exclusive
+#   fcntl lock on a per-key file in SINGLEFLIGHT_DIR. A worker that had to
+#   wait for the lock picks up the result the holder left behind (if it
+#   finished after the wait started) instead of computing it again; if the
+#   holder failed, the waiter computes it itself. SINGLEFLIGHT_DIR is a
+#   private spool directory like the job queue's (jobs.spool_dir) and only
+#   result files owned by this user are unpickled.
+# Generators (iter_forecasts) are coalesced the same way with iterate: the
+# other callers in the process get the leader's items as they are yielded,
+# a worker that waited for the lock gets the holder's items all at once.
+# Results are only handed to callers that were waiting, nothing is cached
+# for later requests. Without fcntl (Windows) only in-process coalescing is
+# done.
+
+import contextlib
+import datetime
+import hashlib
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import metrics
+from incremental import site_key
+from jobs import SPOOL_DIR, owned_file, spool_dir
+from pvgeneration import get_forecasts, iter_forecasts
+
+
+SINGLEFLIGHT_DIR = os.environ.get('SINGLEFLIGHT_DIR', os.path.join(SPOOL_DIR, 'singleflight'))
+
+_MISSING = object()
+
+
+def forecast_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata, inverterdata,
+                 fm, daysahead):
+    # Normalized get_forecasts parameters. The day is part of the key as the
+    # forecast window starts today.
+    return site_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                    inverterdata, fm) + (int(daysahead), datetime.date.today().isoformat())
+
+
+class _Stream(object):
+    # Items of a leader's generator, for the callers waiting on it.
+
+    def __init__(self):
+        self._items = []
+        self._done = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def append(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._items) and not self._done:
+                    self._cond.wait()
+                if i >= len(self._items):
+                    if self._error is not None:
+                        raise self._error
+                    return
+                item = self._items[i]
+            i += 1
+            yield item
+
+
+class SingleFlight(object):
+
+    def __init__(self, lock_dir=SINGLEFLIGHT_DIR, ttl=600):
+        self.lock_dir = spool_dir(lock_dir) if lock_dir else lock_dir
+        self.ttl = ttl
+        self._inflight = {}     # key -> Future of the leader
+        self._streams = {}      # key -> _Stream of the leader (iterate)
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.shared_across_workers = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        # fn(*args, **kwargs), or the result of an identical call in flight.
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._run_locked(key, fn, args, kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _paths(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return (os.path.join(self.lock_dir, digest + '.lock'),
+                os.path.join(self.lock_dir, digest + '.pkl'))
+
+    def iterate(self, key, fn, *args, **kwargs):
+        # Like do for a generator function: the items of fn(*args, **kwargs),
+        # or those of an identical call in flight.
+        with self._lock:
+            stream = self._streams.get(key)
+            leader = stream is None
+            if leader:
+                stream = self._streams[key] = _Stream()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            for item in stream:
+                yield item
+            return
+
+        try:
+            for item in self._iterate_locked(key, fn, args, kwargs):
+                stream.append(item)
+                yield item
+        except GeneratorExit:
+            stream.close(RuntimeError('the leading caller stopped iterating'))
+            raise
+        except BaseException as exc:
+            stream.close(exc)
+            raise
+        else:
+            stream.close()
+        finally:
+            with self._lock:
+                del self._streams[key]
+
+    @contextlib.contextmanager
+    def _locked(self, key):
+        # Hold the cross-worker lock of key. Yields (result path, start of the
+        # wait, whether another worker held the lock), or None when there is
+        # no cross-worker locking.
+        if fcntl is None or not self.lock_dir:
+            yield None
+            return
+        lock_path, result_path = self._paths(key)
+        started = time.time()
+        try:
+            lock_file = open(lock_path, 'a+')
+        except OSError:
+            yield None
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except OSError:
+                with metrics.timer('singleflight_wait'):
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                waited = True
+            try:
+                yield result_path, started, waited
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _shared_result(self, lock):
+        # Result the lock holder we waited for left behind, or _MISSING.
+        if lock is None or not lock[2]:
+            return _MISSING
+        result = self._read_result(lock[0], lock[1])
+        if result is not _MISSING:
+            with self._lock:
+                self.shared_across_workers += 1
+        return result
+
+    def _run_locked(self, key, fn, args, kwargs):
+        with self._locked(key) as lock:
+            result = self._shared_result(lock)
+            if result is not _MISSING:
+                return result
+            result = fn(*args, **kwargs)
+            if lock is not None:
+                self._write_result(lock[0], result)
+            return result
+
+    def _iterate_locked(self, key, fn, args, kwargs):
+        with self._locked(key) as lock:
+            items = self._shared_result(lock)
+            if items is not _MISSING:
+                for item in items:
+                    yield item
+                return
+            items = []
+            for item in fn(*args, **kwargs):
+                items.append(item)
+                yield item
+            if lock is not None:
+                self._write_result(lock[0], items)
+
+    def _read_result(self, path, started):
+        if not owned_file(path):
+            return _MISSING
+        try:
+            with open(path, 'rb') as f:
+                finished, result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        return result if finished >= started else _MISSING
+
+    def _write_result(self, path, result):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump((time.time(), result), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except (OSError, pickle.PicklingError):
+            pass
+        self.purge()
+
+    def purge(self):
+        # Remove results older than ttl seconds. Lock files are kept, removing
+        # one that another worker is waiting on would let two workers lead.
+        cutoff = time.time() - self.ttl
+        try:
+            for fname in os.listdir(self.lock_dir):
+                path = os.path.join(self.lock_dir, fname)
+                if not fname.endswith('.lock') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'shared': self.shared,
+                    'shared_across_workers': self.shared_across_workers,
+                    'inflight': len(self._inflight) + len(self._streams)}
+
+
+forecast_flight = SingleFlight()
+metrics.register_gauges('singleflight', forecast_flight.stats)
+
+
+def get_forecasts_coalesced(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                            inverterdata, fm, daysahead):
+    # get_forecasts, sharing the result with identical calls in flight.
+    key = forecast_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                       inverterdata, fm, daysahead)
+    return forecast_flight.do(key, get_forecasts, latitude, longitude, surface_tilt, surface_azimuth,
+                              albedo, pvmoduledata, inverterdata, fm, daysahead)
+
+
+def iter_forecasts_coalesced(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                             inverterdata, fm, daysahead, chunk_days=1):
+    # iter_forecasts, sharing the chunks with identical calls in flight.
+    key = forecast_key(latitude, longitude, surface_tilt, surface_azimuth, albedo, pvmoduledata,
+                       inverterdata, fm, daysahead) + ('chunks', int(chunk_days))
+    return forecast_flight.iterate(key, iter_forecasts, latitude, longitude, surface_tilt, surface_azimuth,
+                                   albedo, pvmoduledata, inverterdata, fm, daysahead, chunk_days)
@@ -0,0 +1,164 @@
+# Precomputed solar geometry for registered sites.
+#
+# get_solpos runs the full NREL SPA and get_dni_extra recomputes the
+# extraterrestrial radiation on every request, although both only depend on
+# the location and the timestamps. For registered sites a table per calendar
+# year (UTC) is computed once at a fixed resolution and kept as a float32
+# .npy file that is memory-mapped on load:
+#     columns: GEOMETRY_COLUMNS, rows: year start + i * GEOMETRY_FREQ_MINUTES
+# Forecast times on the table grid are read directly, other times are
+# linearly interpolated between the two neighbouring rows. The sites in
+# GEOMETRY_SITES ('lat,lon;lat,lon', by default the landing page site) are
+# registered at boot by app.py with register_configured_sites.
+#
+#     register_site(39.7423, -105.1785)
+#     solpos = geometry_cache.solpos(39.7423, -105.1785, forecast_data.index)
+
+import datetime
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+GEOMETRY_DIR = os.environ.get('GEOMETRY_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geometry_tables'))
+GEOMETRY_FREQ_MINUTES = 5
+GEOMETRY_COLUMNS = ['apparent_zenith', 'zenith', 'azimuth', 'airmass', 'dni_extra']
+GEOMETRY_SITES = os.environ.get('GEOMETRY_SITES', '39.7423,-105.1785')
+
+
+def site_key(latitude, longitude):
+    return (round(float(latitude), 4), round(float(longitude), 4))
+
+
+def build_geometry_table(latitude, longitude, year, freq_minutes=GEOMETRY_FREQ_MINUTES):
+    # One year of geometry as a float32 (rows x GEOMETRY_COLUMNS) array. One
+    # extra row (the first step of the next year) is included so every time in
+    # the year has a right-hand neighbour to interpolate with.
+    from pvlib import atmosphere, irradiance
+    from pvlib.location import Location
+    start = pd.Timestamp('{}-01-01'.format(year), tz='UTC')
+    end = pd.Timestamp('{}-01-01'.format(year + 1), tz='UTC')
+    time = pd.date_range(start, end, freq='{}min'.format(freq_minutes))
+    # Same defaults as get_solpos, which uses the forecast model's Location.
+    solpos = Location(latitude, longitude).get_solarposition(time)
+    table = np.empty((len(time), len(GEOMETRY_COLUMNS)), dtype=np.float32)
+    table[:, 0] = solpos['apparent_zenith']
+    table[:, 1] = solpos['zenith']
+    table[:, 2] = solpos['azimuth']
+    table[:, 3] = atmosphere.get_relative_airmass(solpos['apparent_zenith'])
+    table[:, 4] = irradiance.get_extra_radiation(time)
+    return table
+
+
+class GeometryCache(object):
+    # Registry of sites with their per-year geometry tables.
+
+    def __init__(self, table_dir=GEOMETRY_DIR, freq_minutes=GEOMETRY_FREQ_MINUTES):
+        self.table_dir = table_dir
+        self.freq_minutes = freq_minutes
+        self.sites = set()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def register(self, latitude, longitude, years=None):
+        # Register a site; tables for `years` are built now, any other year on
+        # first use.
+        key = site_key(latitude, longitude)
+        self.sites.add(key)
+        for year in years or []:
+            self.table(key, year)
+
+    def is_registered(self, latitude, longitude):
+        return site_key(latitude, longitude) in self.sites
+
+    def _path(self, key, year):
+        name = 'geom_{:.4f}_{:.4f}_{}_{}min.npy'.format(key[0], key[1], year, self.freq_minutes)
+        return os.path.join(self.table_dir, name)
+
+    def table(self, key, year):
+        table = self._tables.get((key, year))
+        if table is not None:
+            return table
+        with self._lock:
+            table = self._tables.get((key, year))
+            if table is None:
+                path = self._path(key, year)
+                try:
+                    table = np.load(path, mmap_mode='r')
+                except (OSError, ValueError):
+                    table = build_geometry_table(key[0], key[1], year, self.freq_minutes)
+                    try:
+                        os.makedirs(self.table_dir, exist_ok=True)
+                        tmp = '{}.{}.tmp'.format(path, os.getpid())
+                        with open(tmp, 'wb') as f:
+                            np.save(f, table)
+                        os.replace(tmp, path)
+                    except OSError:
+                        pass
+                self._tables[(key, year)] = table
+        return table
+
+    def lookup(self, latitude, longitude, times):
+        # GEOMETRY_COLUMNS at `times` as a float64 (len(times) x 5) array.
+        key = site_key(latitude, longitude)
+        times = pd.DatetimeIndex(times)
+        utc = times.tz_convert('UTC') if times.tz is not None else times.tz_localize('UTC')
+        step = self.freq_minutes * 60 * 10 ** 9
+        out = np.empty((len(utc), len(GEOMETRY_COLUMNS)))
+        years = utc.year.values
+        for year in np.unique(years):
+            mask = years == year
+            table = self.table(key, int(year))
+            t0 = pd.Timestamp('{}-01-01'.format(year), tz='UTC').value
+            pos = (utc.asi8[mask] - t0) / step
+            i = np.floor(pos).astype(np.int64)
+            w = (pos - i)[:, None]
+            left = np.asarray(table[i], dtype=np.float64)
+            right = np.asarray(table[np.minimum(i + 1, len(table) - 1)], dtype=np.float64)
+            # azimuth wraps around at 360 degrees
+            right[:, 2] = left[:, 2] + (right[:, 2] - left[:, 2] + 180) % 360 - 180
+            values = np.where(w == 0, left, left + w * (right - left))
+            values[:, 2] %= 360
+            out[mask] = values
+        return out
+
+    def solpos(self, latitude, longitude, times):
+        # Same columns as Location.get_solarposition (plus 'airmass').
+        values = self.lookup(latitude, longitude, times)
+        solpos = pd.DataFrame(values[:, :4], index=times, columns=GEOMETRY_COLUMNS[:4])
+        solpos['apparent_elevation'] = 90 - solpos['apparent_zenith']
+        solpos['elevation'] = 90 - solpos['zenith']
+        return solpos
+
+    def dni_extra(self, latitude, longitude, times):
+        # get_extra_radiation(times) takes the day of year of times in their
+        # own time zone while the table rows are UTC, so the local wall-clock
+        # times are looked up as if they were UTC.
+        times = pd.DatetimeIndex(times)
+        wall = times.tz_localize(None) if times.tz is not None else times
+        return pd.Series(self.lookup(latitude, longitude, wall)[:, 4], index=times)
+
+
+# Process-wide registry used by pvgeneration.get_solpos/get_dni_extra.
+geometry_cache = GeometryCache()
+
+
+def register_site(latitude, longitude, years=None):
+    geometry_cache.register(latitude, longitude, years)
+
+
+def configured_sites(sites=GEOMETRY_SITES):
+    # [(latitude, longitude), ...] of a 'lat,lon;lat,lon' string.
+    return [tuple(float(v) for v in site.split(',')) for site in sites.split(';') if site.strip()]
+
+
+def register_configured_sites(days=21):
+    # Register GEOMETRY_SITES with the tables of every year the next `days`
+    # days fall in.
+    today = datetime.date.today()
+    years = sorted({today.year, (today + datetime.timedelta(days=days)).year})
+    for latitude, longitude in configured_sites():
+        register_site(latitude, longitude, years)
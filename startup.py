@@ -0,0 +1,31 @@
+# Boot time report for the dashboard.
+#
+# Imported first by app.py; mark() records how long each boot phase took
+# since the previous mark and report() prints the breakdown once the app is
+# ready, e.g.
+#     startup: imports 0.41s, sam tables 0.05s, initial figures 0.03s, total 0.49s
+
+import collections
+import sys
+import time
+
+
+_last = time.perf_counter()
+_start = _last
+startup_times = collections.OrderedDict()
+
+
+def mark(phase):
+    global _last
+    now = time.perf_counter()
+    startup_times[phase] = now - _last
+    _last = now
+
+
+def total():
+    return _last - _start
+
+
+def report(out=None):
+    phases = ', '.join('{} {:.2f}s'.format(phase, secs) for phase, secs in startup_times.items())
+    print('startup: {}, total {:.2f}s'.format(phases, total()), file=out or sys.stderr)
@@ -0,0 +1,48 @@
+# Shared fixtures: the forecast pipeline runs offline on
+# weathercache.LocalForecastSource (synthetic GFS-like weather) and every
+# cache/spool directory is a per-test temporary directory.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fleet
+import orientations
+import pvgeneration
+import resultcache
+from weathercache import LocalForecastSource
+
+
+LATITUDE = 39.7423
+LONGITUDE = -105.1785
+MODULE = {'pvmanf': 'SandiaMod', 'pvmodel': 'Canadian_Solar_CS5P_220M___2009_'}
+INVERTER = {'invmanf': 'sandiainverter', 'invmodel': 'ABB__MICRO_0_25_I_OUTD_US_208__208V_'}
+SITE = dict(latitude=LATITUDE, longitude=LONGITUDE, surface_tilt=30., surface_azimuth=180., albedo=0.2,
+            **MODULE, **INVERTER)
+
+
+def forecast_args(daysahead=2, fm='GFS'):
+    # get_forecasts arguments of the test site.
+    return (LATITUDE, LONGITUDE, 30, 180, 0.2, MODULE, INVERTER, fm, daysahead)
+
+
+@pytest.fixture
+def source(monkeypatch):
+    # LocalForecastSource served for every model name, with empty caches.
+    src = LocalForecastSource('GFS')
+    get_model = lambda fm: src if isinstance(fm, str) else fm
+    for module in (pvgeneration, fleet, orientations):
+        monkeypatch.setattr(module, 'get_forecast_model', get_model)
+    pvgeneration.weather_cache.clear()
+    yield src
+    pvgeneration.weather_cache.clear()
+
+
+@pytest.fixture
+def result_cache(monkeypatch, tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path / 'results'))
+    monkeypatch.setattr(resultcache, 'result_cache', cache)
+    return cache
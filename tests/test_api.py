@@ -0,0 +1,106 @@
+import gzip
+import io
+import json
+import time
+
+import flask
+import numpy as np
+import pytest
+
+import api
+from jobs import JobQueue
+
+from conftest import SITE
+
+
+@pytest.fixture
+def client(source, result_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, 'job_queue', JobQueue(job_dir=str(tmp_path / 'jobs')))
+    app = flask.Flask(__name__)
+    app.register_blueprint(api.api)
+    return app.test_client()
+
+
+def post(client, sites=None, **body):
+    body = dict({'model': 'GFS', 'daysahead': 2, 'sites': sites or [dict(SITE, id='plant-1')]}, **body)
+    return client.post('/api/forecasts', data=json.dumps(body), content_type='application/json')
+
+
+def test_json_forecasts(client):
+    response = post(client, outputs=['ac_out', 'dc_out'])
+    assert response.status_code == 200
+    body = response.get_json()
+    site, = body['sites']
+    assert site['id'] == 'plant-1' and set(site) == {'id', 'ac_out', 'dc_out'}
+    assert len(site['ac_out']) == len(body['time']) == len(site['dc_out']['p_mp'])
+
+
+def test_npz_forecasts_gzip(client):
+    response = client.post('/api/forecasts', headers={'Accept-Encoding': 'gzip'},
+                           data=json.dumps({'sites': [SITE, SITE], 'daysahead': 1, 'format': 'npz'}),
+                           content_type='application/json')
+    assert response.status_code == 200 and response.headers['Content-Encoding'] == 'gzip'
+    arrays = np.load(io.BytesIO(gzip.decompress(response.data)))
+    assert arrays['ac_out'].shape == (2, len(arrays['time']))
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'sites': []},
+    {'sites': [SITE], 'daysahead': 0},
+    {'sites': [SITE], 'model': 'ECMWF'},
+    {'sites': [SITE], 'outputs': ['p_dc']},
+    {'sites': [dict(SITE, latitude=None)]},
+    {'sites': [dict(SITE, latitude='north')]},
+    {'sites': [dict(SITE, pvmodel=5)]},
+    {'sites': [dict(SITE, invmanf=['sandiainverter'])]},
+])
+def test_bad_requests(client, body):
+    response = client.post('/api/forecasts', data=json.dumps(body), content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('site', [dict(SITE, invmodel='No such inverter'), dict(SITE, pvmanf='CECMod'),
+                                  dict(SITE, invmanf='../../etc')])
+def test_unknown_sam_entries(client, source, site):
+    response = post(client, [site])
+    assert response.status_code == 422
+    # rejected before any weather was pulled
+    assert source.calls == 0
+
+
+def test_fetch_failure(client, source):
+    def fail(*args, **kwargs):
+        raise OSError('connection refused')
+
+    source.get_processed_data = fail
+    response = post(client)
+    assert response.status_code == 502
+    assert 'connection refused' in response.get_json()['error']
+
+
+def test_large_batch_runs_as_job(client, monkeypatch):
+    monkeypatch.setattr(api, 'API_SYNC_SITES', 2)
+    sites = [dict(SITE, longitude=SITE['longitude'] + i, id=i) for i in range(3)]
+    response = post(client, sites, daysahead=1)
+    assert response.status_code == 202
+    url = response.get_json()['status_url']
+    assert response.headers['Location'].endswith(url)
+    for _ in range(200):
+        response = client.get(url)
+        if response.status_code != 202:
+            break
+        time.sleep(0.05)
+    assert response.status_code == 200
+    assert [site['id'] for site in response.get_json()['sites']] == [0, 1, 2]
+    assert client.get('/api/jobs/0123abcd').status_code == 404
+
+
+def test_sam_search(client):
+    response = client.get('/api/sam/sandiainverter?q=abb+micro&page_size=5')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['total'] > 5 and len(body['options']) == 5
+    assert client.get('/api/sam/nope').status_code == 404
+    assert client.get('/api/sam/SandiaMod?page=x').status_code == 400
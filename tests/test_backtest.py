@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import chunk_offsets, iter_weather, load_sites, run_backtest
+from resultstore import ResultStore
+from weathercache import LocalForecastSource
+
+from conftest import SITE
+
+
+START, END = '2019-06-01', '2019-06-09'
+
+
+@pytest.fixture
+def archive(tmp_path):
+    # Hourly weather of one site for 10 days, and its sites file.
+    fm = LocalForecastSource('archive', freq='1h')
+    fm.set_location('UTC', SITE['latitude'], SITE['longitude'])
+    weather = fm.synthetic_data(SITE['latitude'], SITE['longitude'], pd.Timestamp('2019-05-31', tz='UTC'),
+                                pd.Timestamp('2019-06-10', tz='UTC'))
+    archive_dir = tmp_path / 'archive'
+    archive_dir.mkdir()
+    weather.rename_axis('time').to_csv(str(archive_dir / 'site-1.csv'))
+    sites_path = str(tmp_path / 'sites.csv')
+    pd.DataFrame([dict(SITE, site_id='site-1')]).to_csv(sites_path, index=False)
+    return load_sites(sites_path), str(archive_dir)
+
+
+def stored(out_dir):
+    # All stored runs of site-1 joined in time order.
+    store = ResultStore(out_dir)
+    return pd.concat([store.read('site-1', run_id)[3] for run_id in store.runs('site-1')]).sort_index()
+
+
+def test_chunk_offsets_match_read_csv_chunks(archive):
+    path = os.path.join(archive[1], 'site-1.csv')
+    offsets, times = chunk_offsets(path, 50)
+    chunks = list(iter_weather(path, chunk_rows=50))
+    assert len(offsets) == len(chunks)
+    assert times.equals(pd.DatetimeIndex([chunk.index[0] for chunk in chunks]))
+    seeked = list(iter_weather(path, chunk_rows=50, rows=(int(offsets[2]), 100)))
+    assert [chunk.index[0] for chunk in seeked] == [chunks[2].index[0], chunks[3].index[0]]
+
+
+def test_resume_models_only_missing_runs(archive, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    stats = run_backtest(*archive, out_dir=out_dir, start=START, end=END, workers=1, chunk_rows=48)
+    assert stats['modelled'] == 8 * 24 and stats['skipped'] == 0
+    full = stored(out_dir)
+
+    store = ResultStore(out_dir)
+    dropped = store.runs('site-1')[1:3]
+    rows = sum(len(store.read('site-1', run_id)[3]) for run_id in dropped)
+    for run_id in dropped:
+        os.remove(os.path.join(out_dir, 'site-1', '{}.pvr'.format(run_id)))
+    stats = run_backtest(*archive, out_dir=out_dir, start=START, end=END, workers=1, chunk_rows=48)
+    assert stats['modelled'] == rows and stats['skipped'] == 8 * 24 - rows
+    pd.testing.assert_series_equal(stored(out_dir), full)
+
+
+def test_shards_match_the_whole_range(archive, tmp_path):
+    whole = str(tmp_path / 'whole')
+    sharded = str(tmp_path / 'sharded')
+    run_backtest(*archive, out_dir=whole, start=START, end=END, workers=1, chunk_rows=50)
+    stats = run_backtest(*archive, out_dir=sharded, start=START, end=END, workers=2, chunk_rows=50,
+                         shard_days=3)
+    assert stats['tasks'] == 3 and stats['modelled'] == 8 * 24
+    a, b = stored(whole), stored(sharded)
+    assert a.index.equals(pd.date_range(START, '2019-06-08 23:00', freq='1h', tz='UTC'))
+    assert a.index.equals(b.index)
+    np.testing.assert_allclose(a.to_numpy(), b.to_numpy())
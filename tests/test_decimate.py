@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import decimate
+
+
+def series(n=5000):
+    x = pd.date_range('2026-10-18', periods=n, freq='min', tz='US/Mountain')
+    y = np.sin(np.arange(n) / 50.) * 100 + np.where(np.arange(n) == 1234, 500, 0)
+    return x, y
+
+
+def test_lttb_keeps_endpoints_and_budget():
+    x, y = series()
+    idx = decimate.lttb(x.asi8, y, 300)
+    assert len(idx) == 300
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert np.all(np.diff(idx) > 0)
+    # the spike survives
+    assert 1234 in idx
+
+
+def test_lttb_small_inputs_unchanged():
+    assert list(decimate.lttb(np.arange(10), np.arange(10), 20)) == list(range(10))
+    assert list(decimate.lttb(np.arange(10), np.arange(10), 2)) == list(range(10))
+
+
+def test_traces_point_budget():
+    x, y = series()
+    line, = decimate.traces(x[:500], y[:500], 'ac', 1000)
+    assert len(line['x']) == 500
+    traces = decimate.traces(x, y, 'ac', 400)
+    lower, upper, line = traces
+    assert len(line['x']) == 400 and len(line['y']) == 400
+    assert line['x'][0] == x[0].strftime('%Y-%m-%d %H:%M')
+    assert line['x'][-1] == x[-1].strftime('%Y-%m-%d %H:%M')
+    # envelope band holds the extremes
+    assert max(upper['y']) == round(y.max(), decimate.DECIMALS)
+    assert min(lower['y']) == round(y.min(), decimate.DECIMALS)
+
+
+def test_figure_scales_with_width():
+    x, y = series()
+    fig = decimate.figure('AC', [(x, y, 'ac')], width_px=decimate.graph_width(1200, 4))
+    assert len(fig['data'][-1]['x']) == 400
+    assert fig['layout']['title']['text'] == 'AC'
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ensemble import align, blend, common_grid, get_ensemble_forecasts
+from weathercache import LocalForecastSource
+
+from conftest import forecast_args
+
+
+def hours(start, periods, freq):
+    return pd.date_range('2021-06-01 {}'.format(start), periods=periods, freq=freq, tz='US/Mountain')
+
+
+def test_common_grid():
+    grid = common_grid([hours('03:00', 4, '3h'), hours('00:00', 6, '1h')])
+    assert grid.equals(hours('00:00', 13, '1h'))
+    # members of a single row have no resolution of their own
+    assert common_grid([hours('03:00', 1, '1h'), hours('00:00', 4, '1h')]).equals(hours('00:00', 4, '1h'))
+    assert common_grid([hours('03:00', 1, '1h'), hours('03:00', 1, '1h')]).equals(hours('03:00', 1, '1h'))
+
+
+def test_align_interpolates_inside_the_member_span():
+    member = pd.Series([0., 30., 60.], index=hours('03:00', 3, '3h'))
+    aligned = align(member, hours('00:00', 12, '1h'))
+    np.testing.assert_allclose(aligned['2021-06-01 03:00':'2021-06-01 09:00'], np.arange(0, 61, 10))
+    assert aligned.isna().sum() == 5
+
+
+def test_blend_weights_and_missing_members():
+    index = hours('00:00', 3, '1h')
+    a = pd.Series([1., 2., 3.], index=index)
+    b = pd.Series([3., np.nan, 7.], index=index)
+    mean, spread = blend([a, b], [1, 3])
+    np.testing.assert_allclose(mean, [2.5, 2., 6.])
+    np.testing.assert_allclose(spread, [np.sqrt(0.75), 0., np.sqrt(3.)])
+
+
+def test_members_share_the_blend_grid(source, result_cache):
+    models = [LocalForecastSource('GFS'), LocalForecastSource('HRRR')]
+    out = get_ensemble_forecasts(*forecast_args(1)[:7], models=models, daysahead=1)
+    assert out['models'] == ['GFS', 'HRRR'] and not out['errors']
+    grid = out['blend'][3].index
+    for model in out['models']:
+        for table in out['members'][model]:
+            assert table.index.equals(grid)
+    members = np.stack([out['members'][model][3].to_numpy() for model in out['models']])
+    np.testing.assert_allclose(out['blend'][3], np.nanmean(members, axis=0))
+    np.testing.assert_allclose(out['spread'][3], np.nanstd(members, axis=0), atol=1e-9)
+
+
+def test_failed_members_are_reported(source, result_cache):
+    empty = LocalForecastSource('NAM', data=pd.DataFrame(columns=LocalForecastSource.output_variables,
+                                                          index=pd.DatetimeIndex([], tz='UTC')))
+    out = get_ensemble_forecasts(*forecast_args(1)[:7], models=[LocalForecastSource('GFS'), empty], daysahead=1)
+    assert out['models'] == ['GFS'] and 'NAM' in out['errors']
+    with pytest.raises(ValueError):
+        get_ensemble_forecasts(*forecast_args(1)[:7], models=[empty], daysahead=1)
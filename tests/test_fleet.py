@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fleet import fleet_frame, get_fleet_forecasts, site_forecast
+from pvgeneration import get_forecasts
+
+from conftest import SITE, forecast_args
+
+
+def sites():
+    rows = [dict(SITE), dict(SITE, surface_tilt=10., surface_azimuth=90., albedo=0.3),
+            dict(SITE, latitude=33.45, longitude=-112.07, surface_tilt=45., surface_azimuth=220.)]
+    return pd.DataFrame(rows)
+
+
+def assert_tables_close(got, want):
+    if isinstance(want, pd.DataFrame):
+        got = got[[col for col in want.columns if col in got.columns]]
+        want = want[got.columns]
+    assert got.index.equals(want.index)
+    np.testing.assert_allclose(np.nan_to_num(np.asarray(got, dtype=float)),
+                               np.nan_to_num(np.asarray(want, dtype=float)), rtol=1e-6, atol=1e-6)
+
+
+def test_fleet_matches_get_forecasts(source):
+    fleet_out = get_fleet_forecasts(sites().iloc[:1], 'GFS', 2)
+    for got, want in zip(site_forecast(fleet_out, 0), get_forecasts(*forecast_args(2))):
+        assert_tables_close(got, want)
+
+
+def test_every_site_matches_its_own_run(source):
+    frame = sites()
+    fleet_out = get_fleet_forecasts(frame, 'GFS', 1)
+    for i, site in enumerate(frame.to_dict('records')):
+        want = get_forecasts(site['latitude'], site['longitude'], site['surface_tilt'],
+                             site['surface_azimuth'], site['albedo'],
+                             {'pvmanf': site['pvmanf'], 'pvmodel': site['pvmodel']},
+                             {'invmanf': site['invmanf'], 'invmodel': site['invmodel']}, 'GFS', 1)
+        assert_tables_close(site_forecast(fleet_out, i)[3], want[3])
+    frame_ac = fleet_frame(fleet_out, 'p_ac')
+    assert frame_ac.shape == (len(fleet_out['time']), len(frame))
+
+
+def test_missing_columns(source):
+    with pytest.raises(ValueError):
+        get_fleet_forecasts(sites().drop(columns=['albedo']), 'GFS', 1)
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+import pvgeneration
+from incremental import IncrementalForecaster
+from pvgeneration import forecast_window, get_forecasts
+from weathercache import LocalForecastSource
+
+from conftest import INVERTER, LATITUDE, LONGITUDE, MODULE, forecast_args
+
+
+def weather(daysahead=2):
+    start, end = forecast_window(daysahead)
+    return LocalForecastSource('GFS').get_processed_data(LATITUDE, LONGITUDE, start, end)
+
+
+def run(forecaster, data, daysahead=2):
+    # forecast on a fresh pull of data
+    pvgeneration.weather_cache.clear()
+    now = forecast_window(daysahead)[0]
+    return forecaster.forecast(LATITUDE, LONGITUDE, 30, 180, 0.2, MODULE, INVERTER,
+                               LocalForecastSource('GFS', data=data), daysahead, now=now)
+
+
+def assert_results_equal(got, want):
+    for a, b in zip(got, want):
+        assert a.index.equals(b.index)
+        np.testing.assert_allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), rtol=1e-9)
+
+
+def test_same_cycle_recomputes_nothing(source, tmp_path):
+    forecaster = IncrementalForecaster(str(tmp_path / 'state'))
+    first = forecaster.forecast(*forecast_args(2, fm=source))
+    assert forecaster.last_stats['recomputed'] == forecaster.last_stats['timesteps']
+    second = forecaster.forecast(*forecast_args(2, fm=source))
+    assert forecaster.last_stats['recomputed'] == 0
+    assert_results_equal(second, first)
+    assert_results_equal(first, get_forecasts(*forecast_args(2, fm=source)))
+
+
+def test_new_cycle_recomputes_changed_rows(source, tmp_path):
+    data = weather()
+    update = data.copy()
+    update.iloc[len(update) // 2:, update.columns.get_loc('ghi')] *= 0.5
+    forecaster = IncrementalForecaster(str(tmp_path / 'state'))
+    run(forecaster, data)
+    results = run(forecaster, update)
+    assert 0 < forecaster.last_stats['recomputed'] < forecaster.last_stats['timesteps']
+    pvgeneration.weather_cache.clear()
+    full = get_forecasts(*forecast_args(2, fm=LocalForecastSource('GFS', data=update)))
+    assert_results_equal(results, full)
+
+
+def test_state_is_only_read_back_from_own_files(source, tmp_path):
+    data = weather()
+    state_dir = str(tmp_path / 'state')
+    run(IncrementalForecaster(state_dir), data)
+    forecaster = IncrementalForecaster(state_dir)
+    run(forecaster, data)
+    assert forecaster.last_stats['recomputed'] == 0
+
+    # a state file replaced by a link is ignored
+    (path,) = [os.path.join(state_dir, f) for f in os.listdir(state_dir)]
+    os.rename(path, str(tmp_path / 'moved.pkl'))
+    os.symlink(str(tmp_path / 'moved.pkl'), path)
+    forecaster = IncrementalForecaster(state_dir)
+    run(forecaster, data)
+    assert forecaster.last_stats['recomputed'] == forecaster.last_stats['timesteps']
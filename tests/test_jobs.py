@@ -0,0 +1,69 @@
+import os
+import stat
+import time
+
+import pytest
+
+from jobs import DONE, ERROR, JobQueue, QueueFull, owned_file, spool_dir
+
+
+def wait(queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while queue.status(job_id)['state'] not in (DONE, ERROR):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    return queue.status(job_id)
+
+
+def test_job_result_and_error(tmp_path):
+    queue = JobQueue(job_dir=str(tmp_path / 'jobs'))
+    assert wait(queue, queue.submit(lambda a, b: a + b, 1, b=2))['result'] == 3
+    status = wait(queue, queue.submit(lambda: 1 / 0))
+    assert status['state'] == ERROR and status['error'].startswith('ZeroDivisionError')
+    assert queue.status('unknown') is None
+
+
+def test_generator_job_collects_items(tmp_path):
+    queue = JobQueue(job_dir=str(tmp_path / 'jobs'))
+    assert wait(queue, queue.submit(lambda: (i for i in range(3))))['result'] == [0, 1, 2]
+
+
+def test_status_is_shared_through_the_spool(tmp_path):
+    # a poll that lands on another worker reads the spooled status
+    job_dir = str(tmp_path / 'jobs')
+    queue = JobQueue(job_dir=job_dir)
+    job_id = queue.submit(lambda: 'done')
+    wait(queue, job_id)
+    assert JobQueue(job_dir=job_dir).status(job_id)['result'] == 'done'
+    assert JobQueue(job_dir=job_dir).status('../' + job_id) is None
+
+
+def test_queue_full(tmp_path):
+    queue = JobQueue(max_workers=1, max_pending=1, job_dir=None)
+    job_id = queue.submit(time.sleep, 0.2)
+    assert queue.pending() == 1
+    with pytest.raises(QueueFull):
+        queue.submit(time.sleep, 0)
+    wait(queue, job_id)
+    # the slot is freed just after the job's final state is published
+    deadline = time.time() + 10
+    while queue.pending():
+        assert time.time() < deadline
+        time.sleep(0.01)
+    wait(queue, queue.submit(time.sleep, 0))
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='needs uids')
+def test_spool_directory_is_private(tmp_path):
+    job_dir = JobQueue(job_dir=str(tmp_path / 'jobs')).job_dir
+    assert stat.S_IMODE(os.stat(job_dir).st_mode) == 0o700
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    os.chmod(str(shared), 0o777)
+    assert spool_dir(str(shared)) != str(shared)
+    # spooled files are only read back if they are regular files of this user
+    target = tmp_path / 'elsewhere.pkl'
+    target.write_bytes(b'')
+    link = os.path.join(job_dir, 'link.pkl')
+    os.symlink(str(target), link)
+    assert owned_file(str(target)) and not owned_file(link)
@@ -0,0 +1,48 @@
+# The fused kernel engines against the pvlib path of the fleet chain.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kernel
+from fleet import get_fleet_forecasts
+
+from conftest import SITE
+
+
+OUTPUTS = kernel.DEFAULT_OUTPUTS
+
+
+def sites():
+    rows = [dict(SITE), dict(SITE, surface_tilt=10., surface_azimuth=90., albedo=0.3),
+            dict(SITE, latitude=33.45, longitude=-112.07, surface_tilt=45., surface_azimuth=220.)]
+    return pd.DataFrame(rows)
+
+
+def assert_close(out, ref, rtol, atol):
+    for name in OUTPUTS:
+        np.testing.assert_allclose(np.nan_to_num(out[name]), np.nan_to_num(ref[name]), rtol=rtol, atol=atol,
+                                   err_msg=name)
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'fused'])
+def test_kernel_matches_pvlib_chain(source, engine):
+    ref = get_fleet_forecasts(sites(), 'GFS', 2, engine='pvlib')
+    out = get_fleet_forecasts(sites(), 'GFS', 2, engine=engine)
+    assert out['time'].equals(ref['time'])
+    assert_close(out, ref, rtol=1e-7, atol=1e-6)
+
+
+def test_kernel_float32(source):
+    ref = get_fleet_forecasts(sites(), 'GFS', 2, engine='pvlib')
+    out = get_fleet_forecasts(sites(), 'GFS', 2, engine='numpy', dtype=np.float32)
+    assert out['p_ac'].dtype == np.float32
+    assert_close(out, ref, rtol=1e-4, atol=1e-2)
+
+
+def test_kernel_only_requested_outputs(source):
+    out = get_fleet_forecasts(sites(), 'GFS', 1, engine='numpy', outputs=['p_ac'])
+    assert 'p_ac' in out and 'poa_global' not in out
+    with pytest.raises(ValueError):
+        get_fleet_forecasts(sites(), 'GFS', 1, engine='numpy', outputs=['p_dc'])
+
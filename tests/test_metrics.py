@@ -0,0 +1,55 @@
+import pytest
+
+import metrics
+from pvgeneration import get_forecasts
+
+from conftest import forecast_args
+
+
+@pytest.fixture
+def collecting(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    monkeypatch.setattr(metrics, '_gauges', {})
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    metrics.reset()
+    with metrics.timer('stage'):
+        metrics.count('rows', 10)
+    metrics.timed('stage')(lambda: None)()
+    assert metrics.snapshot() == {'histograms': {}, 'counters': {}}
+    assert 'disabled' in metrics.render()
+
+
+def test_timed_buckets_and_counters(collecting):
+    metrics.observe('stage', 0.003)
+    metrics.observe('stage', 0.2)
+    metrics.count('bytes fetched', 5)
+    metrics.count('bytes fetched', 7)
+    hist = metrics.snapshot()['histograms']['stage']
+    assert hist['count'] == 2 and hist['sum'] == pytest.approx(0.203)
+    assert hist['buckets'][metrics.BUCKETS.index(0.005)] == 1 and hist['buckets'][metrics.BUCKETS.index(0.25)] == 1
+    text = metrics.render()
+    assert 'solarapp_stage_seconds_bucket{stage="stage",le="0.005"} 1' in text
+    assert 'solarapp_stage_seconds_bucket{stage="stage",le="+Inf"} 2' in text
+    assert 'solarapp_bytes_fetched_total 12' in text
+
+
+def test_gauges_are_read_at_render(collecting):
+    values = {'size': 1}
+    metrics.register_gauges('cache', lambda: dict(values))
+    metrics.register_gauges('broken', lambda: 1 / 0)
+    values['size'] = 3
+    text = metrics.render()
+    assert 'solarapp_cache_size 3' in text and 'broken' not in text
+
+
+def test_forecast_stages_are_timed(collecting, source):
+    get_forecasts(*forecast_args(1))
+    stages = metrics.snapshot()['histograms']
+    for stage in ['get_weather_data', 'model_forecasts']:
+        assert stages[stage]['count'] == 1
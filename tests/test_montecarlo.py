@@ -0,0 +1,42 @@
+import numpy as np
+
+from montecarlo import UNCERTAINTY, ar1_noise, get_forecast_quantiles, perturb_weather
+from pvgeneration import forecast_window
+
+from conftest import forecast_args
+
+
+def test_ar1_noise_is_stationary_with_the_given_autocorrelation():
+    e = ar1_noise(np.random.RandomState(1), 4000, 48, 0.8)
+    # unit variance from the first step on
+    np.testing.assert_allclose(e.std(axis=0)[[0, 1, 24, 47]], 1, atol=0.05)
+    for lag in (1, 2):
+        corr = np.mean(e[:, :-lag] * e[:, lag:]) / np.mean(e * e)
+        assert abs(corr - 0.8 ** lag) < 0.02
+
+
+def test_perturbed_weather_stays_physical(source):
+    data = source.get_processed_data(39.7, -105.2, *forecast_window(2))
+    weather, albedo = perturb_weather(data, 0.2, 200)
+    for col in ('ghi', 'dni', 'dhi', 'wind_speed'):
+        assert weather[col].shape == (200, len(data)) and (weather[col] >= 0).all()
+    night = data['ghi'].to_numpy() == 0
+    assert (weather['ghi'][:, night] == 0).all()
+    assert albedo.shape == (200, 1) and ((albedo >= 0) & (albedo <= 1)).all()
+    assert abs(albedo.std() - UNCERTAINTY['albedo']) < 0.01
+
+
+def test_band_quantiles(source):
+    out = get_forecast_quantiles(*forecast_args(1, fm=source), n_samples=300)
+    bands = out['ac_quantiles']
+    ac_out = out['forecast'][3]
+    assert list(bands.columns) == ['p10', 'p50', 'p90'] and bands.index.equals(ac_out.index)
+    assert (bands['p10'] <= bands['p50']).all() and (bands['p50'] <= bands['p90']).all()
+    # a band around the deterministic forecast in daytime, none at night
+    day = ac_out > 10
+    assert (bands['p90'][day] > bands['p10'][day]).all()
+    assert ((bands['p10'][day] <= ac_out[day] * 1.01) & (ac_out[day] <= bands['p90'][day] * 1.01)).mean() > 0.9
+    np.testing.assert_allclose(bands['p10'][~day], bands['p90'][~day], atol=1e-6)
+    # the same seed gives the same bands
+    again = get_forecast_quantiles(*forecast_args(1, fm=source), n_samples=300)['ac_quantiles']
+    np.testing.assert_array_equal(again.to_numpy(), bands.to_numpy())
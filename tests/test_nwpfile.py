@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nwpfile import NWPFile, NWPFileSource
+from pvgeneration import forecast_window, get_forecasts
+
+from conftest import INVERTER, LATITUDE, LONGITUDE, MODULE
+
+netCDF4 = pytest.importorskip('netCDF4')
+pytest.importorskip('siphon')
+
+
+LATS = np.arange(38., 42.01, 0.5)
+LONS = np.arange(252., 258.01, 0.5)     # 0-360 like GFS
+
+
+@pytest.fixture
+def gfs_file(tmp_path):
+    # A small synthetic GFS cycle with the pvlib GFS variable names, 3-hourly
+    # over the forecast window. Cloud cover differs per grid point.
+    start = forecast_window(2)[0].tz_convert('UTC') - pd.Timedelta(hours=6)
+    times = pd.date_range(start, periods=26, freq='3h')
+    path = str(tmp_path / 'gfs.nc')
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.createDimension('time', len(times))
+        ds.createDimension('isobaric', 2)
+        ds.createDimension('lat', len(LATS))
+        ds.createDimension('lon', len(LONS))
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since {}'.format(start.strftime('%Y-%m-%d %H:%M:%S'))
+        time[:] = np.arange(len(times)) * 3.
+        ds.createVariable('isobaric', 'f4', ('isobaric',))[:] = [85000., 100000.]
+        ds.createVariable('lat', 'f4', ('lat',))[:] = LATS
+        ds.createVariable('lon', 'f4', ('lon',))[:] = LONS
+        shape = (len(times), len(LATS), len(LONS))
+        clouds = np.broadcast_to(np.linspace(0, 80, len(LONS)), shape)
+        for name, values in [('Temperature_surface', np.full(shape, 293.15)),
+                             ('Total_cloud_cover_entire_atmosphere_Mixed_intervals_Average', clouds),
+                             ('Low_cloud_cover_low_cloud_Mixed_intervals_Average', clouds / 2),
+                             ('Medium_cloud_cover_middle_cloud_Mixed_intervals_Average', clouds / 4),
+                             ('High_cloud_cover_high_cloud_Mixed_intervals_Average', clouds / 4)]:
+            ds.createVariable(name, 'f4', ('time', 'lat', 'lon'))[:] = values
+        wind = np.zeros((len(times), 2) + shape[1:])
+        wind[:, 1] = 3.     # only the 1000 hPa level is used
+        ds.createVariable('u-component_of_wind_isobaric', 'f4', ('time', 'isobaric', 'lat', 'lon'))[:] = wind
+        ds.createVariable('v-component_of_wind_isobaric', 'f4', ('time', 'isobaric', 'lat', 'lon'))[:] = wind * 0
+    return path
+
+
+def test_nearest_grid_point_across_longitude_conventions(gfs_file):
+    grid = NWPFile(gfs_file)
+    iy, ix, km = grid.nearest([LATITUDE, 40.1], [LONGITUDE, 360 - 103.9])
+    assert LATS[iy].tolist() == [39.5, 40.] and LONS[ix].tolist() == [255., 256.]
+    assert (km < 40).all()
+    grid.close()
+
+
+def test_extract_reads_the_nearest_points(gfs_file):
+    grid = NWPFile(gfs_file)
+    name = 'Total_cloud_cover_entire_atmosphere_Mixed_intervals_Average'
+    times, values = grid.extract([name], [39., 41.], [-107.9, -102.1])[name]
+    assert values.shape == (2, len(times)) == (2, 26)
+    np.testing.assert_allclose(values[:, 0], [grid.dataset[name][0, 2, 0], grid.dataset[name][0, 6, 12]])
+    grid.close()
+
+
+def test_forecast_from_file(source, gfs_file):
+    fm = NWPFileSource('GFS', gfs_file)
+    poa_irrad, pvtemp, dc_out, ac_out = get_forecasts(LATITUDE, LONGITUDE, 30, 180, 0.2, MODULE, INVERTER, fm, 2)
+    start, end = forecast_window(2)
+    assert ac_out.index[0] >= start and ac_out.index[-1] <= end
+    # night time consumption, a daytime peak around solar noon below the
+    # inverter rating on both days
+    assert (ac_out[ac_out.index.hour < 4] <= 0).all()
+    days = ac_out[ac_out.index < end]
+    for _, day in days.groupby(days.index.date):
+        assert 100 < day.max() <= 250
+        assert 10 <= day.idxmax().hour <= 14
+    # the clearer grid point to the west gives more energy
+    cloudy = get_forecasts(LATITUDE, LONGITUDE + 2, 30, 180, 0.2, MODULE, INVERTER, fm, 2)[3]
+    assert ac_out.clip(lower=0).sum() > cloudy.clip(lower=0).sum()
+
+
+def test_fleet_data_matches_single_pulls(gfs_file):
+    fm = NWPFileSource('GFS', gfs_file)
+    start, end = forecast_window(2)
+    frames = fm.get_fleet_data([LATITUDE, 41.], [LONGITUDE, -103.], start, end)
+    for frame, (lat, lon) in zip(frames, [(LATITUDE, LONGITUDE), (41., -103.)]):
+        pd.testing.assert_frame_equal(frame, fm.get_processed_data(lat, lon, start, end))
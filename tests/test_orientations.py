@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from fleet import site_forecast
+from orientations import evaluate_orientations, get_site_intermediates
+from pvgeneration import get_forecasts
+
+from conftest import INVERTER, LATITUDE, LONGITUDE, MODULE
+
+
+def test_each_orientation_matches_get_forecasts(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 2)
+    tilts, azimuths = [30, 30, 15], [90, 270, 180]
+    out = evaluate_orientations(site, tilts, azimuths, 0.2, MODULE, INVERTER)
+    assert out['sites'] == ['30/90', '30/270', '15/180']
+    for i, (tilt, azimuth) in enumerate(zip(tilts, azimuths)):
+        want = get_forecasts(LATITUDE, LONGITUDE, tilt, azimuth, 0.2, MODULE, INVERTER, 'GFS', 2)
+        got = site_forecast(out, i)
+        assert got[3].index.equals(want[3].index)
+        np.testing.assert_allclose(got[3].to_numpy(), want[3].to_numpy(), rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(got[0]['poa_global'].to_numpy(), want[0]['poa_global'].to_numpy(),
+                                   rtol=1e-6, atol=1e-6)
+
+
+def test_east_and_west_peak_on_their_side_of_noon(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 1)
+    out = evaluate_orientations(site, [40, 40], [90, 270], [0.2, 0.2], MODULE, INVERTER)
+    east, west = out['poa_global'].argmax(axis=1)
+    assert out['time'][east] < out['time'][west]
+
+
+def test_mismatched_orientations(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 1)
+    with pytest.raises(ValueError):
+        evaluate_orientations(site, [30, 20], [180], 0.2, MODULE, INVERTER)
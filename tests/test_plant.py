@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fleet import sam_parameters
+from orientations import get_site_intermediates
+from plant import PLANT_COLUMNS, evaluate_plant, get_plant_forecasts, plant_frame
+from pvgeneration import get_forecasts
+
+from conftest import INVERTER, LATITUDE, LONGITUDE, MODULE, forecast_args
+
+
+def block(**values):
+    row = dict(surface_tilt=30., surface_azimuth=180., albedo=0.2, modules_per_string=1,
+               strings_per_inverter=1, inverters=1, **MODULE, **INVERTER)
+    row.update(values)
+    return row
+
+
+def plant(*rows):
+    return pd.DataFrame(list(rows))[PLANT_COLUMNS]
+
+
+def test_single_module_plant_matches_get_forecasts(source):
+    out = get_plant_forecasts(LATITUDE, LONGITUDE, plant(block()), 'GFS', 2)
+    poa_irrad, pvtemp, dc_out, ac_out = get_forecasts(*forecast_args(2))
+    frame = plant_frame(out)
+    assert frame.index.equals(ac_out.index)
+    np.testing.assert_allclose(frame['plant_ac'], np.nan_to_num(ac_out.to_numpy(dtype=float)),
+                               rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(frame['plant_dc'], np.nan_to_num(dc_out['p_mp'].to_numpy(dtype=float)),
+                               rtol=1e-6, atol=1e-6)
+
+
+def test_blocks_are_merged_and_scaled_by_inverter_count(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 1)
+    one = evaluate_plant(site, plant(block()))
+    out = evaluate_plant(site, plant(block(inverters=3), block(surface_azimuth=90., inverters=4),
+                                     block(inverters=2), block(modules_per_string=2, strings_per_inverter=2)))
+    assert out['blocks']['inverters'].tolist() == [5, 4, 1]
+    # the 2x2 block shares the module configuration of the first one
+    assert len(out['configs']) == 2
+    np.testing.assert_allclose(out['p_ac'][0], one['p_ac'][0])
+    np.testing.assert_allclose(out['p_dc'][2], 4 * one['p_dc'][0])
+    np.testing.assert_allclose(out['plant_ac'], (out['p_ac'] * [[5], [4], [1]]).sum(axis=0))
+
+
+def test_clipping_at_the_inverter_rating(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 1)
+    out = evaluate_plant(site, plant(block(strings_per_inverter=3, inverters=10)))
+    paco = sam_parameters([INVERTER['invmanf']], [INVERTER['invmodel']])['Paco'][0]
+    assert out['p_ac'].max() <= paco + 1e-9
+    assert out['clipping'].max() > 0 and (out['clipping'] >= 0).all()
+    assert out['plant_ac'].max() == pytest.approx(10 * out['p_ac'].max())
+
+
+def test_missing_columns(source):
+    site = get_site_intermediates(LATITUDE, LONGITUDE, 'GFS', 1)
+    with pytest.raises(ValueError):
+        evaluate_plant(site, plant(block()).drop(columns=['inverters']))
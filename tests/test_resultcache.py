@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from resultcache import get_forecasts_cached, iter_forecasts_cached
+from weathercache import cycle_expiry, latest_cycle
+
+from conftest import forecast_args
+
+
+NOW = pd.Timestamp.now(tz='UTC').floor('h')
+
+
+def test_hit_within_the_cycle(source, result_cache):
+    first = get_forecasts_cached(*forecast_args(2), now=NOW)
+    second = get_forecasts_cached(*forecast_args(2), now=NOW)
+    assert source.calls == 1
+    assert result_cache.stats()['hits'] == 1
+    np.testing.assert_array_equal(first[3].to_numpy(), second[3].to_numpy())
+
+
+def test_new_cycle_recomputes(source, result_cache):
+    get_forecasts_cached(*forecast_args(2), now=NOW)
+    later = cycle_expiry(source, latest_cycle(source, NOW))
+    get_forecasts_cached(*forecast_args(2), now=later)
+    assert result_cache.stats()['hits'] == 0
+
+
+def test_chunks_are_cached_joined(source, result_cache):
+    chunks = list(iter_forecasts_cached(*forecast_args(3), now=NOW))
+    assert len(chunks) == 3
+    # the whole horizon was pulled once
+    assert source.calls == 1
+    cached = list(iter_forecasts_cached(*forecast_args(3), now=NOW))
+    assert len(cached) == 1
+    joined = pd.concat([chunk[3] for chunk in chunks])
+    np.testing.assert_array_equal(cached[0][3].to_numpy(), joined.to_numpy())
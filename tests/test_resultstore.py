@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from pvgeneration import get_forecasts
+from resultstore import MAGIC, ResultStore
+
+from conftest import forecast_args
+
+
+def test_round_trip(source, tmp_path):
+    results = get_forecasts(*forecast_args(2))
+    store = ResultStore(str(tmp_path))
+    run_id = store.write('site-1', *results, meta={'daysahead': 2})
+    assert store.sites() == ['site-1'] and store.runs('site-1') == [run_id]
+    with open(str(tmp_path / 'site-1' / '{}.pvr'.format(run_id)), 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC
+    assert store.header('site-1')['meta'] == {'daysahead': 2}
+    for got, want in zip(store.read('site-1'), results):
+        assert got.index.equals(want.index) and str(got.index.tz) == str(want.index.tz)
+        if isinstance(want, pd.DataFrame):
+            pd.testing.assert_frame_equal(got, want[got.columns], check_freq=False)
+            assert sorted(got.columns) == sorted(want.columns)
+        else:
+            np.testing.assert_array_equal(got.to_numpy(), want.to_numpy())
+
+
+def test_time_range_and_latest_run(source, tmp_path):
+    results = get_forecasts(*forecast_args(2))
+    store = ResultStore(str(tmp_path))
+    store.write('site-1', *results, run_id='20260101T000000Z')
+    store.write('site-1', *(table * 2 for table in results), run_id='20260102T000000Z')
+    assert store.latest_run('site-1') == '20260102T000000Z'
+    index = results[3].index
+    start, end = index[3], index[10]
+    ac = store.read('site-1', start=start, end=end)[3]
+    want = results[3] * 2
+    assert ac.index.min() >= start and ac.index.max() <= end
+    np.testing.assert_array_equal(ac.to_numpy(), want[ac.index].to_numpy())
+    first = store.read('site-1', run_id='20260101T000000Z')[3]
+    np.testing.assert_array_equal(first.to_numpy(), results[3].to_numpy())
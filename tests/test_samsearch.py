@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import samsearch
+from samcache import SamTable
+
+
+def index_of(names, paco):
+    table = SamTable('test', names, ['Paco'], np.array(paco, dtype=float)[:, None], {})
+    return samsearch.SamIndex(table)
+
+
+NAMES = ['Acme__Power_SMA_3000__240V_', 'SMA_America__SB3000US__240V_', 'SMA_America__SB5000US__240V_',
+         'Fronius_USA__IG_5000__240V_', 'Sunny_Island_SMA']
+INDEX = index_of(NAMES, [3000, 3000, 5000, 5000, np.nan])
+
+
+def found(query):
+    return [NAMES[i] for i in INDEX.lookup(query)]
+
+
+def test_words_must_all_match_as_prefixes():
+    assert found('sma america') == ['SMA_America__SB3000US__240V_', 'SMA_America__SB5000US__240V_']
+    assert found('sb50') == ['SMA_America__SB5000US__240V_']
+    assert found('fronius sb5000') == []
+
+
+def test_names_starting_with_the_query_rank_first():
+    result = found('sma')
+    assert set(result) == {NAMES[0], NAMES[1], NAMES[2], NAMES[4]}
+    assert result[:2] == ['SMA_America__SB3000US__240V_', 'SMA_America__SB5000US__240V_']
+
+
+def test_rating_tokens_and_labels():
+    assert found('5000w') == ['SMA_America__SB5000US__240V_', 'Fronius_USA__IG_5000__240V_']
+    assert INDEX.option(2) == {'label': 'SMA America SB5000US 240V (5,000 W)',
+                               'value': 'SMA_America__SB5000US__240V_'}
+    assert INDEX.option(4)['label'] == 'Sunny Island SMA'
+
+
+def test_typos_fall_back_to_close_tokens():
+    assert found('fronuis') == ['Fronius_USA__IG_5000__240V_']
+
+
+def test_empty_query_lists_everything():
+    assert found('') == NAMES
+
+
+def test_search_pages_real_catalog():
+    first = samsearch.search('SandiaMod', 'canadian', page=0, page_size=1)
+    second = samsearch.search('SandiaMod', 'canadian', page=1, page_size=1)
+    assert first['total'] == second['total'] >= 2
+    assert first['options'][0]['value'] != second['options'][0]['value']
+    assert samsearch.search('SandiaMod', 'cs5p 220')['options'][0]['value'] == 'Canadian_Solar_CS5P_220M___2009_'
+    with pytest.raises(KeyError):
+        samsearch.search('NoSuchTable', 'x')
+
+
+def test_dropdown_keeps_selected_value_and_hints_more():
+    options = samsearch.dropdown_options('SandiaMod', 'canadian', 'Advent_Solar_AS160___2006_', page_size=1)
+    assert options[0]['value'] == 'Advent_Solar_AS160___2006_'
+    assert options[-1]['disabled'] and options[-1]['value'] == ''
+    assert samsearch.dropdown_options(None) == []
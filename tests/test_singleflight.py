@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(fn, n=4):
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(fn())) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return out
+
+
+def test_identical_calls_share_one_run(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 42
+
+    assert run_concurrently(lambda: flight.do(('key',), compute)) == [42] * 4
+    assert len(calls) == 1
+    assert flight.stats()['shared'] == 3 and flight.stats()['inflight'] == 0
+
+
+def test_different_keys_run_separately(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    assert flight.do(('a',), lambda: 1) == 1
+    assert flight.do(('b',), lambda: 2) == 2
+    assert flight.stats()['leaders'] == 2
+
+
+def test_leader_error_reaches_followers(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError('boom')
+
+    def call():
+        try:
+            flight.do(('key',), fail)
+        except ValueError as exc:
+            return str(exc)
+
+    assert run_concurrently(call) == ['boom'] * 4
+
+
+def test_iterate_shares_items(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    calls = []
+
+    def chunks():
+        calls.append(1)
+        for i in range(3):
+            time.sleep(0.05)
+            yield i
+
+    assert run_concurrently(lambda: list(flight.iterate(('key',), chunks))) == [[0, 1, 2]] * 4
+    assert len(calls) == 1
+
+
+def _slow(pid_file):
+    with open(pid_file, 'a') as f:
+        f.write('{}\n'.format(os.getpid()))
+    time.sleep(0.5)
+    return 'result'
+
+
+def _worker(lock_dir, pid_file, queue):
+    flight = SingleFlight(lock_dir)
+    queue.put((flight.do(('cross',), _slow, pid_file), flight.stats()['shared_across_workers']))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_shared_across_processes(tmp_path):
+    pid_file = str(tmp_path / 'pids')
+    lock_dir = str(tmp_path / 'locks')
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    workers = [context.Process(target=_worker, args=(lock_dir, pid_file, queue)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    results = sorted(queue.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join()
+    assert results == [('result', 0), ('result', 1)]
+    with open(pid_file) as f:
+        assert len(f.read().split()) == 1
+
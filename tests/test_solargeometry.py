@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pvlib import irradiance
+from pvlib.location import Location
+
+import solargeometry
+from solargeometry import GeometryCache, configured_sites
+
+from conftest import LATITUDE, LONGITUDE
+
+
+@pytest.fixture(scope='module')
+def cache(tmp_path_factory):
+    cache = GeometryCache(table_dir=str(tmp_path_factory.mktemp('geometry')), freq_minutes=10)
+    cache.register(LATITUDE, LONGITUDE)
+    return cache
+
+
+def test_landing_site_is_registered_by_default():
+    assert configured_sites(solargeometry.GEOMETRY_SITES) == [(LATITUDE, LONGITUDE)]
+    assert configured_sites('1,2; 3.5,-4;') == [(1., 2.), (3.5, -4.)]
+
+
+def test_lookup_matches_spa(cache):
+    times = pd.date_range('2021-06-01', periods=96, freq='15min', tz='America/Denver')
+    want = Location(LATITUDE, LONGITUDE).get_solarposition(times)
+    got = cache.solpos(LATITUDE, LONGITUDE, times)
+    assert cache.is_registered(LATITUDE, LONGITUDE)
+    # rows on the table grid are exact up to float32, the times in between
+    # are interpolated
+    on_grid = times.minute % 10 == 0
+    np.testing.assert_allclose(got['zenith'][on_grid], want['zenith'][on_grid], atol=1e-3)
+    np.testing.assert_allclose(got['zenith'], want['zenith'], atol=0.05)
+    np.testing.assert_allclose(got['apparent_zenith'], want['apparent_zenith'], atol=0.05)
+
+
+def test_azimuth_wraps_around_north(cache):
+    # Around solar midnight the azimuth crosses 360 -> 0; interpolating
+    # between e.g. 355 and 5 must give ~0, not ~180.
+    times = pd.date_range('2021-06-01 06:05', periods=24 * 12, freq='5min', tz='UTC')
+    want = Location(LATITUDE, LONGITUDE).get_solarposition(times)['azimuth'].to_numpy()
+    got = cache.solpos(LATITUDE, LONGITUDE, times)['azimuth'].to_numpy()
+    diff = (got - want + 180) % 360 - 180
+    assert np.abs(diff).max() < 0.5
+    assert ((got >= 0) & (got < 360)).all()
+
+
+def test_dni_extra_uses_local_day(cache):
+    # Late evening in Denver is already the next day in UTC; dni_extra has to
+    # follow the local day like get_extra_radiation does.
+    times = pd.date_range('2021-12-31 20:00', periods=8, freq='H', tz='America/Denver')
+    want = irradiance.get_extra_radiation(times)
+    got = cache.dni_extra(LATITUDE, LONGITUDE, times)
+    assert got.index.equals(times)
+    np.testing.assert_allclose(got, want, rtol=1e-5)
@@ -0,0 +1,36 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import startup
+from pvgeneration import FORECAST_MODELS, get_forecast_model
+
+
+def test_report_lists_phases_in_order(monkeypatch):
+    monkeypatch.setattr(startup, 'startup_times', startup.startup_times.__class__())
+    startup.mark('imports')
+    startup.mark('initial figures')
+    out = io.StringIO()
+    startup.report(out)
+    line = out.getvalue()
+    assert line.startswith('startup: imports ') and line.index('imports') < line.index('initial figures')
+    assert sum(startup.startup_times.values()) <= startup.total()
+
+
+def test_forecast_models_are_imported_lazily():
+    # Importing pvgeneration must not pull in pvlib.forecast (siphon,
+    # netCDF4) or matplotlib.
+    code = ('import sys, pvgeneration; '
+            'print(sorted(m for m in ("pvlib.forecast", "siphon", "matplotlib") if m in sys.modules))')
+    out = subprocess.check_output([sys.executable, '-c', code], 
+                                  cwd=os.path.dirname(os.path.abspath(startup.__file__)))
+    assert out.decode().strip() == '[]'
+
+
+def test_unknown_forecast_model():
+    assert 'GFS' in FORECAST_MODELS
+    with pytest.raises(ValueError):
+        get_forecast_model('ECMWF')
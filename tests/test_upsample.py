@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from pvlib import clearsky
+from pvlib.location import Location
+
+from upsample import monthly_linke_turbidity, upsample_arrays, upsample_weather
+from weathercache import LocalForecastSource
+
+from conftest import LATITUDE, LONGITUDE
+
+
+LOCATION = Location(LATITUDE, LONGITUDE, tz='US/Mountain')
+
+
+def coarse_weather(start='2021-06-01', days=2):
+    start = pd.Timestamp(start, tz=LOCATION.tz)
+    end = start + pd.Timedelta(days=days)
+    return LocalForecastSource('GFS').get_processed_data(LATITUDE, LONGITUDE, start, end)
+
+
+def test_monthly_turbidity_is_indexed_by_month():
+    turbidity = monthly_linke_turbidity(LATITUDE, LONGITUDE)
+    for month in (1, 6, 12):
+        time = pd.DatetimeIndex([pd.Timestamp(2021, month, 10, 12)], tz='UTC')
+        want = clearsky.lookup_linke_turbidity(time, LATITUDE, LONGITUDE, interp_turbidity=False)
+        assert turbidity[month - 1] == want.iloc[0]
+    assert turbidity[0] != turbidity[5]
+
+
+def test_forecast_values_are_kept_at_their_times():
+    data = coarse_weather()
+    fine = upsample_weather(data, LOCATION, '15min')
+    assert fine.index.freq == '15min' and list(fine.columns) == list(data.columns)
+    pd.testing.assert_frame_equal(fine.loc[data.index], data, check_freq=False)
+    assert (fine[['ghi', 'dni', 'dhi']] >= 0).all().all()
+
+
+def test_missing_values_are_not_filled_in():
+    data = coarse_weather()
+    noon = data.index[(data.index.hour == 12)][0]
+    data.loc[noon, ['ghi', 'dni', 'temp_air']] = np.nan
+    fine = upsample_weather(data, LOCATION, '15min')
+    step = pd.Timedelta(hours=3)
+    around = (fine.index > noon - step) & (fine.index < noon + step)
+    assert fine.loc[around, ['ghi', 'dni', 'temp_air']].isna().all().all()
+    assert fine.loc[~around, ['ghi', 'dni', 'temp_air']].notna().all().all()
+    assert fine.loc[around, 'dhi'].notna().all()
+    # the same for the fleet arrays
+    weather = {col: np.stack([data[col].to_numpy(), data[col].fillna(0).to_numpy()])
+               for col in ['ghi', 'temp_air']}
+    time, out = upsample_arrays(data.index, weather, [LATITUDE] * 2, [LONGITUDE] * 2, '15min')
+    assert time.equals(fine.index)
+    np.testing.assert_array_equal(np.isnan(out['ghi'][0]), around)
+    assert not np.isnan(out['ghi'][1]).any()
+
+
+def test_clear_day_shape_is_recovered():
+    # 3-hourly samples of a clear day upsampled to 15 minutes follow the
+    # clear-sky curve much closer than linear interpolation, with about the
+    # same daily energy.
+    time = pd.date_range('2021-06-01', '2021-06-02', freq='15min', tz=LOCATION.tz)
+    truth = LOCATION.get_clearsky(time, model='ineichen')[['ghi', 'dni', 'dhi']]
+    coarse = truth[time.hour % 3 == 0].iloc[::4]
+    fine = upsample_weather(coarse, LOCATION, '15min')
+    linear = coarse.reindex(time).interpolate(method='time')
+    for col in ['ghi', 'dni', 'dhi']:
+        rmse = np.sqrt(((fine[col] - truth[col]) ** 2).mean())
+        assert rmse < 0.25 * np.sqrt(((linear[col] - truth[col]) ** 2).mean())
+        assert abs(fine[col].sum() / truth[col].sum() - 1) < 0.03
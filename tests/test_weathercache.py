@@ -0,0 +1,97 @@
+import os
+
+import pandas as pd
+
+from weathercache import LocalForecastSource, WeatherCache, WeatherFetchError, cycle_expiry, latest_cycle
+
+import pytest
+
+
+NOW = pd.Timestamp('2026-10-18 12:00', tz='UTC')
+START = pd.Timestamp('2026-10-18', tz='US/Mountain')
+END = START + pd.Timedelta(days=2)
+
+
+def test_hit_after_miss():
+    src = LocalForecastSource('GFS')
+    cache = WeatherCache()
+    first = cache.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    second = cache.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    assert src.calls == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    pd.testing.assert_frame_equal(first, second)
+    # fm is set up as if it had been queried
+    assert list(src.time) == list(second.index)
+
+
+def test_same_grid_cell_hits():
+    src = LocalForecastSource('GFS')
+    cache = WeatherCache()
+    cache.get(src, 39.6, -105.1, START, END, now=NOW)
+    cache.get(src, 39.65, -105.2, START, END, now=NOW)
+    assert src.calls == 1
+
+
+def test_entry_expires_with_the_next_cycle():
+    src = LocalForecastSource('GFS')
+    cache = WeatherCache()
+    cache.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    expiry = cycle_expiry(src, latest_cycle(src, NOW))
+    cache.get(src, 39.7423, -105.1785, START, END, now=expiry - pd.Timedelta(minutes=1))
+    assert src.calls == 1
+    cache.get(src, 39.7423, -105.1785, START, END, now=expiry)
+    assert src.calls == 2
+
+
+def test_disk_tier_shared_between_caches(tmp_path):
+    src = LocalForecastSource('GFS')
+    WeatherCache(cache_dir=str(tmp_path)).get(src, 39.7423, -105.1785, START, END, now=NOW)
+    other = WeatherCache(cache_dir=str(tmp_path))
+    other.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    assert src.calls == 1
+    assert other.stats()['disk_hits'] == 1
+
+
+@pytest.mark.parametrize('junk', [b'', b'not a pickle', b'\x80\x04K\x05.'])
+def test_unreadable_disk_entry_is_a_miss(tmp_path, junk):
+    src = LocalForecastSource('GFS')
+    WeatherCache(cache_dir=str(tmp_path)).get(src, 39.7423, -105.1785, START, END, now=NOW)
+    path, = [os.path.join(str(tmp_path), name) for name in os.listdir(str(tmp_path))]
+    with open(path, 'wb') as f:
+        f.write(junk)
+    cache = WeatherCache(cache_dir=str(tmp_path))
+    data = cache.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    assert src.calls == 2 and len(data)
+    # the broken file was replaced by the new pull
+    assert pd.read_pickle(path)[1].equals(data)
+
+
+def test_failed_pull_raises_weather_fetch_error():
+    src = LocalForecastSource('GFS')
+
+    def fail(*args, **kwargs):
+        raise OSError('connection refused')
+
+    src.get_processed_data = fail
+    with pytest.raises(WeatherFetchError):
+        WeatherCache().get(src, 39.7423, -105.1785, START, END, now=NOW)
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='needs uids')
+def test_disk_tier_only_reads_private_files(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    os.chmod(str(shared), 0o777)
+    assert WeatherCache(cache_dir=str(shared)).cache_dir != str(shared)
+
+    src = LocalForecastSource('GFS')
+    cache = WeatherCache(cache_dir=str(tmp_path / 'cache'))
+    cache.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    path, = [os.path.join(cache.cache_dir, name) for name in os.listdir(cache.cache_dir)]
+    # an entry that is a link to some other file is not unpickled
+    planted = tmp_path / 'planted.pkl'
+    os.replace(path, str(planted))
+    os.symlink(str(planted), path)
+    other = WeatherCache(cache_dir=cache.cache_dir)
+    other.get(src, 39.7423, -105.1785, START, END, now=NOW)
+    assert other.stats()['disk_hits'] == 0 and src.calls == 2
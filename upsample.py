@@ -0,0 +1,181 @@
+# Temporal upsampling of coarse NWP weather through the clear-sky index.
+#
+# GFS has 3-hourly points; linear interpolation of irradiance between them
+# cuts off the sunrise/sunset shape and shifts the peak. Instead GHI, DNI and
+# DHI are divided by clear-sky irradiance at the forecast times, the
+# resulting clear-sky indices are interpolated to the finer times (night
+# values carry the nearest daytime index) and multiplied by clear-sky
+# irradiance at the fine times. Where that does not give back the forecast
+# value at a forecast time (clipped indices, twilight below CLEARSKY_MIN) the
+# misfit is interpolated linearly and added, and the forecast values are
+# kept as they were at their own times. Other columns (temp_air,
+# wind_speed, clouds) are interpolated linearly. Missing (NaN) forecast
+# values are not filled in: the fine steps on either side of one are NaN.
+#
+# Everything works on (n_sites, n_times) arrays: interpolation weights depend
+# only on the time grids and are computed once for all sites, and clear-sky
+# irradiance (Ineichen, with monthly Linke turbidity looked up once per
+# location) comes from vectorized solar positions (fleet.fleet_solpos).
+# Single-site clear-sky profiles are cached, since the same site and window
+# are requested again on every dashboard run.
+#
+#     forecast_data = upsample_weather(forecast_data, fm.location, '15min')
+#     fm.time = forecast_data.index
+
+import collections
+import threading
+
+import numpy as np
+import pandas as pd
+from pvlib import atmosphere, clearsky, irradiance
+
+from fleet import fleet_solpos
+
+
+IRRADIANCE_COLUMNS = ['ghi', 'dni', 'dhi']
+# Clear-sky GHI (W/m^2) below which the clear-sky index is not computed.
+CLEARSKY_MIN = 20.
+# Upper bounds of the clear-sky indices (diffuse can exceed clear-sky
+# diffuse by far under broken clouds).
+MAX_INDEX = {'ghi': 1.5, 'dni': 1.5, 'dhi': 5.}
+PROFILE_CACHE_SIZE = 256
+
+_turbidity = {}
+_profiles = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def monthly_linke_turbidity(latitude, longitude):
+    # Linke turbidity of the 12 months at a location (cached).
+    key = (round(float(latitude), 2), round(float(longitude), 2))
+    if key not in _turbidity:
+        months = pd.date_range('2020-01-01', periods=12, freq='MS') + pd.Timedelta(days=14)
+        _turbidity[key] = np.asarray(clearsky.lookup_linke_turbidity(months, latitude, longitude,
+                                                                     interp_turbidity=False), dtype=float)
+    return _turbidity[key]
+
+
+def clearsky_arrays(time, latitude, longitude):
+    # Ineichen clear-sky {'ghi', 'dni', 'dhi'} as (n_sites, n_times) arrays;
+    # latitude/longitude are (n_sites, 1).
+    latitude = np.asarray(latitude, dtype=float).reshape(-1, 1)
+    longitude = np.asarray(longitude, dtype=float).reshape(-1, 1)
+    solpos = fleet_solpos(time, latitude, longitude)
+    airmass = atmosphere.get_absolute_airmass(atmosphere.get_relative_airmass(solpos['apparent_zenith']))
+    turbidity = np.stack([monthly_linke_turbidity(lat, lon)
+                          for lat, lon in zip(latitude[:, 0], longitude[:, 0])])[:, time.month - 1]
+    dni_extra = np.asarray(irradiance.get_extra_radiation(time), dtype=float)[None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cs = clearsky.ineichen(solpos['apparent_zenith'], airmass, turbidity, altitude=0, dni_extra=dni_extra)
+    return {col: np.nan_to_num(np.asarray(cs[col], dtype=float)) for col in IRRADIANCE_COLUMNS}
+
+
+def clearsky_profile(time, latitude, longitude):
+    # clearsky_arrays of one site as 1-D arrays, cached per site and time grid.
+    key = (round(float(latitude), 4), round(float(longitude), 4), time[0].value, time[-1].value, len(time))
+    with _lock:
+        profile = _profiles.get(key)
+        if profile is not None:
+            _profiles.move_to_end(key)
+            return profile
+    profile = {col: values[0] for col, values in clearsky_arrays(time, [latitude], [longitude]).items()}
+    with _lock:
+        _profiles[key] = profile
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def interpolation_weights(coarse, fine):
+    # (i0, i1, w) such that values at fine = (1 - w) * v[i0] + w * v[i1].
+    x = np.asarray(coarse.asi8, dtype=float)
+    xi = np.clip(np.asarray(fine.asi8, dtype=float), x[0], x[-1])
+    i1 = np.clip(np.searchsorted(x, xi, side='right'), 1, len(x) - 1)
+    i0 = i1 - 1
+    w = (xi - x[i0]) / (x[i1] - x[i0])
+    return i0, i1, w
+
+
+def interpolate(values, weights):
+    # Fine steps next to a missing (NaN) coarse value are NaN, the others
+    # are interpolated between their two coarse neighbours.
+    i0, i1, w = weights
+    missing = np.isnan(values)
+    if not missing.any():
+        return values[..., i0] * (1 - w) + values[..., i1] * w
+    values = np.where(missing, 0., values)
+    out = values[..., i0] * (1 - w) + values[..., i1] * w
+    out[(missing[..., i0] & (w < 1)) | (missing[..., i1] & (w > 0))] = np.nan
+    return out
+
+
+def clear_sky_index(values, clear, max_index):
+    # values / clear where the sun is up; other timesteps take the index of
+    # the nearest daytime step before (or else after) them.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        index = np.where(clear >= CLEARSKY_MIN, np.clip(values / clear, 0, max_index), np.nan)
+    filled = pd.DataFrame(np.atleast_2d(index).T).ffill().bfill().fillna(1.)
+    return filled.to_numpy().T.reshape(index.shape)
+
+
+def sample_positions(coarse, fine):
+    # (positions in coarse, positions in fine) of the coarse times that are
+    # on the fine grid.
+    fine_pos = fine.get_indexer(coarse)
+    coarse_pos = np.flatnonzero(fine_pos >= 0)
+    return coarse_pos, fine_pos[coarse_pos]
+
+
+def upsample_irradiance(values, clear_coarse, clear_fine, max_index, weights, samples):
+    # values (n_sites, n_coarse) on the fine grid through the clear-sky
+    # index, reproducing values at the coarse times (see the header). Fine
+    # steps next to a missing coarse value are missing as well.
+    index = clear_sky_index(values, clear_coarse, max_index)
+    misfit = values - index * clear_coarse
+    fine = np.maximum(interpolate(index, weights) * clear_fine + interpolate(misfit, weights), 0)
+    coarse_pos, fine_pos = samples
+    fine[..., fine_pos] = values[..., coarse_pos]
+    return fine
+
+
+def upsample_arrays(coarse_time, weather, latitude, longitude, freq):
+    # (fine_time, {column: (n_sites, n_fine)}) from {column: (n_sites,
+    # n_coarse)}; all columns other than the irradiance are interpolated.
+    fine_time = pd.date_range(coarse_time[0], coarse_time[-1], freq=freq)
+    if len(coarse_time) < 2 or len(fine_time) <= len(coarse_time):
+        return coarse_time, weather
+    weights = interpolation_weights(coarse_time, fine_time)
+    samples = sample_positions(coarse_time, fine_time)
+    clear_coarse = clearsky_arrays(coarse_time, latitude, longitude)
+    clear_fine = clearsky_arrays(fine_time, latitude, longitude)
+    out = {}
+    for col, values in weather.items():
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        if col in IRRADIANCE_COLUMNS:
+            out[col] = upsample_irradiance(values, clear_coarse[col], clear_fine[col], MAX_INDEX[col],
+                                           weights, samples)
+        else:
+            out[col] = interpolate(values, weights)
+    return fine_time, out
+
+
+def upsample_weather(forecast_data, location, freq):
+    # forecast_data of one site (as returned by get_weather_data) on a `freq`
+    # grid; location is fm.location.
+    coarse_time = forecast_data.index
+    fine_time = pd.date_range(coarse_time[0], coarse_time[-1], freq=freq)
+    if len(coarse_time) < 2 or len(fine_time) <= len(coarse_time):
+        return forecast_data
+    weights = interpolation_weights(coarse_time, fine_time)
+    samples = sample_positions(coarse_time, fine_time)
+    clear_coarse = clearsky_profile(coarse_time, location.latitude, location.longitude)
+    clear_fine = clearsky_profile(fine_time, location.latitude, location.longitude)
+    columns = {}
+    for col in forecast_data.columns:
+        values = forecast_data[col].to_numpy(dtype=float)
+        if col in IRRADIANCE_COLUMNS:
+            columns[col] = upsample_irradiance(values, clear_coarse[col], clear_fine[col], MAX_INDEX[col],
+                                               weights, samples)
+        else:
+            columns[col] = interpolate(values, weights)
+    return pd.DataFrame(columns, index=fine_time)[list(forecast_data.columns)]
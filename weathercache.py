@@ -0,0 +1,295 @@
+# Cache for processed NWP weather pulls.
+#
+# fm.get_processed_data is a remote NCSS query against the Unidata THREDDS
+# server. The data it returns only changes when the model publishes a new
+# cycle, and every point inside one model grid cell gets the same grid values,
+# so pulls are cached under
+#     (model, model cycle init time, snapped grid cell, start, end)
+# and an entry expires as soon as the next cycle of that model is expected to
+# be available. Entries are kept in memory and, optionally, as pickles on local
+# disk so other gunicorn workers can reuse them (WEATHER_CACHE_DIR, a private
+# directory checked like the job spool, see jobs.spool_dir; only files owned
+# by this user are unpickled). A failed pull (network error, THREDDS error
+# response) is raised as WeatherFetchError.
+#
+# LocalForecastSource is an offline stand-in for the pvlib forecast models that
+# serves recorded or synthetic data, so the cache (and the rest of the
+# pipeline) can be exercised without network access.
+
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from jobs import owned_file, spool_dir
+
+# Release cadence and approximate grid spacing of the pvlib forecast models:
+# * cycle_hours - hours between model runs
+# * delay_hours - hours after the init time until a run is on the server
+# * grid_deg    - grid spacing in degrees used to snap request points
+MODEL_CADENCE = {
+    'GFS':  {'cycle_hours': 6, 'delay_hours': 5, 'grid_deg': 0.5},
+    'NAM':  {'cycle_hours': 6, 'delay_hours': 2, 'grid_deg': 0.11},   # 12 km
+    'NDFD': {'cycle_hours': 1, 'delay_hours': 1, 'grid_deg': 0.025},  # 2.5 km
+    'RAP':  {'cycle_hours': 1, 'delay_hours': 1, 'grid_deg': 0.18},   # 20 km
+    'HRRR': {'cycle_hours': 1, 'delay_hours': 1, 'grid_deg': 0.03},   # 3 km
+}
+DEFAULT_CADENCE = {'cycle_hours': 1, 'delay_hours': 0, 'grid_deg': 0.01}
+
+WEATHER_CACHE_DIR = os.environ.get('WEATHER_CACHE_DIR')
+
+
+class WeatherFetchError(Exception):
+    # The forecast model could not be queried; the original exception is the
+    # __cause__.
+    pass
+
+
+def model_name(fm):
+    # Name of a forecast model given as a string ('GFS') or an instance.
+    if isinstance(fm, str):
+        return fm
+    return getattr(fm, 'cache_name', type(fm).__name__)
+
+
+def model_cadence(fm):
+    return MODEL_CADENCE.get(model_name(fm), DEFAULT_CADENCE)
+
+
+def _utcnow():
+    return pd.Timestamp.now(tz='UTC')
+
+
+def latest_cycle(fm, now=None):
+    # Init time (UTC) of the newest model run expected to be on the server.
+    cadence = model_cadence(fm)
+    now = _utcnow() if now is None else pd.Timestamp(now).tz_convert('UTC')
+    available = now - pd.Timedelta(hours=cadence['delay_hours'])
+    return available.floor('{}h'.format(cadence['cycle_hours']))
+
+
+def cycle_expiry(fm, cycle):
+    # Time (UTC) at which the run after `cycle` is expected to be available.
+    cadence = model_cadence(fm)
+    return cycle + pd.Timedelta(hours=cadence['cycle_hours'] + cadence['delay_hours'])
+
+
+def snap_to_grid(fm, latitude, longitude):
+    # Centre of the model grid cell containing the point.
+    step = model_cadence(fm)['grid_deg']
+    return (round(round(latitude / step) * step, 6),
+            round(round(longitude / step) * step, 6))
+
+
+def weather_key(fm, latitude, longitude, start, end, cycle):
+    lat, lon = snap_to_grid(fm, latitude, longitude)
+    return (model_name(fm), cycle.isoformat(), lat, lon,
+            pd.Timestamp(start).isoformat(), pd.Timestamp(end).isoformat())
+
+
+class WeatherCache(object):
+    # In-memory LRU of processed forecast frames with an optional disk tier.
+
+    def __init__(self, cache_dir=WEATHER_CACHE_DIR, max_entries=256):
+        self.cache_dir = spool_dir(cache_dir) if cache_dir else cache_dir
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()    # key -> (expires, data)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, fm, latitude, longitude, start, end, now=None):
+        # Same contract as fm.get_processed_data(latitude, longitude, start,
+        # end): returns the processed frame and leaves fm.location/fm.time set.
+        now = _utcnow() if now is None else pd.Timestamp(now).tz_convert('UTC')
+        cycle = latest_cycle(fm, now)
+        key = weather_key(fm, latitude, longitude, start, end, cycle)
+        data = self._get_memory(key, now)
+        if data is None:
+            data = self._get_disk(key, now)
+            if data is not None:
+                self._put_memory(key, cycle_expiry(fm, cycle), data)
+        if data is not None:
+            # fm was not queried, set what get_data would have set.
+            fm.set_location(pd.Timestamp(start).tz, latitude, longitude)
+            fm.time = data.index
+            return data.copy()
+
+        with self._lock:
+            self.misses += 1
+        with metrics.timer('nwp_fetch'):
+            try:
+                data = fm.get_processed_data(latitude, longitude, start, end)
+            except Exception as exc:
+                raise WeatherFetchError('{} pull failed: {}: {}'.format(
+                    model_name(fm), type(exc).__name__, exc)) from exc
+        # Size of the processed frame; the raw NCSS response is not exposed by pvlib.
+        metrics.count('nwp_bytes_fetched', int(data.memory_usage(index=True).sum()))
+        metrics.count('nwp_rows_fetched', len(data))
+        expires = cycle_expiry(fm, cycle)
+        self._put_memory(key, expires, data)
+        self._put_disk(key, expires, data)
+        return data.copy()
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def _put_memory(self, key, expires, data):
+        with self._lock:
+            self._entries[key] = (expires, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, '{}-{}.pkl'.format(key[0], digest))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read_disk(self, path):
+        # (expires, data) of a disk entry, or None. An entry that cannot be
+        # loaded (truncated, written by another pandas version, ...) is
+        # treated as a miss and removed; files of other users are skipped.
+        if not owned_file(path):
+            return None
+        try:
+            expires, data = pd.read_pickle(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self._remove(path)
+            return None
+        return expires, data
+
+    def _get_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        entry = self._read_disk(path)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires <= now:
+            self._remove(path)
+            return None
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return data
+
+    def _put_disk(self, key, expires, data):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            pd.to_pickle((expires, data), tmp)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def purge(self, now=None):
+        # Drop expired entries from memory and disk.
+        now = _utcnow() if now is None else pd.Timestamp(now).tz_convert('UTC')
+        with self._lock:
+            for key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[key]
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for fname in os.listdir(self.cache_dir):
+                if fname.endswith('.pkl'):
+                    path = os.path.join(self.cache_dir, fname)
+                    entry = self._read_disk(path)
+                    if entry is not None and entry[0] <= now:
+                        self._remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'entries': len(self._entries)}
+
+
+class LocalForecastSource(object):
+    # Offline stand-in for a pvlib forecast model (GFS(), HRRR(), ...).
+    #
+    # With `data` (a processed frame, e.g. a recorded get_processed_data
+    # result) the requested window is sliced out of it; without it synthetic
+    # weather is generated from a clear-sky model and a deterministic cloud
+    # pattern seeded by the location. `calls` counts the simulated pulls.
+
+    output_variables = ['temp_air', 'wind_speed', 'ghi', 'dni', 'dhi',
+                        'total_clouds', 'low_clouds', 'mid_clouds', 'high_clouds']
+
+    def __init__(self, model='GFS', data=None, freq=None):
+        self.cache_name = model
+        self.model_name = model
+        self.data = data
+        self.freq = freq or ('3h' if model == 'GFS' else '1h')
+        self.calls = 0
+
+    def __repr__(self):
+        return 'LocalForecastSource({})'.format(self.model_name)
+
+    def set_location(self, tz, latitude, longitude):
+        from pvlib.location import Location
+        self.location = Location(latitude, longitude, tz=tz)
+
+    def get_processed_data(self, latitude, longitude, start, end, **kwargs):
+        self.calls += 1
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        self.set_location(start.tz, latitude, longitude)
+        if self.data is not None:
+            data = self.data.tz_convert(self.location.tz).sort_index().loc[start:end]
+        else:
+            data = self.synthetic_data(latitude, longitude, start, end)
+        self.time = data.index
+        return data
+
+    def synthetic_data(self, latitude, longitude, start, end):
+        from pvlib import irradiance
+        time = pd.date_range(start.ceil(self.freq), end, freq=self.freq)
+        seed = int(abs(latitude * 1000) + abs(longitude * 10)) % (2 ** 32)
+        rng = np.random.RandomState(seed)
+        clouds = np.clip(rng.normal(30, 30, len(time)), 0, 100)
+        solpos = self.location.get_solarposition(time)
+        ghi_clear = self.location.get_clearsky(time, model='haurwitz',
+                                               solar_position=solpos)['ghi']
+        ghi = ghi_clear * (1 - 0.75 * (clouds / 100) ** 3.4)
+        dni_dhi = irradiance.erbs(ghi, solpos['zenith'], time)
+        hours = (time.hour + time.minute / 60.).values
+        temp_air = 20 + 8 * np.sin((hours - 9) / 24. * 2 * np.pi) - 0.05 * abs(latitude)
+        data = pd.DataFrame({'temp_air': temp_air,
+                             'wind_speed': np.abs(rng.normal(3, 1.5, len(time))),
+                             'ghi': ghi,
+                             'dni': dni_dhi['dni'],
+                             'dhi': dni_dhi['dhi'],
+                             'total_clouds': clouds,
+                             'low_clouds': clouds * 0.5,
+                             'mid_clouds': clouds * 0.3,
+                             'high_clouds': clouds * 0.2}, index=time)
+        return data[self.output_variables]